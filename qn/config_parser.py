@@ -2,8 +2,8 @@
 
 import os
 import sys
-import configargparse
-from subprocess import PIPE, call
+import pickle
+import qn.tools as tools
 
 # Globals
 # _TAGF_PATH = os.path.join(_QNDATA, 'tags.pickle')
@@ -11,6 +11,11 @@ _XDG_CONFIG_HOME = os.environ.get('XDG_CONFIG_HOME')
 _DEFAULT_QNDIR = '~/qn/'
 _FALLBACK_TERMINAL = 'xterm'
 _FALLBACK_EDITOR = 'vi'
+_DEFAULT_SCAN_WORKERS = 1
+_DEFAULT_MAX_RESULTS = 0
+_COMPILED_VERSION = 1
+# Environment the parsed options depend on, besides PATH (see tools).
+_COMPILED_ENV = ('HOME', 'XDG_CONFIG_HOME')
 
 _IMPLEMENTED_APPS = ('rofi', 'fzf')
 _SORT_OPTS = ('cdate', 'mdate', 'name', 'size')
@@ -68,9 +73,19 @@ _DEFAULT_HOTKEYS['fzf'] = {
   }
 
 
+def compiled_config_path(app=None):
+    """Path of the compiled options of QnOptions.load_config, in qn's cache
+    dir."""
+    cache_home = os.environ.get('XDG_CACHE_HOME')
+    if not cache_home:
+        cache_home = os.path.expanduser('~/.cache')
+    return(os.path.join(cache_home, 'qn', 'config-' + str(app) + '.pickle'))
+
+
 def cmd_exists(cmd):
-    """Check if a program exists in PATH. Linux only."""
-    return(call("type " + cmd, shell=True, stdout=PIPE, stderr=PIPE) == 0)
+    """Check if a program exists in PATH. Lookups are cached in the qn data
+    dir, see tools."""
+    return(tools.cmd_exists(cmd))
 
 
 class QnOptions():
@@ -110,10 +125,15 @@ class QnOptions():
         self.__options['command_extra'] = None
         self.__options['interactive'] = None
         self.__options['hotkeys'] = None
+        self.__options['scan_workers'] = None
+        self.__options['stream'] = None
+        self.__options['max_results'] = None
+        self.__options['summary'] = None
+        self.__options['fzf_session'] = None
 
         if run_parse_config:
             self.configure_defaults()
-            self.parse_config()
+            self.load_config()
         else:
             self.configure_defaults()
 
@@ -160,6 +180,12 @@ class QnOptions():
 
         self.__options['hotkeys'] = _DEFAULT_HOTKEYS[self.__app]
 
+        self.__options['scan_workers'] = _DEFAULT_SCAN_WORKERS
+        self.__options['stream'] = False
+        self.__options['max_results'] = _DEFAULT_MAX_RESULTS
+        self.__options['summary'] = False
+        self.__options['fzf_session'] = False
+
     @property
     def app(self):
         return(self.__app)
@@ -204,7 +230,7 @@ class QnOptions():
 
     @property
     def command(self):
-        command = self.__options['command']
+        command = list(self.__options['command'])
         if self.__options['command_extra']:
             command.extend(self.__options['command_extra'])
         return(command)
@@ -217,6 +243,26 @@ class QnOptions():
     def hotkeys(self):
         return(self.__options['hotkeys'])
 
+    @property
+    def scan_workers(self):
+        return(self.__options['scan_workers'])
+
+    @property
+    def stream(self):
+        return(self.__options['stream'])
+
+    @property
+    def max_results(self):
+        return(self.__options['max_results'])
+
+    @property
+    def summary(self):
+        return(self.__options['summary'])
+
+    @property
+    def fzf_session(self):
+        return(self.__options['fzf_session'])
+
     @property
     def qndir(self):
         return(self.__qndir)
@@ -253,6 +299,21 @@ class QnOptions():
     def set_interactive(self, interactive):
         self.__options['interactive'] = interactive
 
+    def set_scan_workers(self, scan_workers):
+        self.__options['scan_workers'] = scan_workers
+
+    def set_stream(self, stream):
+        self.__options['stream'] = stream
+
+    def set_max_results(self, max_results):
+        self.__options['max_results'] = max_results
+
+    def set_summary(self, summary):
+        self.__options['summary'] = summary
+
+    def set_fzf_session(self, fzf_session):
+        self.__options['fzf_session'] = fzf_session
+
     def print_options(self):
         """Print options list. Usually for debugging."""
         print("Interface App   =", self.__app)
@@ -272,6 +333,11 @@ class QnOptions():
         print("sortrev         =", self.sortrev)
         print("selected_row    =", self.selected_row)
         print("filter          =", self.filter)
+        print("scan_workers    =", self.scan_workers)
+        print("stream          =", self.stream)
+        print("max_results     =", self.max_results)
+        print("summary         =", self.summary)
+        print("fzf_session     =", self.fzf_session)
         print()
         print("command         =", self.__options['command'])
         print("command_extra   =", self.__options['command_extra'])
@@ -282,12 +348,98 @@ class QnOptions():
         for key, value in self.__options['hotkeys'].items():
             print("    " + str(key).ljust(12) + "" + str(value))
 
+    def __config_path(self):
+        """Path of the config file parse_config reads."""
+        argv = sys.argv[1:]
+        for n, arg in enumerate(argv):
+            if arg in ('-c', '--config') and n + 1 < len(argv):
+                return(os.path.abspath(argv[n + 1]))
+            if arg.startswith('--config='):
+                return(os.path.abspath(arg[len('--config='):]))
+        default_config_path = os.path.expanduser(_DEFAULT_CONFIG)
+        if not os.path.isfile(default_config_path):
+            default_config_path = os.path.abspath('/etc/qn/config.example')
+        return(default_config_path)
+
+    def __config_files(self):
+        """Paths of every config file parse_config reads: configargparse
+        reads the default one even when others are given with -c."""
+        config_files = [os.path.expanduser(_DEFAULT_CONFIG)]
+        argv = sys.argv[1:]
+        for n, arg in enumerate(argv):
+            if arg in ('-c', '--config') and n + 1 < len(argv):
+                config_files.append(os.path.abspath(argv[n + 1]))
+            elif arg.startswith('--config='):
+                config_files.append(os.path.abspath(arg[len('--config='):]))
+        return(config_files)
+
+    def __compiled_key(self):
+        """What the parsed options depend on: the command line, the config
+        files and the environment."""
+        config_mtimes = []
+        for config_file in self.__config_files():
+            try:
+                config_mtimes.append((config_file,
+                                      os.stat(config_file).st_mtime_ns))
+            except OSError:
+                config_mtimes.append((config_file, None))
+        return((self.__force_app, self.__qndir, self.config_file_only,
+                tuple(sys.argv[1:]),
+                tuple(os.environ.get(name) for name in _COMPILED_ENV),
+                tuple(config_mtimes),
+                tools.path_key(self.__config_path())))
+
+    def load_config(self):
+        """Set the options from the config file and command line arguments,
+        like parse_config, but from a compiled copy of them when neither
+        those nor the environment changed since the last parse. The copy is
+        kept in qn's cache dir, as the notes dir holding .qn is one of the
+        options."""
+        compiled_path = compiled_config_path(self.__force_app)
+        key = self.__compiled_key()
+        try:
+            with open(compiled_path, 'rb') as compiled_file:
+                data = pickle.load(compiled_file)
+        except Exception:
+            data = None
+        if (isinstance(data, dict) and
+                data.get('version') == _COMPILED_VERSION and
+                data.get('key') == key):
+            self.__app = data['app']
+            self.__qndir = data['qndir']
+            self.__qndata = data['qndata']
+            self.__qntrash = data['qntrash']
+            self.__options = data['options']
+            tools.use_cache(self.__qndata, self.__config_path())
+            return
+
+        self.parse_config()
+        data = {'version': _COMPILED_VERSION,
+                'key': key,
+                'app': self.__app,
+                'qndir': self.__qndir,
+                'qndata': self.__qndata,
+                'qntrash': self.__qntrash,
+                'options': self.__options}
+        tmp_path = compiled_path + '.tmp'
+        try:
+            os.makedirs(os.path.dirname(compiled_path), exist_ok=True)
+            with open(tmp_path, 'wb') as compiled_file:
+                pickle.dump(data, compiled_file, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, compiled_path)
+        except OSError:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
     def parse_config(self, argv=None):
         """Parse config file and command line arguments."""
         default_config_path = os.path.expanduser(_DEFAULT_CONFIG)
         if not os.path.isfile(default_config_path):
             default_config_path = os.path.abspath('/etc/qn/config.example')
         config_used = None
+        import configargparse
 
 #        options = argument_parser()
 
@@ -309,6 +461,21 @@ class QnOptions():
         p.add('--sorttype', default='cdate',
               help='type of default sorting (cdate, mdate, name, size)')
         p.add('--sortrev', default=False, help='reverse sorting (True/False)')
+        p.add('--scan-workers', default=_DEFAULT_SCAN_WORKERS,
+              help='number of threads used to scan the qn directory. Values' +
+              ' above 1 help on network or FUSE mounts (default 1)')
+        p.add('--stream', default=False,
+              help='show notes in the launcher while the qn directory is' +
+              ' still being scanned, unsorted at first (True/False)')
+        p.add('--max-results', default=_DEFAULT_MAX_RESULTS,
+              help='number of best matches shown for a search, 0 shows' +
+              ' every match (default 0)')
+        p.add('--summary', default=False,
+              help='show the first heading or line of each note next to' +
+              ' its name (True/False)')
+        p.add('--fzf-session', default=False,
+              help='keep a single fzf open and switch views inside it,' +
+              ' needs fzf 0.56 or later (True/False)')
         p.add('--rofi-settings', default=False,
               help="rofi settings to append. Format as: '-width 1 -lines 15'" +
                    ", surround by '( )' if using command line argument" +
@@ -383,6 +550,7 @@ class QnOptions():
         self.__qndir = os.path.expanduser(options.qndir)
         self.__qndata = os.path.join(self.__qndir, '.qn')
         self.__qntrash = os.path.join(self.__qndata, 'trash')
+        tools.use_cache(self.__qndata, self.__config_path())
 
         command_extra = False
         keybindings_extra = False
@@ -459,6 +627,33 @@ class QnOptions():
 
         self.__options['sortrev'] = (options.sortrev == 'True')
 
+        try:
+            scan_workers = int(options.scan_workers)
+        except ValueError:
+            scan_workers = 0
+        if scan_workers < 1:
+            print("WARNING with config '" + config_used + "': scan-workers " +
+                  "option, " + str(options.scan_workers) + " is not valid." +
+                  " Using " + str(_DEFAULT_SCAN_WORKERS))
+            scan_workers = _DEFAULT_SCAN_WORKERS
+        self.__options['scan_workers'] = scan_workers
+
+        self.__options['stream'] = (options.stream == 'True')
+
+        try:
+            max_results = int(options.max_results)
+        except ValueError:
+            max_results = -1
+        if max_results < 0:
+            print("WARNING with config '" + config_used + "': max-results " +
+                  "option, " + str(options.max_results) + " is not valid." +
+                  " Using " + str(_DEFAULT_MAX_RESULTS))
+            max_results = _DEFAULT_MAX_RESULTS
+        self.__options['max_results'] = max_results
+
+        self.__options['summary'] = (options.summary == 'True')
+        self.__options['fzf_session'] = (options.fzf_session == 'True')
+
     def check_environment(self):
         """Check environment to make sure that everything needed for qn is
         there.
@@ -0,0 +1,259 @@
+"""Search the contents of notes for a list of query strings"""
+
+import mmap
+import multiprocessing
+import re
+import threading
+from os import cpu_count, fsencode, fsdecode
+from shutil import which
+from subprocess import Popen, PIPE, DEVNULL
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+# Below this many files, starting worker processes costs more than it saves.
+_PARALLEL_MIN_FILES = 1000
+_CHUNKS_PER_WORKER = 4
+# Bytes of file paths passed to a single grep process. Far below ARG_MAX,
+# so that the environment and grep's own arguments always fit too.
+_BATCH_BYTES = 128 * 1024
+# Characters that are special somewhere in a grep basic regular expression.
+_BRE_SPECIAL = set('\\.[]*^$')
+
+
+def match_line(filepath, queries_list):
+    """Check whether a file contains every query, case insensitive. Returns
+    the last line in which a query was found, or None if some query is
+    missing."""
+    match = None
+    queries_p = [qp.lower() for qp in queries_list]
+    try:
+        with open(filepath, 'r') as notefile:
+            for line in notefile:
+                line_lower = line.lower()
+                for qp in list(queries_p):
+                    if qp in line_lower:
+                        match = line
+                        queries_p.remove(qp)
+                if not queries_p:
+                    return(match)
+    except (OSError, UnicodeDecodeError):
+        return(None)
+    return(None)
+
+
+def compile_queries(queries_list):
+    """Compile queries for match_line_bytes. Returns None if some query is
+    not ASCII, since bytes patterns only ignore the case of ASCII letters."""
+    if not all(qp.isascii() for qp in queries_list):
+        return(None)
+    return([re.compile(re.escape(qp.encode('ascii')), re.IGNORECASE)
+            for qp in queries_list])
+
+
+def match_line_bytes(filepath, patterns):
+    """Same as match_line, but matches compiled queries directly against the
+    memory mapped bytes of the file, decoding only the line returned."""
+    try:
+        with open(filepath, 'rb') as notefile:
+            with mmap.mmap(notefile.fileno(), 0,
+                           access=mmap.ACCESS_READ) as data:
+                last = -1
+                for pattern in patterns:
+                    found = pattern.search(data)
+                    if found is None:
+                        return(None)
+                    last = max(last, found.start())
+                if last == -1:
+                    return(None)
+                start = data.rfind(b'\n', 0, last) + 1
+                end = data.find(b'\n', last)
+                end = len(data) if end == -1 else end + 1
+                return(data[start:end].decode('utf-8'))
+    except (OSError, ValueError, UnicodeDecodeError):
+        # ValueError: empty files can't be mapped.
+        return(None)
+
+
+def _search_chunk(filepaths, queries_list):
+    """Worker job: get (filepath, line) for each matching file."""
+    patterns = compile_queries(queries_list)
+    results = []
+    for fp in filepaths:
+        match = match_line_bytes(fp, patterns)
+        if match is not None:
+            results.append((fp, match))
+    return(results)
+
+
+def search_paths(filepaths, queries_list, workers=None):
+    """Search files for a list of queries, all of which must be found.
+
+    Keyword arguments:
+    filepaths -- list of paths of the files to search.
+    queries_list -- list of strings, matched case insensitive.
+    workers -- number of worker processes, or threads if other threads
+               are running, for large searches (default None, one per
+               core).
+
+    Returns:
+        list of (filepath, line) for each matching file, in the order of
+        filepaths, line being the last line in which a query was found.
+    """
+    if not queries_list:
+        return([])
+    patterns = compile_queries(queries_list)
+    if patterns is None:
+        results = []
+        for fp in filepaths:
+            match = match_line(fp, queries_list)
+            if match is not None:
+                results.append((fp, match))
+        return(results)
+
+    if workers is None:
+        workers = cpu_count() or 1
+    if workers < 2 or len(filepaths) < _PARALLEL_MIN_FILES:
+        return(_search_chunk(filepaths, queries_list))
+
+    nchunks = workers * _CHUNKS_PER_WORKER
+    size = -(-len(filepaths) // nchunks)
+    chunks = [filepaths[i:i + size] for i in range(0, len(filepaths), size)]
+    # Forking a process that runs other threads (qnd, the fzf session, the
+    # summary thread) is not safe, and the other start methods import the
+    # main script again in each worker, which starts the bin scripts over.
+    if threading.active_count() > 1:
+        executor = ThreadPoolExecutor(workers)
+    else:
+        executor = ProcessPoolExecutor(
+            workers, mp_context=multiprocessing.get_context('fork'))
+    with executor as pool:
+        results = []
+        for chunk_results in pool.map(_search_chunk, chunks,
+                                      [queries_list] * len(chunks)):
+            results.extend(chunk_results)
+    return(results)
+
+
+class GrepBackend:
+    """Search backend that runs grep. Patterns are grep basic regular
+    expressions, matched case insensitive, and binary files are skipped."""
+    name = 'grep'
+    executable = 'grep'
+
+    def available(self):
+        return(which(self.executable) is not None)
+
+    def supports(self, pattern):
+        """Whether the backend matches pattern with grep's semantics."""
+        return(True)
+
+    def command(self, pattern):
+        """Command line up to the file paths. It must print the first
+        matching line of each file as path, NUL, line."""
+        return([self.executable, '-H', '-Z', '-i', '-I', '-m', '1',
+                '-e', pattern, '--'])
+
+
+class RipgrepBackend(GrepBackend):
+    """Search backend that runs ripgrep. Its regex syntax is not grep's, so
+    it is only used for patterns without special characters, which are
+    searched as fixed strings."""
+    name = 'rg'
+    executable = 'rg'
+
+    def supports(self, pattern):
+        return(not _BRE_SPECIAL.intersection(pattern))
+
+    def command(self, pattern):
+        return([self.executable, '--no-config', '--with-filename', '--null',
+                '--no-heading', '--no-line-number', '--no-messages',
+                '--ignore-case', '--fixed-strings', '--max-count', '1',
+                '-e', pattern, '--'])
+
+
+BACKENDS = {'grep': GrepBackend, 'rg': RipgrepBackend}
+_PREFERRED_BACKENDS = ('rg', 'grep')
+
+
+def get_backend(pattern, name='auto'):
+    """Get the search backend to use for a pattern.
+
+    Keyword arguments:
+    pattern -- grep basic regular expression to search for.
+    name -- backend name in BACKENDS, or 'auto' to prefer ripgrep when it is
+            installed and supports the pattern (default 'auto').
+    """
+    if name != 'auto':
+        return(BACKENDS[name]())
+    for backend_name in _PREFERRED_BACKENDS:
+        backend = BACKENDS[backend_name]()
+        if backend.supports(pattern) and backend.available():
+            return(backend)
+    return(GrepBackend())
+
+
+def _batches(filepaths):
+    """Split file paths in batches that fit in a command line."""
+    batch = []
+    batch_bytes = 0
+    for fp in filepaths:
+        fp_bytes = len(fsencode(fp)) + 1
+        if batch and batch_bytes + fp_bytes > _BATCH_BYTES:
+            yield batch
+            batch = []
+            batch_bytes = 0
+        batch.append(fp)
+        batch_bytes += fp_bytes
+    if batch:
+        yield batch
+
+
+def _grep_batch(command, batch):
+    """Run the backend on a batch of files, parsing its output as it comes.
+    Returns a list of (filepath, line)."""
+    results = []
+    seen = set()
+    proc = Popen(command + batch, stdout=PIPE, stderr=DEVNULL)
+    for out_line in proc.stdout:
+        fp, sep, match = out_line.partition(b'\x00')
+        if not sep:
+            continue
+        fp = fsdecode(fp)
+        # The first match of each file is the one that is kept.
+        if fp in seen:
+            continue
+        seen.add(fp)
+        results.append((fp, match.rstrip(b'\n').decode('utf-8', 'replace')))
+    proc.stdout.close()
+    proc.wait()
+    return(results)
+
+
+def grep_paths(filepaths, pattern, backend='auto', workers=None):
+    """Search files for a pattern with an external search backend.
+
+    Keyword arguments:
+    filepaths -- list of paths of the files to search.
+    pattern -- grep basic regular expression, matched case insensitive.
+    backend -- backend name, see get_backend (default 'auto').
+    workers -- number of batches searched at the same time
+               (default None, one per core).
+
+    Returns:
+        list of (filepath, line) with the first matching line of each
+        matching file, in the order in which the backend reported them.
+    """
+    if not filepaths:
+        return([])
+    command = get_backend(pattern, backend).command(pattern)
+    batches = list(_batches(filepaths))
+    if workers is None:
+        workers = cpu_count() or 1
+    if len(batches) == 1 or workers < 2:
+        return([result for batch in batches
+                for result in _grep_batch(command, batch)])
+    with ThreadPoolExecutor(min(workers, len(batches))) as pool:
+        results = []
+        for batch_results in pool.map(_grep_batch, [command] * len(batches),
+                                      batches):
+            results.extend(batch_results)
+    return(results)
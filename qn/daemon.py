@@ -0,0 +1,317 @@
+"""qn daemon (qnd): keeps note repositories scanned and sorted in memory,
+current through inotify, and serves launcher input to qnr/qnf over a Unix
+socket."""
+
+import ctypes
+import ctypes.util
+import json
+import socketserver
+import threading
+from os import path, remove, read, close, fsencode, umask
+from select import select
+from struct import unpack_from, calcsize
+from sys import exit
+from time import monotonic
+
+import qn.qn as qn
+import qn.snapshot as snapshot
+import qn.search_index as search_index
+import qn.result_cache as result_cache
+import qn.summary as summary
+import qn.daemon_client as daemon_client
+
+# inotify constants, from <sys/inotify.h>
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+_WATCH_MASK = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+               IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF |
+               IN_ONLYDIR)
+_EVENT_HEADER = 'iIII'
+_EVENT_HEADER_SIZE = calcsize(_EVENT_HEADER)
+
+_SETTLE_TIME = 0.05   # quiet time after a burst of events before rescanning
+_POLL_INTERVAL = 2.0  # rescan interval of repositories that can't be watched
+
+
+class Inotify:
+    """Minimal ctypes binding to the Linux inotify API."""
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.__libc = libc
+        self.__fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.__fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, 'inotify_init1 failed')
+
+    def fileno(self):
+        return(self.__fd)
+
+    def add_watch(self, dirpath, mask=_WATCH_MASK):
+        wd = self.__libc.inotify_add_watch(self.__fd, fsencode(dirpath), mask)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, 'inotify_add_watch failed for ' + dirpath)
+        return(wd)
+
+    def read_events(self):
+        """Read pending events. Returns a list of (wd, mask, name)."""
+        events = []
+        try:
+            data = read(self.__fd, 65536)
+        except BlockingIOError:
+            return(events)
+        offset = 0
+        while offset + _EVENT_HEADER_SIZE <= len(data):
+            wd, mask, cookie, length = unpack_from(_EVENT_HEADER, data, offset)
+            offset += _EVENT_HEADER_SIZE
+            name = data[offset:offset + length].rstrip(b'\x00')
+            offset += length
+            events.append((wd, mask, name.decode('utf-8', 'surrogateescape')))
+        return(events)
+
+    def close(self):
+        close(self.__fd)
+
+
+class HotRepo:
+    """A FileRepo kept in memory by the daemon, with its rendered launcher
+    input cached until the repository changes."""
+    def __init__(self, root, snapshot_path=None, scan_workers=1,
+                 index_paths=None, cache_path=None, summary_path=None):
+        self.repo = qn.FileRepo(root, snapshot_path, scan_workers,
+                                index_paths, cache_path, summary_path)
+        self.watched = {}      # reldir -> wd
+        self.watching = False  # True if every directory is watched
+        self.dirty = set()     # entries changed since the last scan
+        self.stale = True
+        self.scanned_at = 0
+        self.renders = {}
+
+    def rescan(self):
+        for reldir in self.dirty:
+            self.repo.invalidate(reldir, save=False)
+        self.dirty = set()
+        self.repo.scan_files()
+        self.renders = {}
+        self.stale = False
+        self.scanned_at = monotonic()
+
+    def render(self, sorttype, sortrev, format_list):
+        """Get (count, names, lines) for a sort and line format, rendering
+        them only if the repository changed since the last request."""
+        key = (sorttype, sortrev, tuple(format_list or ()))
+        if key not in self.renders:
+            self.repo.sort(sorttype, sortrev)
+            names = self.repo.filenames()
+            lines = b''
+            if format_list:
+                lines = '\x00'.join(self.repo.lines(format_list))
+                lines = lines.encode('utf-8')
+            self.renders[key] = (len(names),
+                                 '\x00'.join(names).encode('utf-8'), lines)
+        return(self.renders[key])
+
+
+class QnDaemon:
+    """Class that holds the note repositories of a qn configuration and
+    answers requests from qnr/qnf.
+
+    Keyword arguments:
+    qnoptions -- QnOptions class.
+    sock_path -- path of the Unix socket (default
+                 daemon_client.socket_path()).
+    """
+    def __init__(self, qnoptions, sock_path=None):
+        self.__options = qnoptions
+        if sock_path is None:
+            sock_path = daemon_client.socket_path()
+        self.__sock_path = sock_path
+        self.__lock = threading.RLock()
+        self.__repos = {}   # root -> HotRepo
+        self.__watches = {}  # wd -> (HotRepo, reldir)
+        try:
+            self.__inotify = Inotify()
+        except (OSError, AttributeError):
+            print("inotify is not available, polling for changes.")
+            self.__inotify = None
+
+    def hot_repo(self, root):
+        """Get the HotRepo for a root directory, scanning it if needed."""
+        root = path.join(root, "")
+        with self.__lock:
+            hot = self.__repos.get(root)
+            if hot is None:
+                instance = 'default'
+                if root == path.join(self.__options.qntrash, ""):
+                    instance = 'trash'
+                snapshot_path = None
+                index_paths = None
+                cache_path = None
+                summary_path = None
+                if root in (path.join(self.__options.qndir, ""),
+                            path.join(self.__options.qntrash, "")):
+                    snapshot_path = snapshot.snapshot_path(
+                        self.__options.qndata, instance)
+                    index_paths = {}
+                    for kind in search_index.INDEX_KINDS:
+                        index_paths[kind] = search_index.index_path(
+                            self.__options.qndata, instance, kind)
+                    cache_path = result_cache.cache_path(
+                        self.__options.qndata, instance)
+                    summary_path = summary.cache_path(
+                        self.__options.qndata, instance)
+                hot = HotRepo(root, snapshot_path,
+                              self.__options.scan_workers, index_paths,
+                              cache_path, summary_path)
+                self.__repos[root] = hot
+            if hot.stale or (not hot.watching and
+                             monotonic() - hot.scanned_at > _POLL_INTERVAL):
+                hot.rescan()
+                self.__watch(hot)
+            return(hot)
+
+    def __watch(self, hot):
+        """Add watches for directories found by the last scan."""
+        if not self.__inotify:
+            return
+        hot.watching = True
+        for reldir in hot.repo.dirnames():
+            if reldir in hot.watched:
+                continue
+            try:
+                wd = self.__inotify.add_watch(hot.repo.root + reldir)
+            except OSError:
+                # Usually out of watches, fall back to polling.
+                hot.watching = False
+                continue
+            hot.watched[reldir] = wd
+            self.__watches[wd] = (hot, reldir)
+
+    def __handle_events(self, events):
+        for wd, mask, name in events:
+            if mask & IN_Q_OVERFLOW:
+                for hot in self.__repos.values():
+                    hot.stale = True
+                    hot.dirty.update(hot.watched)
+                continue
+            if wd not in self.__watches:
+                continue
+            hot, reldir = self.__watches[wd]
+            if mask & IN_IGNORED:
+                del self.__watches[wd]
+                hot.watched.pop(reldir, None)
+                continue
+            hot.stale = True
+            hot.dirty.add(reldir + name)
+
+    def watch_loop(self):
+        """Read inotify events, and rescan changed repositories once the
+        events settle."""
+        pending = False
+        while True:
+            timeout = _SETTLE_TIME if pending else None
+            ready = select([self.__inotify], [], [], timeout)[0]
+            with self.__lock:
+                if ready:
+                    self.__handle_events(self.__inotify.read_events())
+                    pending = True
+                    continue
+                for hot in self.__repos.values():
+                    if hot.stale:
+                        hot.rescan()
+                        self.__watch(hot)
+                pending = False
+
+    def handle_request(self, message):
+        """Answer a request. Returns (header, payload)."""
+        op = message.get('op')
+        if op == 'ping':
+            return({'size': 0}, b'')
+        if 'root' not in message:
+            return({'error': 'no root given'}, b'')
+
+        with self.__lock:
+            hot = self.hot_repo(message['root'])
+            if op == 'list':
+                count, names, lines = hot.render(message['sorttype'],
+                                                 message['sortrev'],
+                                                 message.get('format'))
+                return({'count': count, 'names': len(names),
+                        'size': len(names) + len(lines)}, names + lines)
+            elif op in ('search', 'grep'):
+                limit = message.get('limit')
+                if op == 'search':
+                    results = hot.repo.search_files(message['query'], limit)
+                else:
+                    results = hot.repo.grep_files(message['query'], limit)
+                if not isinstance(results, qn.FileRepo):
+                    return({'results': None, 'size': 0}, b'')
+                matches = list(zip(results.filenames(),
+                                   results.get_property_list('misc')))
+                return({'results': matches, 'size': 0}, b'')
+        return({'error': 'unknown request ' + str(op)}, b'')
+
+    def serve_forever(self):
+        """Scan the qn directory and trash, then serve requests until
+        interrupted."""
+        client = daemon_client.DaemonClient(self.__sock_path)
+        if client.ping():
+            print("qnd is already running on " + self.__sock_path)
+            exit(1)
+        if not daemon_client.private_dir(path.dirname(self.__sock_path)):
+            print(path.dirname(self.__sock_path) + " can be used by other " +
+                  "users, not listening on it")
+            exit(1)
+        if path.exists(self.__sock_path):
+            remove(self.__sock_path)
+
+        self.hot_repo(self.__options.qndir)
+        self.hot_repo(self.__options.qntrash)
+        if self.__inotify:
+            watcher = threading.Thread(target=self.watch_loop, daemon=True)
+            watcher.start()
+
+        old_umask = umask(0o177)
+        try:
+            server = _Server(self.__sock_path, _RequestHandler)
+        finally:
+            umask(old_umask)
+        server.qnd = self
+        print("qnd listening on " + self.__sock_path)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            remove(self.__sock_path)
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            message = json.loads(self.rfile.readline().decode('utf-8'))
+            header, payload = self.server.qnd.handle_request(message)
+        except (ValueError, KeyError, TypeError) as err:
+            header, payload = {'error': 'invalid request: ' + str(err)}, b''
+        try:
+            daemon_client.write_message(self.wfile, header, payload)
+        except OSError:
+            pass
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
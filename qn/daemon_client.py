@@ -0,0 +1,335 @@
+"""Client side of the qn daemon (qnd) protocol"""
+
+import json
+import socket
+import struct
+from os import path, environ, getuid, lstat, makedirs
+from stat import S_ISDIR
+
+import qn.qn as qn
+
+_SOCKET_NAME = 'qnd.sock'
+_CONNECT_TIMEOUT = 0.5
+_PROTOCOL_VERSION = 1
+# struct ucred of SO_PEERCRED: pid, uid, gid.
+_PEERCRED = '3i'
+
+
+def socket_path():
+    """Path of the Unix socket on which qnd listens. Without a runtime dir,
+    it is kept in a directory of the user in /tmp, see private_dir."""
+    runtime_dir = environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir and path.isdir(runtime_dir):
+        return(path.join(runtime_dir, _SOCKET_NAME))
+    return(path.join('/tmp', 'qnd-' + str(getuid()), _SOCKET_NAME))
+
+
+def private_dir(dirpath):
+    """Create the directory of the socket if needed, and check that only the
+    user can use it, so that no other user can put a socket there first.
+
+    Returns:
+        True if the directory belongs to the user and has mode 0700, False
+        otherwise.
+    """
+    try:
+        makedirs(dirpath, 0o700, exist_ok=True)
+        dirstat = lstat(dirpath)
+    except OSError:
+        return(False)
+    return(S_ISDIR(dirstat.st_mode) and dirstat.st_uid == getuid() and
+           not dirstat.st_mode & 0o077)
+
+
+def check_peer(sock, sock_path):
+    """Check that the process at the other end of a connected socket runs
+    as the user. Raises ConnectionError otherwise."""
+    if hasattr(socket, 'SO_PEERCRED'):
+        creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED,
+                                struct.calcsize(_PEERCRED))
+        uid = struct.unpack(_PEERCRED, creds)[1]
+    else:
+        uid = lstat(sock_path).st_uid
+    if uid != getuid():
+        raise ConnectionError(sock_path + ' belongs to another user')
+
+
+def check_names(names):
+    """Check that note names sent by qnd stay inside the notes directory.
+    Raises ValueError otherwise."""
+    for name in names:
+        if not name or name[0] == '/' or '..' in name.split('/'):
+            raise ValueError('qnd sent an invalid note name: ' + repr(name))
+    return(names)
+
+
+def write_message(wfile, header, payload=b''):
+    """Write a message: a json header line, followed by a raw payload whose
+    layout is described by the header."""
+    wfile.write(json.dumps(header).encode('utf-8') + b'\n')
+    if payload:
+        wfile.write(payload)
+    wfile.flush()
+
+
+def read_message(rfile):
+    """Read a message written by write_message. Returns the header, the
+    payload has to be read by the caller."""
+    line = rfile.readline()
+    if not line:
+        raise ConnectionError('qnd closed the connection')
+    return(json.loads(line.decode('utf-8')))
+
+
+def split_entries(data):
+    if not data:
+        return([])
+    return(data.decode('utf-8').split('\x00'))
+
+
+class DaemonClient:
+    """Class that sends requests to a running qnd.
+
+    Keyword arguments:
+    sock_path -- path to the daemon socket (default socket_path()).
+    """
+    def __init__(self, sock_path=None):
+        if sock_path is None:
+            sock_path = socket_path()
+        self.__sock_path = sock_path
+
+    @property
+    def sock_path(self):
+        return(self.__sock_path)
+
+    def request(self, message):
+        """Send a request and return (header, payload)."""
+        message['version'] = _PROTOCOL_VERSION
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.settimeout(_CONNECT_TIMEOUT)
+            sock.connect(self.__sock_path)
+            check_peer(sock, self.__sock_path)
+            sock.settimeout(None)
+            with sock.makefile('rwb') as sockfile:
+                write_message(sockfile, message)
+                header = read_message(sockfile)
+                if 'error' in header:
+                    raise ConnectionError('qnd: ' + header['error'])
+                size = header.get('size', 0)
+                payload = sockfile.read(size) if size else b''
+                if len(payload) != size:
+                    raise ConnectionError('qnd sent a truncated reply')
+        finally:
+            sock.close()
+        return(header, payload)
+
+    def ping(self):
+        """Check whether qnd is running and speaks our protocol."""
+        try:
+            self.request({'op': 'ping'})
+        except (OSError, ValueError):
+            return(False)
+        return(True)
+
+    def repo(self, repopath, snapshot_path=None, scan_workers=1,
+             index_paths=None, cache_path=None, summary_path=None):
+        """Create a RemoteRepo served by this daemon."""
+        return(RemoteRepo(self, repopath, snapshot_path, scan_workers,
+                          index_paths, cache_path, summary_path))
+
+
+class RemoteRepo:
+    """Class with the read side of the FileRepo interface, backed by the
+    repository that qnd keeps in memory. If the daemon goes away, it falls
+    back to scanning the repository locally, with the same data as a
+    FileRepo of qn.QnApp.add_repo.
+
+    Keyword arguments:
+    client -- DaemonClient to send requests through.
+    repopath -- root of the note repository.
+    snapshot_path -- snapshot used if a local scan is needed.
+    scan_workers -- scan threads used if a local scan is needed.
+    index_paths -- search indexes used if a local search is needed.
+    cache_path -- result cache used if a local search is needed.
+    summary_path -- summary cache used if local lines are needed.
+    """
+    def __init__(self, client, repopath, snapshot_path=None, scan_workers=1,
+                 index_paths=None, cache_path=None, summary_path=None):
+        self.__client = client
+        self.__path = path.join(repopath, "")
+        self.__snapshot_path = snapshot_path
+        self.__scan_workers = scan_workers
+        self.__index_paths = index_paths
+        self.__cache_path = cache_path
+        self.__summary_path = summary_path
+        self.__local = None
+        self.__sorttype = "none"
+        self.__sortrev = False
+        self.__lineformat = ['name', 'cdate']
+        self.__names = None
+        self.__lines = {}
+        self.__matcher = None
+        self.__entries = {}
+
+    @property
+    def root(self):
+        return(self.__path)
+
+    @property
+    def sorttype(self):
+        if self.__local:
+            return(self.__local.sorttype)
+        return(self.__sorttype)
+
+    @property
+    def sortrev(self):
+        if self.__local:
+            return(self.__local.sortrev)
+        return(self.__sortrev)
+
+    def __fallback(self):
+        """Scan the repository locally, keeping the current sort."""
+        if not self.__local:
+            print("qnd is not answering, scanning locally...")
+            self.__local = qn.FileRepo(self.__path, self.__snapshot_path,
+                                       self.__scan_workers,
+                                       self.__index_paths, self.__cache_path,
+                                       self.__summary_path)
+            self.__local.set_lineformat(self.__lineformat)
+            self.__local.scan_files()
+            if self.__sorttype != "none":
+                self.__local.sort(self.__sorttype, self.__sortrev)
+        return(self.__local)
+
+    def __fetch(self, format_list=None):
+        message = {'op': 'list', 'root': self.__path,
+                   'sorttype': self.__sorttype, 'sortrev': self.__sortrev,
+                   'format': format_list}
+        header, payload = self.__client.request(message)
+        names_size = header['names']
+        self.__names = check_names(split_entries(payload[:names_size]))
+        if format_list:
+            self.__lines[tuple(format_list)] = \
+                split_entries(payload[names_size:])
+
+    def scan_files(self):
+        """Nothing to do, qnd keeps the repository current."""
+        pass
+
+    def invalidate(self, name, save=True):
+        """Nothing to do, qnd watches the repository for changes."""
+        if self.__local:
+            self.__local.invalidate(name, save)
+
+    def sort(self, sortby='name', sortrev=False):
+        if self.__local:
+            self.__local.sort(sortby, sortrev)
+            return
+        if (sortby, sortrev) != (self.__sorttype, self.__sortrev):
+            self.__names = None
+            self.__lines = {}
+            self.__entries = {}
+        self.__sorttype = sortby
+        self.__sortrev = sortrev
+
+    def set_lineformat(self, new_lineformat):
+        self.__lineformat = new_lineformat
+        if self.__local:
+            self.__local.set_lineformat(new_lineformat)
+
+    def filenames(self, pinned_first=True):
+        if not self.__local and self.__names is None:
+            try:
+                self.__fetch()
+            except (OSError, ValueError, KeyError):
+                self.__fallback()
+        if self.__local:
+            return(self.__local.filenames(pinned_first))
+        return(self.__names)
+
+    def filepaths(self, pinned_first=True):
+        return([self.__path + name for name in self.filenames(pinned_first)])
+
+    def lines(self, format_list=None, pinned_first=True):
+        if not format_list:
+            format_list = self.__lineformat
+        key = tuple(format_list)
+        if not self.__local and key not in self.__lines:
+            try:
+                self.__fetch(format_list)
+            except (OSError, ValueError, KeyError):
+                self.__fallback()
+        if self.__local:
+            return(self.__local.lines(format_list, pinned_first))
+        return(self.__lines[key])
+
+    def filecount(self, include_normal=True, include_pinned=True):
+        return(len(self.filenames()))
+
+    def entries(self, kind='names', format_list=None):
+        if self.__local:
+            return(self.__local.entries(kind, format_list))
+        if kind == 'lines' and not format_list:
+            format_list = self.__lineformat
+        key = (kind, tuple(format_list or ()))
+        if key not in self.__entries:
+            if kind == 'lines':
+                entries = self.lines(format_list)
+            else:
+                entries = self.filenames()
+            data = b''
+            if entries:
+                data = ('\x00'.join(entries) + '\x00').encode('utf-8')
+            self.__entries[key] = data
+        return(self.__entries[key])
+
+    def find(self, patterns, limit=None):
+        if self.__local:
+            return(self.__local.find(patterns, limit))
+        names = self.filenames()
+        if self.__matcher is None or self.__matcher.names is not names:
+            import qn.fuzzy as fuzzy
+
+            self.__matcher = fuzzy.FuzzyMatcher(names)
+        return(self.__matcher.top(patterns, limit))
+
+    def is_empty(self):
+        return(not self.filecount() > 0)
+
+    def __results(self, op, query, limit=None):
+        """Run a search in the daemon and build a local FileRepo from the
+        matches."""
+        if self.__local:
+            return(None)
+        try:
+            header, payload = self.__client.request({'op': op,
+                                                     'root': self.__path,
+                                                     'query': query,
+                                                     'limit': limit})
+            if header.get('results') is None:
+                return(False)
+            check_names([name for name, misc in header['results']])
+        except (OSError, ValueError, TypeError):
+            self.__fallback()
+            return(None)
+        results_repo = qn.FileRepo(self.__path)
+        for name, misc in header['results']:
+            results_repo.add_file(self.__path + name, misc)
+        return(results_repo)
+
+    def search_files(self, queries_list, limit=None):
+        results = self.__results('search', queries_list, limit)
+        if results is None:
+            return(self.__local.search_files(queries_list, limit))
+        if results is False or results.is_empty():
+            return(None)
+        return(results)
+
+    def grep_files(self, filters_string, limit=None):
+        results = self.__results('grep', filters_string, limit)
+        if results is None:
+            return(self.__local.grep_files(filters_string, limit))
+        if results is False or results.is_empty():
+            return(None)
+        return(results)
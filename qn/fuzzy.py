@@ -0,0 +1,216 @@
+"""Fuzzy matching of note names, scored like fzf"""
+
+import heapq
+import re
+from bisect import bisect_right
+
+# Scores, from fzf's algo.go.
+_SCORE_MATCH = 16
+_SCORE_GAP_START = -3
+_SCORE_GAP_EXTENSION = -1
+_BONUS_BOUNDARY = _SCORE_MATCH // 2
+_BONUS_NONWORD = _SCORE_MATCH // 2
+_BONUS_CAMEL = _BONUS_BOUNDARY + _SCORE_GAP_EXTENSION
+_BONUS_CONSECUTIVE = -(_SCORE_GAP_START + _SCORE_GAP_EXTENSION)
+_BONUS_BOUNDARY_DELIMITER = _BONUS_BOUNDARY + 1
+_BONUS_FIRST_CHAR_MULTIPLIER = 2
+
+# Character classes, word classes last.
+_CLASS_DELIMITER = 0
+_CLASS_NONWORD = 1
+_CLASS_LOWER = 2
+_CLASS_UPPER = 3
+_CLASS_LETTER = 4
+_CLASS_NUMBER = 5
+_DELIMITERS = set('/,:;| _-.')
+
+
+def _char_class(char):
+    if char.islower():
+        return(_CLASS_LOWER)
+    if char.isupper():
+        return(_CLASS_UPPER)
+    if char.isdigit():
+        return(_CLASS_NUMBER)
+    if char.isalpha():
+        return(_CLASS_LETTER)
+    if char in _DELIMITERS:
+        return(_CLASS_DELIMITER)
+    return(_CLASS_NONWORD)
+
+
+def _bonus(prev_class, char_class):
+    """Bonus of a match on a character, given the class of the one before."""
+    if char_class >= _CLASS_LOWER:
+        if prev_class == _CLASS_DELIMITER:
+            return(_BONUS_BOUNDARY_DELIMITER)
+        if prev_class == _CLASS_NONWORD:
+            return(_BONUS_BOUNDARY)
+        if prev_class == _CLASS_LOWER and char_class == _CLASS_UPPER:
+            return(_BONUS_CAMEL)
+        if prev_class != _CLASS_NUMBER and char_class == _CLASS_NUMBER:
+            return(_BONUS_CAMEL)
+        return(0)
+    return(_BONUS_NONWORD)
+
+
+def match_key(name):
+    """Key a name is matched on: casefolded, so matching ignores case."""
+    return(name.casefold())
+
+
+def score(pattern, key, name=None):
+    """Score a casefolded pattern against a match key, like fzf's default
+    algorithm: find the shortest window of key, ending at the first place
+    where the whole pattern has been seen, that holds the pattern as a
+    subsequence, and score the characters in it.
+
+    Keyword arguments:
+    pattern -- casefolded string to look for.
+    key -- match key of the name, from match_key.
+    name -- the name itself, used to find word boundaries and camel case
+            (default None, use key).
+
+    Returns:
+        score, higher is better, or None if key does not hold pattern.
+    """
+    if not pattern:
+        return(0)
+    pos = -1
+    for char in pattern:
+        pos = key.find(char, pos + 1)
+        if pos == -1:
+            return(None)
+    end = pos + 1
+
+    # Walk back from the end to find where the shortest window starts.
+    pidx = len(pattern) - 1
+    start = pos
+    while pidx >= 0:
+        if key[start] == pattern[pidx]:
+            pidx -= 1
+            if pidx < 0:
+                break
+        start -= 1
+
+    if name is None or len(name) != len(key):
+        name = key
+    prev_class = _CLASS_DELIMITER
+    if start > 0:
+        prev_class = _char_class(name[start - 1])
+    total = 0
+    in_gap = False
+    consecutive = 0
+    first_bonus = 0
+    pidx = 0
+    for idx in range(start, end):
+        char_class = _char_class(name[idx])
+        if pidx < len(pattern) and key[idx] == pattern[pidx]:
+            total += _SCORE_MATCH
+            bonus = _bonus(prev_class, char_class)
+            if consecutive == 0:
+                first_bonus = bonus
+            else:
+                if bonus >= _BONUS_BOUNDARY and bonus > first_bonus:
+                    first_bonus = bonus
+                bonus = max(bonus, first_bonus, _BONUS_CONSECUTIVE)
+            if pidx == 0:
+                total += bonus * _BONUS_FIRST_CHAR_MULTIPLIER
+            else:
+                total += bonus
+            in_gap = False
+            consecutive += 1
+            pidx += 1
+        else:
+            if in_gap:
+                total += _SCORE_GAP_EXTENSION
+            else:
+                total += _SCORE_GAP_START
+            in_gap = True
+            consecutive = 0
+            first_bonus = 0
+        prev_class = char_class
+    return(total)
+
+
+class FuzzyMatcher:
+    """Class that matches strings against a list of note names, keeping the
+    match keys of the names so they are only computed once.
+
+    Keyword arguments:
+    names -- list of note names.
+    """
+    def __init__(self, names):
+        self.__names = list(names)
+        self.__keys = [match_key(name) for name in self.__names]
+        self.__joined = None  # (keys joined by newlines, start offsets)
+
+    @property
+    def names(self):
+        return(self.__names)
+
+    def __holding(self, pattern):
+        """Get the indexes of the keys holding pattern as a subsequence, with
+        one regex pass over all the keys joined together."""
+        if self.__joined is None:
+            starts = []
+            offset = 0
+            for key in self.__keys:
+                starts.append(offset)
+                offset += len(key) + 1
+            self.__joined = ('\n'.join(self.__keys), starts)
+        joined, starts = self.__joined
+        # Each character is reached without backtracking: 'abc' becomes
+        # a[^\nb]*b[^\nc]*c.
+        regex = re.escape(pattern[0])
+        for char in pattern[1:]:
+            char = re.escape(char)
+            regex += '[^\n' + char + ']*' + char
+        holding = dict.fromkeys(bisect_right(starts, match.start()) - 1
+                                for match in re.finditer(regex, joined))
+        return(list(holding))
+
+    def top(self, patterns, limit=None):
+        """Find the names that hold every pattern as a subsequence, ignoring
+        case, in a single pass over the names.
+
+        Keyword arguments:
+        patterns -- list of strings to match.
+        limit -- keep only this many of the best names (default None, all).
+
+        Returns:
+            list of names, best first. Names with equal scores are ordered
+            shortest first, then in their original order.
+        """
+        patterns = [match_key(pattern) for pattern in patterns]
+        names = self.__names
+        keys = self.__keys
+        candidates = None
+        for pattern in patterns:
+            # Names can't hold a newline, it would match across keys.
+            if pattern and '\n' not in pattern:
+                holding = self.__holding(pattern)
+                if candidates is None:
+                    candidates = holding
+                else:
+                    holding = set(holding)
+                    candidates = [idx for idx in candidates if idx in holding]
+        if candidates is None:
+            candidates = range(len(keys))
+
+        scored = []
+        for idx in candidates:
+            key = keys[idx]
+            total = 0
+            for pattern in patterns:
+                pattern_score = score(pattern, key, names[idx])
+                if pattern_score is None:
+                    break
+                total += pattern_score
+            else:
+                scored.append((total, -len(key), -idx))
+        if limit is not None and limit < len(scored):
+            best = heapq.nlargest(limit, scored)
+        else:
+            best = sorted(scored, reverse=True)
+        return([names[-idx] for total, length, idx in best])
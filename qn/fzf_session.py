@@ -0,0 +1,179 @@
+"""Persistent fzf session: qn views are switched inside a single fzf with its
+reload action, while qn serves the entries of each view"""
+
+import socket
+import sys
+import threading
+from os import path, remove, rmdir
+from shlex import quote
+from tempfile import mkdtemp
+
+# Delimiters fzf accepts around the argument of an action.
+_DELIMITERS = ['()', '[]', '{}', '<>', '~~', '!!', '@@', '##', '$$', '%%',
+               '^^', '&&', '**', ';;', '//', '||']
+_CHUNK = 65536
+
+
+def fzf_action(name, argument):
+    """Write an fzf action, e.g. reload(command), between delimiters that the
+    argument does not hold."""
+    for start, end in _DELIMITERS:
+        if end not in argument:
+            return(name + start + argument + end)
+    # Runs to the end of the binding, so it must be the last action.
+    return(name + ':' + argument)
+
+
+def request(sock_path, optname, query, out=None):
+    """Ask a session for the entries of the view a hotkey leads to, and write
+    them to out. This is what fzf's reload action runs.
+
+    Keyword arguments:
+    sock_path -- path of the socket of the session.
+    optname -- name of the hotkey pressed in fzf.
+    query -- fzf query when the hotkey was pressed.
+    out -- binary file to write the entries to (default None, stdout).
+    """
+    if out is None:
+        out = sys.stdout.buffer
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(sock_path)
+        client.sendall((optname + '\x00' + query).encode('utf-8'))
+        client.shutdown(socket.SHUT_WR)
+        while True:
+            data = client.recv(_CHUNK)
+            if not data:
+                break
+            out.write(data)
+    out.flush()
+
+
+class FzfSession:
+    """Class that serves the entries of qn views to a long-lived fzf. fzf's
+    reload action runs this module as a script, which asks a thread of the
+    qn process for the entries of the next view over a unix socket. Header
+    and prompt changes are sent back to fzf through its --listen server,
+    on another unix socket. Both are in a directory only the user can open,
+    so no other user can ask for notes or run actions in fzf.
+
+    Keyword arguments:
+    serve -- function called with the name of the hotkey pressed in fzf and
+             the fzf query. It returns the entries of the next view, as
+             bytes, and the fzf actions to run once they are sent, e.g.
+             change-header(...), or ''.
+    """
+    def __init__(self, serve):
+        self.__serve = serve
+        self.__dir = None
+        self.__sock_path = None
+        self.__server = None
+        self.__thread = None
+        self.__listen_path = None
+
+    @property
+    def listen_path(self):
+        return(self.__listen_path)
+
+    @property
+    def sock_path(self):
+        return(self.__sock_path)
+
+    def start(self):
+        """Start serving views in a background thread."""
+        self.__dir = mkdtemp(prefix='qn-fzf-')
+        self.__sock_path = path.join(self.__dir, 'views.sock')
+        self.__server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.__server.bind(self.__sock_path)
+        self.__server.listen(4)
+        self.__listen_path = path.join(self.__dir, 'fzf.sock')
+        self.__thread = threading.Thread(target=self.__accept, daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        """Stop serving views and remove the socket."""
+        if self.__server is None:
+            return
+        try:
+            # Wakes up the thread waiting in accept(), close() alone doesn't.
+            self.__server.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.__server.close()
+        self.__server = None
+        for sock_path in (self.__sock_path, self.__listen_path):
+            try:
+                remove(sock_path)
+            except OSError:
+                pass
+        try:
+            rmdir(self.__dir)
+        except OSError:
+            pass
+
+    def __accept(self):
+        while True:
+            try:
+                conn, address = self.__server.accept()
+            except (OSError, AttributeError):
+                # stop() closed the socket.
+                return
+            # One view at a time, in the order the hotkeys were pressed.
+            with conn:
+                actions = self.__answer(conn)
+            if actions:
+                self.post(actions)
+
+    def __answer(self, conn):
+        message = b''
+        while True:
+            data = conn.recv(_CHUNK)
+            if not data:
+                break
+            message += data
+        optname, query = message.decode('utf-8').split('\x00', 1)
+        entries, actions = self.__serve(optname, query)
+        try:
+            conn.sendall(entries)
+        except OSError:
+            # fzf was closed or reloaded again meanwhile.
+            pass
+        return(actions)
+
+    def post(self, actions):
+        """Run fzf actions, e.g. change-header(...), in the running fzf."""
+        body = actions.encode('utf-8')
+        head = ('POST / HTTP/1.1\r\nHost: localhost\r\n' +
+                'Content-Length: ' + str(len(body)) + '\r\n\r\n')
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+                conn.settimeout(1)
+                conn.connect(self.__listen_path)
+                conn.sendall(head.encode('ascii') + body)
+                conn.recv(_CHUNK)
+        except OSError:
+            pass
+
+    def reload_command(self, optname):
+        """Shell command for fzf's reload action on the hotkey optname."""
+        command = [sys.executable, '-S', path.abspath(__file__),
+                   self.__sock_path, optname]
+        return(' '.join(quote(arg) for arg in command) + ' {q}')
+
+    def fzf_args(self, reload_keys):
+        """Get the fzf arguments that bind hotkeys to the views of this
+        session.
+
+        Keyword arguments:
+        reload_keys -- list of (optname, keybinding) of the hotkeys that
+                       switch views without leaving fzf.
+        """
+        args = ['--listen=' + self.__listen_path]
+        for optname, keybinding in reload_keys:
+            action = fzf_action('reload', self.reload_command(optname))
+            args.extend(['--bind', keybinding.lower() + ':' + action +
+                         '+clear-query'])
+        return(args)
+
+
+if __name__ == '__main__':
+    request(sys.argv[1], sys.argv[2], ' '.join(sys.argv[3:]))
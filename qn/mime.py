@@ -0,0 +1,176 @@
+"""MIME types of notes, which decide whether a note is opened in the editor
+or the opener, found in process and kept between runs"""
+
+import pickle
+from os import path, stat, replace, remove
+from subprocess import Popen, PIPE, DEVNULL
+
+import qn.tools as tools
+
+_CACHE_VERSION = 1
+_MAX_ENTRIES = 20000
+_SNIFF_BYTES = 4096
+# First bytes of common binary formats.
+_MAGIC = [(b'%PDF-', 'application/pdf'),
+          (b'\x89PNG\r\n\x1a\n', 'image/png'),
+          (b'\xff\xd8\xff', 'image/jpeg'),
+          (b'GIF87a', 'image/gif'),
+          (b'GIF89a', 'image/gif'),
+          (b'PK\x03\x04', 'application/zip'),
+          (b'\x1f\x8b', 'application/gzip'),
+          (b'7z\xbc\xaf\x27\x1c', 'application/x-7z-compressed'),
+          (b'%!PS', 'application/postscript'),
+          (b'\x7fELF', 'application/x-executable'),
+          (b'OggS', 'audio/ogg'),
+          (b'ID3', 'audio/mpeg'),
+          (b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1', 'application/x-ole-storage')]
+# Note formats the system's extension map may not know, or map elsewhere
+# (.org is a Lotus Organizer file in some mime.types).
+_NOTE_TYPES = {'.txt': 'text/plain',
+               '.md': 'text/markdown',
+               '.markdown': 'text/markdown',
+               '.org': 'text/x-org',
+               '.rst': 'text/x-rst'}
+
+
+def _is_utf8(head, whole):
+    """Whether bytes read from the start of a file are UTF-8 text, the last
+    character being cut short unless the file was read whole."""
+    try:
+        head.decode('utf-8')
+    except UnicodeDecodeError as error:
+        return(not whole and error.start >= len(head) - 3 and
+               error.reason == 'unexpected end of data')
+    return(True)
+
+
+def xdg_mime(filepath):
+    """Ask xdg-mime for the type of a file. Returns None if it is not
+    installed or has no answer."""
+    if not tools.cmd_exists('xdg-mime'):
+        return(None)
+    proc = Popen(['xdg-mime', 'query', 'filetype', filepath], stdout=PIPE,
+                 stderr=DEVNULL)
+    mtype = proc.communicate()[0].decode('utf-8').strip()
+    return(mtype or None)
+
+
+def classify(filepath, size=None):
+    """Get the MIME type of a file from its size, first bytes and extension,
+    asking xdg-mime only for text files whose extension says they are of
+    another type (e.g. application/json).
+
+    Keyword arguments:
+    filepath -- path of the file.
+    size -- size of the file, if known (default None).
+
+    Returns:
+        MIME type, as 'type/subtype'. Empty files are 'inode/x-empty', and
+        files that can't be read 'None/None'.
+    """
+    try:
+        if size is None:
+            size = stat(filepath).st_size
+        with open(filepath, 'rb') as notefile:
+            head = notefile.read(_SNIFF_BYTES)
+    except OSError:
+        return('None/None')
+    if size == 0:
+        return('inode/x-empty')
+    for magic, mtype in _MAGIC:
+        if head.startswith(magic):
+            return(mtype)
+
+    ext = path.splitext(filepath)[1].lower()
+    if ext in _NOTE_TYPES:
+        return(_NOTE_TYPES[ext])
+    import mimetypes
+
+    guess = mimetypes.guess_type(filepath)[0]
+    binary = b'\x00' in head
+    text = not binary and _is_utf8(head, size <= len(head))
+    if guess and (guess.startswith('text/') or binary):
+        return(guess)
+    if guess is None and binary:
+        return('application/octet-stream')
+    if guess is None and text:
+        return('text/plain')
+    return(xdg_mime(filepath) or guess or 'None/None')
+
+
+class MimeCache:
+    """Class that keeps the MIME types of notes between runs, keyed by the
+    inode and mtime of each note, so a note is only classified again once
+    it changed.
+
+    Keyword arguments:
+    cache_path -- path of the file holding the cache, or None to only keep
+                  it in memory.
+    """
+    def __init__(self, cache_path):
+        self.__path = cache_path
+        self.__types = {}  # filepath -> ((inode, mtime), MIME type)
+        self.load()
+
+    @property
+    def cache_path(self):
+        return(self.__path)
+
+    def load(self):
+        """Load the cache from disk. A missing, unreadable or outdated cache
+        is simply discarded."""
+        self.__types = {}
+        if not self.__path:
+            return
+        try:
+            with open(self.__path, 'rb') as cachefile:
+                data = pickle.load(cachefile)
+        except Exception:
+            return
+        if not isinstance(data, dict):
+            return
+        if data.get('version') != _CACHE_VERSION:
+            return
+        self.__types = data['types']
+
+    def save(self):
+        """Write the cache to disk."""
+        if not self.__path:
+            return
+        data = {'version': _CACHE_VERSION,
+                'types': self.__types}
+        tmp_path = self.__path + '.tmp'
+        try:
+            with open(tmp_path, 'wb') as cachefile:
+                pickle.dump(data, cachefile, pickle.HIGHEST_PROTOCOL)
+            replace(tmp_path, self.__path)
+        except OSError:
+            try:
+                remove(tmp_path)
+            except OSError:
+                pass
+
+    def get(self, filepath):
+        """Get the MIME type of a file, classifying it if it is new or
+        changed."""
+        try:
+            filestat = stat(filepath)
+        except OSError:
+            return(classify(filepath))
+        key = (filestat.st_ino, filestat.st_mtime_ns)
+        entry = self.__types.get(filepath)
+        if entry is not None and entry[0] == key:
+            return(entry[1])
+        mtype = classify(filepath, filestat.st_size)
+        self.__types.pop(filepath, None)
+        self.__types[filepath] = (key, mtype)
+        while len(self.__types) > _MAX_ENTRIES:
+            # Oldest first, as entries are moved to the end when updated.
+            del self.__types[next(iter(self.__types))]
+        self.save()
+        return(mtype)
+
+
+def cache_path(qndata):
+    """Path of the MIME type cache inside the qn data dir."""
+    return(path.join(qndata, 'mime.pickle'))
@@ -2,24 +2,36 @@
 # -*- coding: utf-8 -*-
 
 import qn.hotkey_manager as hotkey_manager
+import qn.snapshot as snapshot
+import qn.search_index as search_index
+import qn.result_cache as result_cache
+import qn.summary as summary
+import qn.tools as tools
 
-from os import system, path, makedirs, walk, stat, rename, rmdir
+from os import system, path, makedirs, scandir, stat, rename, rmdir
 from sys import exit
-from subprocess import Popen, PIPE, call
+from subprocess import Popen, PIPE
 from stat import ST_CTIME, ST_ATIME, ST_MTIME, ST_SIZE
-from operator import itemgetter
-import mimetypes
-from datetime import datetime
+from operator import attrgetter
+
+_STAT_KEYS = ('size', 'adate', 'mdate', 'cdate')
+_DATE_KEYS = ('adate', 'mdate', 'cdate')
+_DATE_FORMAT = '%d/%m/%Y %H:%M'
+# Dates are shown to the minute, so they are formatted once per minute.
+_DATE_CACHE = {}
+_DATE_CACHE_SIZE = 100000
 
 
 # Check if program exists - linux only
 def cmd_exists(cmd):
 
-    return call("type " + cmd, shell=True, stdout=PIPE, stderr=PIPE) == 0
+    return(tools.cmd_exists(cmd))
 
 
 def file_mime_type(filename):
 
+    import mimetypes
+
     mtype, menc = mimetypes.guess_type(filename)
     # If type is not detected, just open as plain text
     if not mtype:
@@ -58,6 +70,44 @@ def terminal_open(terminal, command, title=None):
     system(generated_command + " -e " + command)
 
 
+def _stat_tuple(filestat):
+    return((filestat[ST_SIZE], filestat[ST_ATIME], filestat[ST_MTIME],
+            filestat[ST_CTIME]))
+
+
+def _index_key(filestat):
+    """Key the search indexes keep for a note: its size, mtime and ctime,
+    to the nanosecond so that edits within the same second are noticed,
+    and its inode."""
+    return((filestat.st_size, filestat.st_mtime_ns, filestat.st_ctime_ns,
+            filestat.st_ino))
+
+
+def _stat_path(filepath):
+    """Get the stat tuple and the index key of a file, with a None key if
+    it can't be stat'ed."""
+    try:
+        filestat = stat(filepath)
+    except OSError:
+        return((0, 0, 0, 0), None)
+    return(_stat_tuple(filestat), _index_key(filestat))
+
+
+def format_date(timestamp):
+    """Format a timestamp as shown in lines, from a cache of the minutes
+    already formatted."""
+    minute = int(timestamp // 60)
+    block = _DATE_CACHE.get(minute)
+    if block is None:
+        if len(_DATE_CACHE) >= _DATE_CACHE_SIZE:
+            _DATE_CACHE.clear()
+        from datetime import datetime
+
+        block = datetime.utcfromtimestamp(minute * 60).strftime(_DATE_FORMAT)
+        _DATE_CACHE[minute] = block
+    return(block)
+
+
 def sizeof_fmt(num, suffix='B'):
     for unit in ['', 'Ki', 'Mi', 'Gi', 'Ti', 'Pi', 'Ei', 'Zi']:
         if abs(num) < 1024.0:
@@ -66,10 +116,62 @@ def sizeof_fmt(num, suffix='B'):
     return "%.1f%s%s" % (num, 'Yi', suffix)
 
 
+class FileRecord:
+    """Properties of a single file in a FileRepo. The full path is not
+    stored, FileRepo builds it from its root and the name.
+
+    Keyword arguments:
+    name -- path of the file relative to the repo root.
+    stats -- (size, adate, mdate, cdate) tuple, or None if the file has not
+             been stat'ed yet.
+    misc -- string shown in the 'misc' block of lines (default None).
+    key -- key of the stats for the search indexes, see _index_key (default
+           None).
+    """
+    __slots__ = ('name', 'size', 'adate', 'mdate', 'cdate', 'misc', 'tags',
+                 'line', 'key')
+
+    def __init__(self, name, stats=None, misc=None, key=None):
+        self.name = name
+        if stats is None:
+            self.size = self.adate = self.mdate = self.cdate = None
+        else:
+            self.size, self.adate, self.mdate, self.cdate = stats
+        self.misc = misc
+        self.key = key
+        self.tags = None
+        self.line = None  # (render key, line) of the last format_line
+
+    def set_stats(self, stats, key=None):
+        self.size, self.adate, self.mdate, self.cdate = stats
+        self.key = key
+
+
 class FileRepo:
-    def __init__(self, dirpath=None):
+    def __init__(self, dirpath=None, snapshot_path=None, scan_workers=1,
+                 index_paths=None, cache_path=None, summary_path=None):
         self.__path = path.join(dirpath, "")
         self.__path_len = len(self.__path)
+        self.__snapshot_path = snapshot_path
+        self.__snapshot = None
+        self.__scan_workers = scan_workers
+        self.__index_paths = index_paths  # dict of index kind -> path
+        self.__indexes = {}
+        self.__indexed = set()  # kinds of indexes updated since the scan
+        self.__cache_path = cache_path
+        self.__result_cache = None
+        self.__query_key = ()  # searches that gave this repo, if any
+        self.__matcher = None  # fuzzy.FuzzyMatcher of the current names
+        # sort key -> ascending list of (value, name), and the records in
+        # that order, or None until they are matched with the current scan.
+        self.__orders = {}
+        self.__entries = {}  # (kind, format) -> launcher input bytes
+        self.__sorted_as = None  # (sortby, sortrev, records) of last sort
+        self.__summary_path = summary_path
+        self.__summaries = None
+        self.__summary_pending = []  # names with no up to date summary
+        self.__dirs = []  # list of scanned directories, relative to root
+        self.__scanning = None  # scan_iter generator, until exhausted
         self.__file_list = []    # list of files - dicts
         self.__pfile_list = []  # list of pinned files - dicts
         self.__pinned_filenames = []  # List of filenames that will be pinned
@@ -78,6 +180,7 @@ class FileRepo:
 
         self.__filecount = 0
         self.__pfilecount = 0
+        self.__unstated = 0
 
         self.__tags = None
 
@@ -99,59 +202,243 @@ class FileRepo:
     def sortrev(self):
         return(self.__sortrev)
 
+    @property
+    def scan_workers(self):
+        return(self.__scan_workers)
+
+    @property
+    def root(self):
+        return(self.__path)
+
+    def set_scan_workers(self, scan_workers):
+        """Set the number of threads used to read directories and stat files.
+        1 scans serially."""
+        self.__scan_workers = max(1, int(scan_workers))
+
     def scan_files(self):
         """Scans the directory for files and populates the file list and
-        linebs.
+        linebs. If the repo has a snapshot, directories that did not change
+        since the last scan are not listed again.
         """
+        for file_props in self.scan_iter():
+            pass
+
+    def scan_iter(self):
+        """Scan the directory like scan_files, yielding each FileRecord as
+        soon as it is found, in scan order. The repo is complete once the
+        generator is exhausted. If it is abandoned early, finish_scan() (which
+        sort, lines and get_property_list call) completes the scan.
+        """
+        self.__scanning = self.__scan_gen()
+        return(self.__scanning)
+
+    def finish_scan(self):
+        """Complete a scan started by scan_iter that was not exhausted."""
+        if self.__scanning:
+            for file_props in self.__scanning:
+                pass
+
+    def __scan_gen(self):
+        self.__file_list = []
+        self.__pfile_list = []
+        self.__dirs = []
         self.__filecount = 0
         self.__pfilecount = 0
+        self.__unstated = 0
+        self.__indexed = set()
+        self.__matcher = None
+        self.__forget_sorted()
         pintot = len(self.__pinned_filenames)
         if pintot != 0:
             temp_pinned_filenames = list(self.__pinned_filenames)
         else:
             temp_pinned_filenames = False
 
-        for root, dirs, files in walk(self.__path, topdown=True):
+        snap = self.__load_snapshot()
+        for reldir, files in self.__scan_tree(snap):
+            self.__dirs.append(reldir)
             for name in files:
-                fp = path.join(root, name)
-                fp_rel = fp[self.__path_len:]
+                fp_rel = reldir + name
+
+                # Stat lazily, only if a stat property is ever needed.
+                file_props = FileRecord(fp_rel)
+                self.__unstated += 1
+
+                if temp_pinned_filenames and name in temp_pinned_filenames:
+                    temp_pinned_filenames.remove(name)
+                    self.__pfile_list.append(file_props)
+                    self.__pfilecount += 1
+                else:
+                    self.__file_list.append(file_props)
+                    self.__filecount += 1
+
+                yield file_props
+
+        if snap:
+            snap.end_scan()
+            snap.save()
+        self.__scanning = None
 
-                if (fp_rel[0] == '.'):
+    def __load_snapshot(self):
+        if not self.__snapshot_path:
+            return(None)
+        if not self.__snapshot:
+            self.__snapshot = snapshot.StatSnapshot(self.__snapshot_path,
+                                                    self.__path)
+        return(self.__snapshot)
+
+    def __list_dir(self, reldir):
+        """List a directory of the repo. File types come from the directory
+        entries themselves, so regular files are not stat'ed here.
+
+        Returns:
+            subdirs -- list of (name, mtime_ns) for each subdirectory.
+            files -- list of file names.
+        """
+        subdirs = []
+        files = []
+        with scandir(self.__path + reldir) as entries:
+            for entry in entries:
+                # Hidden files and directories are only skipped at the root.
+                if not reldir and entry.name[0] == '.':
                     continue
                 try:
-                    filestat = stat(fp)
-                except:
+                    if entry.is_dir():
+                        if not entry.is_symlink():
+                            subdirs.append((entry.name,
+                                            entry.stat().st_mtime_ns))
+                        continue
+                    if entry.is_symlink():
+                        # Skip broken links.
+                        entry.stat()
+                except OSError:
                     continue
+                files.append(entry.name)
+        return(subdirs, files)
+
+    def __fetch_stats(self, keys):
+        """Stat the files that have not been stat'ed since the scan, if any
+        of keys is a stat property."""
+        if not self.__unstated:
+            return
+        if not any(key in _STAT_KEYS for key in keys):
+            return
+        unstated = [file_props for file_props in
+                    self.__file_list + self.__pfile_list
+                    if file_props.size is None]
+        paths = [self.__path + file_props.name for file_props in unstated]
+        if self.__scan_workers > 1:
+            from concurrent.futures import ThreadPoolExecutor
+
+            with ThreadPoolExecutor(self.__scan_workers) as pool:
+                stats_list = list(pool.map(_stat_path, paths))
+        else:
+            stats_list = [_stat_path(fp) for fp in paths]
+
+        for file_props, (stats, key) in zip(unstated, stats_list):
+            file_props.set_stats(stats, key)
+        self.__unstated = 0
 
-                file_props = {}
-                file_props['size'] = filestat[ST_SIZE]
-                file_props['adate'] = filestat[ST_ATIME]
-                file_props['mdate'] = filestat[ST_MTIME]
-                file_props['cdate'] = filestat[ST_CTIME]
-                file_props['name'] = fp_rel
-                file_props['fullpath'] = fp
-                file_props['misc'] = None
-                file_props['tags'] = None
-
-                if temp_pinned_filenames:
-                    if name in temp_pinned_filenames:
-                        temp_pinned_filenames.remove(name)
-                        self.__pfile_list.append(file_props)
-                        self.__pfilecount += 1
+    def __read_dir(self, snap, reldir, mtime_ns=None):
+        """Get the listing of a directory, from the snapshot if its mtime did
+        not change.
+
+        Returns:
+            (mtime_ns, subdirs, files, listed), where listed is True if the
+            directory was actually listed, or None if it can't be read.
+        """
+        try:
+            if mtime_ns is None:
+                mtime_ns = stat(self.__path + reldir).st_mtime_ns
+            if snap:
+                listing = snap.get(reldir, mtime_ns)
+                if listing is not None:
+                    subdirs = [(name, None) for name in listing[0]]
+                    return(mtime_ns, subdirs, listing[1], False)
+            subdirs, files = self.__list_dir(reldir)
+        except OSError:
+            return(None)
+        return(mtime_ns, subdirs, files, True)
+
+    def __walk_job(self, pool, snap, reldir, mtime_ns=None):
+        """Read a directory in a worker thread and queue its subdirectories
+        right away, so that the whole tree is read in parallel."""
+        result = self.__read_dir(snap, reldir, mtime_ns)
+        if result is None:
+            return(None)
+        children = []
+        for name, sub_mtime_ns in result[1]:
+            subdir = reldir + name + '/'
+            children.append((subdir, pool.submit(self.__walk_job, pool, snap,
+                                                 subdir, sub_mtime_ns)))
+        return(result, children)
+
+    def __scan_tree(self, snap=None):
+        """Walk the repo top-down, yielding (reldir, files) for each directory,
+        where reldir is relative to the repo root and ends with '/'. Listings
+        are taken from the snapshot for directories whose mtime is unchanged.
+        With more than one scan worker, directories are read by a thread pool
+        but still yielded in the same order as a serial walk.
+        """
+        if snap:
+            snap.begin_scan()
+
+        if self.__scan_workers > 1:
+            from concurrent.futures import ThreadPoolExecutor
+
+            with ThreadPoolExecutor(self.__scan_workers) as pool:
+                stack = [('', pool.submit(self.__walk_job, pool, snap, ''))]
+                while stack:
+                    reldir, future = stack.pop()
+                    job = future.result()
+                    if job is None:
                         continue
+                    result, children = job
+                    mtime_ns, subdirs, files, listed = result
+                    if listed and snap:
+                        snap.put(reldir, mtime_ns,
+                                 [name for name, mt in subdirs], files)
+                    yield reldir, files
+                    stack.extend(reversed(children))
+            return
 
-                    self.__file_list.append(file_props)
-                    self.__filecount += 1
-                    continue
+        stack = [('', None)]
+        while stack:
+            reldir, mtime_ns = stack.pop()
+            result = self.__read_dir(snap, reldir, mtime_ns)
+            if result is None:
+                continue
+            mtime_ns, subdirs, files, listed = result
+            if listed and snap:
+                snap.put(reldir, mtime_ns,
+                         [name for name, mt in subdirs], files)
+            yield reldir, files
+            for name, sub_mtime_ns in reversed(subdirs):
+                stack.append((reldir + name + '/', sub_mtime_ns))
+
+    def dirnames(self):
+        """Get a list of the directories found by the last scan, relative to
+        the repo root. The root itself is ''."""
+        return(list(self.__dirs))
+
+    def invalidate(self, name, save=True):
+        """Make the next scan re-read the directory holding a note. Notes
+        edited in place do not change the mtime of their directory.
 
-                # if name in self.pinned_filenames:
-                #     self.__pfile_list.append(file_props)
-                #     self.__pfilecount += 1
-                # else:
-                #     self.__file_list.append(file_props)
-                #     self.__filecount += 1
-                self.__file_list.append(file_props)
-                self.__filecount += 1
+        Keyword arguments:
+        name -- name of the note, relative to the repo root.
+        save -- write the snapshot to disk right away (default True)
+        """
+        snap = self.__load_snapshot()
+        if not snap:
+            return
+        if '/' in name:
+            reldir = name.rsplit('/', 1)[0] + '/'
+        else:
+            reldir = ''
+        snap.invalidate(reldir)
+        if save:
+            snap.save()
 
     def add_file(self, filepath, misc_prop=None):
         """Add a file to the file repo.
@@ -171,17 +458,13 @@ class FileRepo:
         except:
             return
 
-        file_props = {}
-        file_props['size'] = filestat[ST_SIZE]
-        file_props['adate'] = filestat[ST_ATIME]
-        file_props['mdate'] = filestat[ST_MTIME]
-        file_props['cdate'] = filestat[ST_CTIME]
-        file_props['name'] = fp_rel
-        file_props['fullpath'] = filepath
-        file_props['misc'] = misc_prop
+        file_props = FileRecord(fp_rel, _stat_tuple(filestat), misc_prop,
+                                _index_key(filestat))
 
         self.__file_list.append(file_props)
         self.__filecount += 1
+        self.__matcher = None
+        self.__forget_sorted()
 
     def sort(self, sortby='name', sortrev=False):
         """Sort notes
@@ -194,23 +477,89 @@ class FileRepo:
             print("Key '" + sortby + "' is not valid.")
             print("Choose between size, adate, mdate, cdate or name.")
 
-        self.__file_list = sorted(self.__file_list,
-                                  key=itemgetter(sortby), reverse=not sortrev)
+        self.finish_scan()
+        self.__fetch_stats([sortby])
+        records = self.__sorted_records(sortby)
+        last = self.__sorted_as
+        if last and last[:2] == (sortby, sortrev) and last[2] is records:
+            # Same order as the last sort, so the launcher input still holds.
+            return
+        self.__sorted_as = (sortby, sortrev, records)
+        if sortrev:
+            self.__file_list = list(records)
+        else:
+            self.__file_list = records[::-1]
+        self.__matcher = None
+        self.__entries = {}
         self.__sorttype = sortby
         self.__sortrev = sortrev
 
+    def __forget_sorted(self):
+        """Keep the sort orders, but match them with the records again, as
+        the files of the repo changed."""
+        self.__orders = {sortby: (order, None) for sortby, (order, records)
+                         in self.__orders.items()}
+        self.__entries = {}
+        self.__sorted_as = None
+
+    def __sorted_records(self, sortby):
+        """Get the records, but the pinned ones, in ascending order of a
+        property, ties in name order. The order is updated from the previous
+        one for the same key, kept in the snapshot between runs, so only the
+        files that were added or changed need to be placed. Its values are
+        checked against the stats taken since the scan, as notes edited in
+        place are not noticed by the snapshot.
+        """
+        order, records = self.__orders.get(sortby, (None, None))
+        if records is not None:
+            return(records)
+        snap = self.__snapshot
+        if order is None and snap:
+            order = snap.get_order(sortby)
+        getter = attrgetter(sortby)
+        by_name = {filen.name: filen for filen in self.__file_list}
+
+        if order is None:
+            new_order = sorted((getter(filen), filen.name)
+                               for filen in self.__file_list)
+            changed = True
+        else:
+            new_order = [entry for entry in order
+                         if entry[1] in by_name and
+                         getter(by_name[entry[1]]) == entry[0]]
+            changed = len(new_order) < len(order)
+            if len(new_order) < len(by_name):
+                changed = True
+                placed = set(name for value, name in new_order)
+                added = sorted((getter(filen), filen.name)
+                               for filen in self.__file_list
+                               if filen.name not in placed)
+                # Two sorted runs, which sorted merges in linear time.
+                new_order = sorted(new_order + added)
+
+        if snap and changed:
+            snap.set_order(sortby, new_order)
+            snap.save()
+        records = [by_name[name] for value, name in new_order]
+        self.__orders[sortby] = (new_order, records)
+        return(records)
+
     def get_property_list(self, prop='name', pinned_first=True):
         """Get a list of a particular property for each file."""
+        self.finish_scan()
         if pinned_first:
-            plist = list(itemgetter(prop)(filen) for filen in self.__file_list)
-            plist += list(itemgetter(prop)(filen) for filen in
-                          self.__pfile_list)
+            file_lists = (self.__file_list, self.__pfile_list)
         else:
-            plist = list(itemgetter(prop)(filen) for filen in
-                         self.__pfile_list)
-            plist += list(itemgetter(prop)(filen) for filen in
-                          self.__file_list)
-        return(plist)
+            file_lists = (self.__pfile_list, self.__file_list)
+        if prop == 'fullpath':
+            # Full paths are not stored, build them from the root.
+            root = self.__path
+            return([root + filen.name for file_list in file_lists
+                    for filen in file_list])
+        self.__fetch_stats([prop])
+        getprop = attrgetter(prop)
+        return([getprop(filen) for file_list in file_lists
+                for filen in file_list])
 
     def is_empty(self):
         return(not self.__filecount > 0)
@@ -227,6 +576,23 @@ class FileRepo:
         """Get the number of files in the repo"""
         return(self.__filecount + self.__pfilecount)
 
+    def find(self, patterns, limit=None):
+        """Fuzzy find notes by name, like fzf does.
+
+        Keyword arguments:
+        patterns -- list of strings that must all be found in a name, in
+                    order but not necessarily next to each other.
+        limit -- maximum number of names to return (default None, all).
+
+        Returns:
+            list of names, best match first.
+        """
+        if self.__matcher is None:
+            import qn.fuzzy as fuzzy
+
+            self.__matcher = fuzzy.FuzzyMatcher(self.filenames())
+        return(self.__matcher.top(patterns, limit))
+
     def set_lineformat(self, new_lineformat):
         """Set the lineformat, which is a list of properties in the order
         in which they should be arranged by lines().
@@ -235,90 +601,345 @@ class FileRepo:
 
     def lines(self, format_list=None, pinned_first=True):
         """Return a list of nicely formattted lines for each file."""
-        lines = []
+        self.finish_scan()
         if not format_list:
             format_list = self.__lineformat
+        self.__fetch_stats(format_list)
+        format_key = tuple(format_list)
+        render = self.__render
+        lines = []
         for filen in self.__file_list:
-            line = ""
-            for formatn in format_list:
-                if formatn in ['adate', 'mdate', 'cdate']:
-                    block = datetime.utcfromtimestamp(filen[formatn])
-                    block = block.strftime('%d/%m/%Y %H:%M')
-                elif formatn == 'size':
-                    size = filen[formatn]
-                    block = sizeof_fmt(size)
-                else:
-                    block = str(filen[formatn])
-
-                blocksize = self.__linebs[formatn]
-                if len(block) >= blocksize:
-                    block = block[:blocksize-2] + '…'
+            cached = filen.line
+            if (cached is not None and cached[0] == (format_key, filen.mdate,
+                                                     filen.size, filen.misc)):
+                lines.append(cached[1])
+            else:
+                lines.append(render(filen, format_key))
+        self.refresh_summaries()
 
-                block = block.ljust(blocksize)
-                line += block
+        return(lines)
 
-            lines.append(line)
+    def entries(self, kind='names', format_list=None):
+        """Get the input of a launcher: the file names ('names') or lines
+        ('lines'), each ended by a NUL, as a single bytes buffer. It is kept
+        until the files or their order change.
 
-        return(lines)
+        Keyword arguments:
+        kind -- 'names' or 'lines' (default 'names').
+        format_list -- line format for 'lines' (default None, the repo's).
+        """
+        if kind == 'lines' and not format_list:
+            format_list = self.__lineformat
+        key = (kind, tuple(format_list or ()))
+        data = self.__entries.get(key)
+        if data is None:
+            if kind == 'lines':
+                entries = self.lines(format_list)
+            else:
+                entries = self.filenames()
+            data = b''
+            if entries:
+                data = ('\x00'.join(entries) + '\x00').encode('utf-8')
+            # Lines with summaries still being extracted change later.
+            if not self.__summaries or not self.__summaries.refreshing():
+                self.__entries[key] = data
+        return(data)
+
+    def format_line(self, filen, format_list=None):
+        """Return the nicely formatted line of a single FileRecord. The line
+        is kept in the record until its format, dates, size or misc change.
+        """
+        if not format_list:
+            format_list = self.__lineformat
+        if filen.size is None and any(key in _STAT_KEYS
+                                      for key in format_list):
+            filen.set_stats(*_stat_path(self.__path + filen.name))
+            self.__unstated -= 1
+        format_key = tuple(format_list)
+        cached = filen.line
+        if (cached is not None and
+                cached[0] == (format_key, filen.mdate, filen.size,
+                              filen.misc)):
+            return(cached[1])
+        return(self.__render(filen, format_key))
+
+    def __render(self, filen, format_key):
+        blocks = []
+        for formatn in format_key:
+            if formatn in _DATE_KEYS:
+                block = format_date(getattr(filen, formatn))
+            elif formatn == 'size':
+                size = filen.size
+                block = sizeof_fmt(size)
+            elif formatn == 'misc' and filen.misc is None:
+                block = self.__summary(filen)
+            else:
+                block = str(getattr(filen, formatn))
+
+            blocksize = self.__linebs[formatn]
+            if len(block) >= blocksize:
+                block = block[:blocksize-2] + '…'
+
+            blocks.append(block.ljust(blocksize))
+
+        line = ''.join(blocks)
+        # A missing summary is shown empty until it is extracted.
+        if not ('misc' in format_key and filen.misc is None and
+                self.__summary_path):
+            filen.line = ((format_key, filen.mdate, filen.size, filen.misc),
+                          line)
+        return(line)
+
+    def __load_summaries(self):
+        if not self.__summaries:
+            self.__summaries = summary.SummaryCache(self.__summary_path,
+                                                    self.__path)
+        return(self.__summaries)
+
+    def __summary(self, filen):
+        """Get the summary of a note from the summary cache, to show as its
+        'misc' block. Notes with no summary yet are left for
+        refresh_summaries and shown with an empty one."""
+        if not self.__summary_path:
+            return(str(filen.misc))
+        ino = filen.key[3] if filen.key else None
+        summary_text = self.__load_summaries().get(filen.name, filen.mdate,
+                                                   filen.size, ino)
+        if summary_text is None or filen.size is None:
+            self.__summary_pending.append(filen.name)
+        if summary_text is None:
+            return('')
+        filen.misc = summary_text
+        return(summary_text)
+
+    def refresh_summaries(self):
+        """Extract, in a background thread, the summaries that format_line
+        found missing or could not check."""
+        if not self.__summary_pending:
+            return
+        self.__summary_pending, pending = [], self.__summary_pending
+        keep = None
+        if not self.__scanning:
+            keep = set(filen.name for file_list in (self.__file_list,
+                                                    self.__pfile_list)
+                       for filen in file_list)
+        self.__load_summaries().refresh(pending, keep)
 
     def pin_files(self, filelist_topin):
         """Pin a file WIP"""
         self.__pinned_filenames = filelist_topin
         return(1)
 
-    def search_files(self, queries_list):
-        """Search the contents of files and return matches."""
+    def set_search_index(self, index, kind='words'):
+        """Use a search_index.SearchIndex ('words') to narrow down
+        search_files, a search_index.PositionalIndex ('positions') to answer
+        its phrase and proximity queries, or a search_index.TrigramIndex
+        ('trigrams') to narrow down grep_files."""
+        self.__indexes[kind] = index
+
+    def search_index(self, kind='words'):
+        """Get the index of a kind (see search_index.INDEX_KINDS), loading it
+        if needed, and bring it up to date with the repo once per scan. The
+        notes are stat'ed once for every index and view: the snapshot only
+        notices changes to directories, not notes edited in place. Indexes
+        shared from another repo with set_search_index are used as they
+        are. None if the index can't be opened or written."""
+        index = self.__indexes.get(kind)
+        if not self.__index_paths:
+            return(index)
+        try:
+            if not index and kind in self.__index_paths:
+                index = search_index.INDEX_KINDS[kind](
+                    self.__index_paths[kind], self.__path)
+                self.__indexes[kind] = index
+            if index and kind not in self.__indexed:
+                self.finish_scan()
+                self.__fetch_stats(_STAT_KEYS)
+                records = self.__pfile_list + self.__file_list
+                index.update([filen.name for filen in records],
+                             [filen.key for filen in records])
+                self.__indexed.add(kind)
+        except OSError:
+            # Search without it.
+            self.__indexes.pop(kind, None)
+            return(None)
+        return(index)
+
+    def set_result_cache(self, cache, query_key=()):
+        """Use a result_cache.ResultCache for search_files and grep_files.
+
+        Keyword arguments:
+        cache -- ResultCache of the repo this one was searched from.
+        query_key -- key of the searches that gave this repo, so that
+                     refinements of them are cached too (default ()).
+        """
+        self.__result_cache = cache
+        self.__query_key = query_key
+
+    def result_cache(self):
+        """Get the result cache of the repo, loading it if needed."""
+        if not self.__result_cache and self.__cache_path:
+            self.__result_cache = result_cache.ResultCache(self.__cache_path,
+                                                           self.__path)
+        return(self.__result_cache)
+
+    def __cached_matches(self, key, index):
+        """Get the cached (filepath, misc) matches of a search, or None."""
+        cache = self.result_cache()
+        if not cache or not index:
+            return(None)
+        matches = cache.get(key, index.generation)
+        if matches is None:
+            return(None)
+        return([(self.__path + name, misc) for name, misc in matches])
+
+    def __cache_matches(self, key, index, matches):
+        cache = self.result_cache()
+        if not cache or not index:
+            return
+        cache.put(key, index.generation,
+                  [(fp[self.__path_len:], misc) for fp, misc in matches])
+
+    def __rank(self, matches, queries_list, limit=None):
+        """Order (filepath, misc) matches best first by the BM25 score of
+        their notes in the words index, if there is one. The index is only
+        loaded if there is something to rank.
+
+        Keyword arguments:
+        matches -- list of (filepath, misc) tuples.
+        queries_list -- list of query strings to rank the matches by.
+        limit -- maximum number of matches to keep (default None, all).
+        """
+        index = None
+        if queries_list and len(matches) > 1:
+            index = self.search_index('words')
+        if index:
+            misc = {fp[self.__path_len:]: match for fp, match in matches}
+            names = index.rank(list(misc), queries_list, limit)
+            return([(self.__path + name, misc[name]) for name in names])
+        if limit is not None:
+            return(matches[:limit])
+        return(matches)
+
+    def __results_repo(self, matches, key):
+        """Build the repo of the matches of a search."""
+        results_file_repo = FileRepo(self.__path)
+        for kind, index in self.__indexes.items():
+            results_file_repo.set_search_index(index, kind)
+        if self.result_cache():
+            results_file_repo.set_result_cache(self.result_cache(), key)
+        for fp, match in matches:
+            results_file_repo.add_file(fp, match)
+        return(results_file_repo)
+
+    def __positions_match(self, filepath, positional):
+        """Check parsed positional queries against a file, for repos without
+        a positional index."""
+        doc_positions = search_index.read_positions(filepath)
+        return(all(search_index.positions_match(doc_positions, parsed)
+                   for parsed in positional))
+
+    def search_files(self, queries_list, limit=None):
+        """Search the contents of files and return matches, best first.
+        Results are cached until a note changes, if the repo has a result
+        cache.
+
+        Keyword arguments:
+        queries_list -- list of strings that must all be found in a file,
+                        case insensitive. Quoted phrases and NEAR/k queries
+                        from search_index.parse_filter match whole words in
+                        sequence or within k words of each other.
+        limit -- maximum number of matches to return (default None, all).
+        """
         if not self.__file_list:
             print("No files added to file repo")
             return(1)
-        results_file_repo = FileRepo(self.__path)
-        for fp in self.filepaths():
-            match = ""
-            queries_p = list(queries_list)
-            notefile = open(fp, 'r')
-            try:
-                for line in notefile:
-                    if not queries_p:
-                        results_file_repo.add_file(fp, match)
-                        notefile.close()
-                        break
-                    for qp in list(queries_p):
-                        if qp.lower() in line.lower():
-                            match = line
-                            queries_p.remove(qp)
-            except:  # Not pretty, but for now it works.
-                continue
+        index = self.search_index('words')
+        key = self.__query_key + (result_cache.normalize_search(queries_list),
+                                  limit)
+        matches = self.__cached_matches(key, index)
+        if matches is None:
+            plain = []
+            positional = []
+            for query in queries_list:
+                parsed = search_index.positional_query(query)
+                if parsed is None:
+                    plain.append(query)
+                else:
+                    positional.append(parsed)
+            # Every word of a positional query is in its matching lines.
+            line_queries = list(plain)
+            for parsed in positional:
+                line_queries.extend(search_index.query_terms(parsed))
+
+            candidates = None
+            if index and plain:
+                candidates = index.candidates(plain)
+            positions = None
+            if positional:
+                positions = self.search_index('positions')
+            if positions:
+                for parsed in positional:
+                    if candidates is None:
+                        candidates = positions.matching(parsed)
+                    else:
+                        candidates &= positions.matching(parsed)
+            filepaths = self.filepaths()
+            if candidates is not None:
+                root = self.__path
+                filepaths = [root + name for name in self.filenames()
+                             if name in candidates]
+            import qn.content_search as content_search
+
+            matches = content_search.search_paths(filepaths, line_queries)
+            if positional and not positions:
+                matches = [(fp, match) for fp, match in matches
+                           if self.__positions_match(fp, positional)]
+            matches = self.__rank(matches, line_queries, limit)
+            self.__cache_matches(key, index, matches)
+
+        results_file_repo = self.__results_repo(matches, key)
         print(results_file_repo.filecount(), results_file_repo.is_empty())
         if results_file_repo.is_empty():
             return(None)
         else:
             return(results_file_repo)
 
-    def grep_files(self, filters_string):
-        """Search the contents of files and return matches. Uses grep."""
+    def grep_files(self, filters_string, limit=None):
+        """Search the contents of files and return matches, best first. Uses
+        ripgrep for plain strings if it is installed, grep otherwise. Results
+        are cached until a note changes, if the repo has a result cache.
+
+        Keyword arguments:
+        filters_string -- grep basic regular expression to search for.
+        limit -- maximum number of matches to return (default None, all).
+        """
         if not self.__file_list:
             print("No files added to file repo")
             return(1)
-        grep_file_repo = FileRepo(self.__path)
-
-        proc = Popen(['grep', '-i', '-I', filters_string] + self.filepaths(),
-                     stdout=PIPE)
-        answer = proc.stdout.read().decode('utf-8')
-        proc.wait()
-
-        grep_file_repo = FileRepo(self.__path)
-        temp_files = []
-        if answer == '':
+        index = self.search_index('trigrams')
+        key = self.__query_key + (result_cache.normalize_grep(filters_string),
+                                  limit)
+        matches = self.__cached_matches(key, index)
+        if matches is None:
+            filepaths = self.filepaths()
+            if index:
+                candidates = index.candidates(filters_string)
+                if candidates is not None:
+                    root = self.__path
+                    filepaths = [root + name for name in self.filenames()
+                                 if name in candidates]
+            import qn.content_search as content_search
+
+            matches = content_search.grep_paths(filepaths, filters_string)
+            # Rank by the words the pattern can't match without.
+            literals = search_index.required_literals(filters_string)
+            matches = self.__rank(matches, literals, limit)
+            self.__cache_matches(key, index, matches)
+        if not matches:
             return(None)
 
-        for ans in answer.split("\n"):
-            if ans:
-                ans = ans.split(':', 1)
-                if not ans[0] in temp_files:
-                    grep_file_repo.add_file(ans[0], ans[1])
-                    temp_files.append(ans[0])
-
-        return(grep_file_repo)
+        return(self.__results_repo(matches, key))
 
 
 class QnApp ():
@@ -334,8 +955,11 @@ class QnApp ():
         self.__qntrash = qnoptions.qntrash
         self.__hkman = {}
         self.__file_repo = {}
+        self.__daemon = None
+        self.__mime_cache = None
 
-    def add_repo(self, repopath=None, repoinstance='default',):
+    def add_repo(self, repopath=None, repoinstance='default',
+                 use_snapshot=True):
         """Add a note repository to an instance of qn. It creates a FileRepo
         class.
 
@@ -345,10 +969,58 @@ class QnApp ():
         repoinstance -- qn instance name for the repository. This allows qn
                         to have multiple repositories that can be handled
                         independently.
+        use_snapshot -- keep a stat snapshot, search indexes, recent
+                        search results and note summaries of the repository
+                        in the qn data directory, so rescans only list what
+                        changed and searches only read candidate notes
+                        (default True)
         """
         if repopath is None:
             repopath = self.__qndir
-        self.__file_repo[repoinstance] = FileRepo(repopath)
+        snapshot_path = None
+        index_paths = None
+        cache_path = None
+        summary_path = None
+        if use_snapshot and self.__options.qndata:
+            snapshot_path = snapshot.snapshot_path(self.__options.qndata,
+                                                   repoinstance)
+            index_paths = {}
+            for kind in search_index.INDEX_KINDS:
+                index_paths[kind] = search_index.index_path(
+                    self.__options.qndata, repoinstance, kind)
+            cache_path = result_cache.cache_path(self.__options.qndata,
+                                                 repoinstance)
+            summary_path = summary.cache_path(self.__options.qndata,
+                                              repoinstance)
+        if self.__daemon:
+            self.__file_repo[repoinstance] = self.__daemon.repo(
+                repopath, snapshot_path, self.__options.scan_workers,
+                index_paths, cache_path, summary_path)
+        else:
+            self.__file_repo[repoinstance] = FileRepo(
+                repopath, snapshot_path, self.__options.scan_workers,
+                index_paths, cache_path, summary_path)
+
+    @property
+    def daemon(self):
+        return(self.__daemon)
+
+    def connect_daemon(self, sock_path=None):
+        """Use a running qn daemon (qnd) for repositories added from now on.
+        Returns False if no daemon answers, in which case repositories are
+        scanned locally as usual.
+
+        Keyword arguments:
+        sock_path -- path to the daemon socket (default None, the standard
+                     socket path)
+        """
+        import qn.daemon_client as daemon_client
+
+        client = daemon_client.DaemonClient(sock_path)
+        if not client.ping():
+            return(False)
+        self.__daemon = client
+        return(True)
 
     def add_existing_repo(self, existing_file_repo, repoinstance):
         """Add an existing, populated, FileRepo class to an instance."""
@@ -429,18 +1101,17 @@ class QnApp ():
         """Find a note based on a list of strings.
 
         Keyword Arguments:
-            findstringlist -- list of strings to match with note names.
+            findstringlist -- list of strings to fuzzy match with note names,
+                              best matches are listed first.
             open_note -- boolean on whether to open the note found
             instance -- qn instance on which to conduct the matching"""
 
-        tmp_filelist = self.__file_repo[instance].filenames()[:]
         found_list = []
-        for filen in tmp_filelist:
-            if all((fstring in filen) for fstring in findstringlist):
-                if open_note:
-                    found_list.append(filen)
-                else:
-                    print(filen)
+        for filen in self.__file_repo[instance].find(findstringlist):
+            if open_note:
+                found_list.append(filen)
+            else:
+                print(filen)
 
         if open_note:
             found_num = len(found_list)
@@ -521,6 +1192,8 @@ class QnApp ():
         # check if destination already exists
         if path.exists(full_dir2):
             print('Note with same name found, creating conflict.')
+            from datetime import datetime
+
             appended = "-conflict-"
             appended += datetime.now().strftime('%Y%m%d_%H%M%S')
             full_dir2 += appended
@@ -569,8 +1242,10 @@ class QnApp ():
         inter = self.options.interactive
         fulldir = path.join(self.qndir, note)
         if path.isfile(fulldir):
+            if self.file_repo('default'):
+                self.file_repo('default').invalidate(note)
             # mime = file_mime_type(note).split("/")
-            mime = file_mime_type_bash(fulldir).strip().split("/")
+            mime = self.mime_type(fulldir).split("/")
             fulldir = path.join(self.qndir, note).strip()
             editor_command = self.options.editor + " '" + fulldir + "'"
 
@@ -594,6 +1269,18 @@ class QnApp ():
             print(fulldir + " is not a note")
             exit(1)
 
+    def mime_type(self, filepath):
+        """Get the MIME type of a note, from a cache kept in the qn data dir,
+        see mime.MimeCache."""
+        if self.__mime_cache is None:
+            import qn.mime as mime
+
+            cache_path = None
+            if self.__options.qndata:
+                cache_path = mime.cache_path(self.__options.qndata)
+            self.__mime_cache = mime.MimeCache(cache_path)
+        return(self.__mime_cache.get(filepath))
+
     def new_note(self, note):
         """Create a new note"""
 
@@ -1,16 +1,88 @@
 #!/bin/env python3
 
 import qn.qn as qn
+import qn.search_index as search_index
+import qn.startup as startup
 
-from os import path
-from sys import exit
-from struct import pack
+import threading
+from contextlib import redirect_stdout
+from os import path, environ, fork, setsid, devnull, dup2, _exit
+from sys import exit, stdout
 from subprocess import Popen, PIPE
 
 
+# Hotkeys of each view, in the order they are bound.
+_VIEW_HOTKEYS = {
+    'default': ['forcenew', 'delete', 'rename', 'grep', 'showtrash',
+                'showhelp', 'sortname', 'sortcdate', 'sortmdate', 'sortsize'],
+    'trash': ['showtrash', 'showhelp'],
+    'filtered': ['grep'],
+    'help': ['showhelp'],
+    'session': ['forcenew', 'delete', 'rename'],
+}
+# rofi binds every hotkey once for all the views of script mode.
+_VIEW_HOTKEYS['script'] = _VIEW_HOTKEYS['default']
+# Hotkeys that switch views without leaving the fzf of a session.
+_SESSION_RELOADS = ['grep', 'showtrash', 'showhelp', 'sortname', 'sortcdate',
+                    'sortmdate', 'sortsize']
+# Sort hotkeys, and the sortby and default_sortrev of show_sorted_default.
+_SORT_HOTKEYS = {'sortname': ('name', True), 'sortcdate': ('cdate', False),
+                 'sortmdate': ('mdate', False), 'sortsize': ('size', False)}
+
+
+def join_entries(entries):
+    """Encode launcher entries into a single buffer, each one ended by a NUL.
+    """
+    if not entries:
+        return(b'')
+    return(('\x00'.join(entries) + '\x00').encode('utf-8'))
+
+
 class QnAppRF(qn.QnApp):
     """Class that has all the methods for the fzf and rofi interfaces"""
 
+    def __init__(self, qnoptions):
+        super().__init__(qnoptions)
+        self.__hotkey_args = {}  # instance -> launcher hotkey arguments
+        self.__session_view = None  # (view, view_args) shown in the session
+
+    def run(self, view='default', **view_args):
+        """Show views until one of them quits. Each view returns the next
+        one to show instead of calling it, so moving between views does not
+        grow the stack, and the repos and hotkeys of each view are kept
+        between visits.
+
+        Keyword arguments:
+        view -- name of the first view: 'default', 'sorted', 'trash',
+                'filtered' or 'help' (default 'default').
+        view_args -- keyword arguments of the first view.
+        """
+        if (self.launcher == 'fzf' and self.options.fzf_session and
+                view == 'default' and not view_args):
+            return(self.run_session())
+        views = {'default': self.show_default,
+                 'sorted': self.show_sorted_default,
+                 'trash': self.show_trash,
+                 'filtered': self.show_filtered,
+                 'help': self.show_help}
+        state = (view, view_args)
+        while state:
+            view, view_args = state
+            state = views[view](**view_args)
+        return(0)
+
+    def hotkey_args(self, instance):
+        """Get the launcher arguments for the hotkeys of a view. Its
+        HotkeyManager is set up on the first call."""
+        if instance not in self.__hotkey_args:
+            self.add_hkman(instance)
+            hkeys = self.options.hotkeys
+            for optname in _VIEW_HOTKEYS[instance]:
+                self.hkman(instance).add_key(*hkeys[optname])
+            self.__hotkey_args[instance] = \
+                self.hkman(instance).generate_hotkey_args()
+        return(self.__hotkey_args[instance])
+
     def run_launcher(self, entries, additional_args=[]):
         """Runs the launcher (fzf/rofi) showing the entries, and applying any
         additional arguments for the launcher.
@@ -24,14 +96,8 @@ class QnAppRF(qn.QnApp):
             answer -- stdout of the launcher.
             exit_code -- exit code returned by launcher.
         """
-        proc = Popen(self.options.command + additional_args,
-                     stdin=PIPE, stdout=PIPE)
-        for e in entries:
-            proc.stdin.write((e).encode('utf-8'))
-            proc.stdin.write(pack('B', 0))
-        proc.stdin.close()
-        answer = proc.stdout.read().decode("utf-8")
-        exit_code = proc.wait()
+        answer, exit_code = self.__launch(additional_args,
+                                          join_entries(entries))
 
         if answer == '':
             return(None, exit_code)
@@ -43,32 +109,66 @@ class QnAppRF(qn.QnApp):
 
         return(answer, int(exit_code))
 
-    def show_note_selector(self, instance, additional_args=[]):
+    def __launch(self, additional_args, data=b'', feed=None):
+        """Run the launcher, writing its input while reading its output so
+        that neither side can block the other.
+
+        Keyword arguments:
+        additional_args -- list of launcher command line arguments.
+        data -- bytes to write to the launcher (default b'').
+        feed -- function that writes to the launcher's stdin, given as its
+                argument, and closes it. It runs in a thread while the output
+                is read. Replaces data if given (default None).
+
+        Returns:
+            answer -- stdout of the launcher.
+            exit_code -- exit code returned by launcher.
+        """
+        proc = Popen(self.options.command + additional_args, stdin=PIPE,
+                     stdout=PIPE)
+        startup.mark('first launcher write')
+        if feed is None:
+            answer = proc.communicate(data)[0]
+        else:
+            feeder = threading.Thread(target=feed, args=(proc.stdin,))
+            feeder.start()
+            answer = proc.stdout.read()
+            proc.stdout.close()
+            feeder.join()
+        exit_code = proc.wait()
+        return(answer.decode('utf-8'), exit_code)
+
+    def show_note_selector(self, instance, additional_args=[], stream=None):
         """Show notes in launcher
 
         Keyword arguments:
         instance -- qn instance to show.
         additiona_args -- list of any additional arguments to pass to the
                           launcher.
+        stream -- iterator of FileRecords (from FileRepo.scan_iter) to write
+                  to the launcher as they arrive, instead of the sorted repo.
+                  (default None)
         """
 
         appname = self.launcher
-        if appname == 'rofi':
-            applist = self.file_repo(instance).lines()
-        elif appname == 'fzf':
-            applist = self.file_repo(instance).filenames()
-        else:
+        data = b''
+        if stream is None and appname == 'rofi':
+            data = self.file_repo(instance).entries('lines')
+        elif stream is None and appname == 'fzf':
+            data = self.file_repo(instance).entries('names')
+        elif appname not in ('rofi', 'fzf'):
             print("ERROR: appname '" + appname + "' not implemented")
 
-        proc = Popen(self.options.command + additional_args, stdin=PIPE,
-                     stdout=PIPE)
+        shown = None
+        if stream is not None:
+            shown = []
 
-        for e in applist:
-            proc.stdin.write((e).encode('utf-8'))
-            proc.stdin.write(pack('B', 0))
-        proc.stdin.close()
-        answer = proc.stdout.read().decode("utf-8")
-        exit_code = proc.wait()
+            def feed(stdin):
+                self.__write_stream(stdin, instance, stream, shown)
+
+            answer, exit_code = self.__launch(additional_args, feed=feed)
+        else:
+            answer, exit_code = self.__launch(additional_args, data)
 
         if answer == '':
             return(False)
@@ -84,6 +184,8 @@ class QnAppRF(qn.QnApp):
             POS = int(answer[2])
             if POS == -1:
                 NOTE = None
+            elif shown is not None:
+                NOTE = shown[POS].strip()
             else:
                 NOTE = self.file_repo(instance).filenames()[POS].strip()
             if exit_code == 0:
@@ -94,103 +196,163 @@ class QnAppRF(qn.QnApp):
                 if self.hkman(instance):
                     OPTSEL = self.hkman(instance).get_opt(exit_code)
         elif appname == 'fzf':
-            answer = answer.split('\x00')
-            if not answer:
-                return(False)
-            if len(answer) < 4:
-                FILTER, KEY, MISC = answer[0:3]
-                NOTE = None
-            else:
-                FILTER, KEY, NOTE, MISC = answer
-                NOTE = NOTE.strip()
-            FILTER = FILTER.strip()
-            KEY = KEY.strip()
-            if not FILTER:
-                FILTER = None
-            if KEY:
-                if self.hkman(instance):
-                    OPTSEL = self.hkman(instance).get_opt(KEY)
-                else:
-                    OPTSEL = None
-            else:
-                OPTSEL = None
-            POS = None
+            return(self.__fzf_answer(answer, instance))
         else:
             print('Appname "' + appname + '"not implemented.')
             return(False)
 
         return(NOTE, FILTER, OPTSEL)
 
+    def __fzf_answer(self, answer, instance):
+        """Get the note, filter and hotkey optname from the output of fzf."""
+        answer = answer.split('\x00')
+        if not answer:
+            return(False)
+        if len(answer) < 4:
+            FILTER, KEY, MISC = answer[0:3]
+            NOTE = None
+        else:
+            FILTER, KEY, NOTE, MISC = answer
+            NOTE = NOTE.strip()
+        FILTER = FILTER.strip()
+        KEY = KEY.strip()
+        if not FILTER:
+            FILTER = None
+        if KEY:
+            if self.hkman(instance):
+                OPTSEL = self.hkman(instance).get_opt(KEY)
+            else:
+                OPTSEL = None
+        else:
+            OPTSEL = None
+
+        return(NOTE, FILTER, OPTSEL)
+
+    def __write_stream(self, stdin, instance, stream, shown):
+        """Write FileRecords to the launcher as the scan finds them. The
+        names written are added to shown, in order, to map rofi's row back
+        to a note."""
+        file_repo = self.file_repo(instance)
+        try:
+            for file_props in stream:
+                if self.launcher == 'rofi':
+                    entry = file_repo.format_line(file_props)
+                else:
+                    entry = file_props.name
+                stdin.write((entry + '\x00').encode('utf-8'))
+                stdin.flush()
+                shown.append(file_props.name)
+            stdin.close()
+        except BrokenPipeError:
+            # The launcher exited before the scan was done.
+            try:
+                stdin.close()
+            except OSError:
+                pass
+        file_repo.refresh_summaries()
+
     def show_default(self):
+        """Show the notes. Returns the next view to show, as a
+        (view, view_args) tuple, or None to quit. See run()."""
 
         instance = 'default'
-        if not self.hkman(instance):
-            self.add_hkman(instance)
-            hkeys = self.options.hotkeys
-            self.hkman(instance).add_key(*hkeys['forcenew'])
-            self.hkman(instance).add_key(*hkeys['delete'])
-            self.hkman(instance).add_key(*hkeys['rename'])
-            self.hkman(instance).add_key(*hkeys['grep'])
-            self.hkman(instance).add_key(*hkeys['showtrash'])
-            self.hkman(instance).add_key(*hkeys['showhelp'])
-            self.hkman(instance).add_key(*hkeys['sortname'])
-            self.hkman(instance).add_key(*hkeys['sortcdate'])
-            self.hkman(instance).add_key(*hkeys['sortmdate'])
-            self.hkman(instance).add_key(*hkeys['sortsize'])
-
-        hotkey_args = self.hkman(instance).generate_hotkey_args()
+        hotkey_args = self.hotkey_args(instance)
 
+        stream = None
         if not self.file_repo(instance):
             self.add_repo(self.qndir, instance)
-            self.file_repo(instance).scan_files()
-
-        self.file_repo(instance).sort(self.options.sorttype,
-                                      self.options.sortrev)
+            if self.options.stream and not self.daemon:
+                # Sorting needs the whole list, so the first view is shown
+                # unsorted while it is being scanned.
+                stream = self.file_repo(instance).scan_iter()
+            else:
+                self.file_repo(instance).scan_files()
+            if self.options.summary:
+                self.file_repo(instance).set_lineformat(['name', 'misc',
+                                                         'cdate'])
 
-        MESG = 'Press "' + self.options.hotkeys['showhelp'][1]
-        MESG += '" to see a list of hotkeys.'
-        if self.options.help:
-            MESG += self.options.help
-        MESG += ' Sorted by: ' + self.file_repo(instance).sorttype
+        if stream is None:
+            self.file_repo(instance).sort(self.options.sorttype,
+                                          self.options.sortrev)
+            startup.mark('notes sorted')
 
-        if self.file_repo(instance).sortrev:
-            MESG += ' [v]'
-        else:
-            MESG += ' [^]'
+        MESG = self.__default_mesg(stream is None)
 
         extra_args = self.options.gen_instance_args(instance, alt_help=MESG)
         extra_args.extend(hotkey_args)
 
-        ANSWER = self.show_note_selector(instance, extra_args)
+        ANSWER = self.show_note_selector(instance, extra_args, stream)
         if not ANSWER:
-            return(0)
+            return(None)
 
         NOTE, FILTER, OPTSEL = ANSWER
 
         print(NOTE, '|', FILTER, '|', OPTSEL)
         if not OPTSEL:
-            if not NOTE:
-                print("Creating file from filter...")
-                self.new_note(FILTER)
-                return(0)
+            self.__open_or_create(NOTE, FILTER)
+            return(None)
+
+        if OPTSEL in ('delete', 'rename', 'forcenew'):
+            self.__note_hotkey(NOTE, FILTER, OPTSEL)
+        elif OPTSEL == 'showtrash':
+            return(('trash', {}))
+        elif OPTSEL == 'grep':
+            if not FILTER:
+                return(('default', {}))
+            return(('filtered', {'file_repo': self.file_repo('default'),
+                                 'FILTER': FILTER}))
+    #   # elif OPTSEL == 'addtag':
+    #   #     print('Add Tag to Note')
+    #   # elif OPTSEL == 'showtagb':
+    #   #     print('Browse Tags')
+    #   # elif OPTSEL == 'showtagm':
+    #   #     print('Show Note Tags')
+        elif OPTSEL == 'showhelp':
+            return(('help', {'enter_help': "Create/Edit note"}))
+        if OPTSEL in _SORT_HOTKEYS:
+            sortby, default_sortrev = _SORT_HOTKEYS[OPTSEL]
+            return(('sorted', {'sortby': sortby,
+                               'default_sortrev': default_sortrev}))
+        return(None)
+
+    def __default_mesg(self, is_sorted=True):
+        """Help message of the notes view."""
+        MESG = 'Press "' + self.options.hotkeys['showhelp'][1]
+        MESG += '" to see a list of hotkeys.'
+        if self.options.help:
+            MESG += self.options.help
+        if not is_sorted:
+            MESG += ' Unsorted, press a sort hotkey to sort.'
+        else:
+            MESG += ' Sorted by: ' + self.file_repo('default').sorttype
+
+            if self.file_repo('default').sortrev:
+                MESG += ' [v]'
             else:
-                notepath = path.join(self.qndir, NOTE)
-                print('path', notepath)
-                if path.isfile(notepath):
-                    print("file found, editing...")
-                    self.open_note(NOTE)
-                    return(0)
-                else:
-                    print("file not found, create...")
-                    self.new_note(FILTER)
-                    return(0)
+                MESG += ' [^]'
+        return(MESG)
+
+    def __open_or_create(self, NOTE, FILTER):
+        """Open the selected note, or create one named after the filter."""
+        if not NOTE:
+            print("Creating file from filter...")
+            self.new_note(FILTER)
+        else:
+            notepath = path.join(self.qndir, NOTE)
+            print('path', notepath)
+            if path.isfile(notepath):
+                print("file found, editing...")
+                self.open_note(NOTE)
+            else:
+                print("file not found, create...")
+                self.new_note(FILTER)
 
+    def __note_hotkey(self, NOTE, FILTER, OPTSEL):
+        """Run the delete, rename or forcenew hotkeys of the notes view."""
         if OPTSEL == 'delete':
             self.show_delete(NOTE)
         elif OPTSEL == 'rename':
             self.show_rename(NOTE)
-        elif OPTSEL == 'showtrash':
-            self.show_trash()
         elif OPTSEL == 'forcenew':
             if not FILTER:
                 if not NOTE:
@@ -200,35 +362,16 @@ class QnAppRF(qn.QnApp):
             elif not FILTER.strip():
                 exit(0)
             self.force_new_note(FILTER.strip())
-        elif OPTSEL == 'grep':
-            if not FILTER:
-                self.show_default()
-            else:
-                self.show_filtered(self.file_repo('default'), FILTER)
-    #   # elif OPTSEL == 'addtag':
-    #   #     print('Add Tag to Note')
-    #   # elif OPTSEL == 'showtagb':
-    #   #     print('Browse Tags')
-    #   # elif OPTSEL == 'showtagm':
-    #   #     print('Show Note Tags')
-        elif OPTSEL == 'showhelp':
-            self.show_help(enter_help="Create/Edit note")
-        if OPTSEL == 'sortname':
-            self.show_sorted_default('name', True)
-        elif OPTSEL == 'sortcdate':
-            self.show_sorted_default('cdate')
-        elif OPTSEL == 'sortmdate':
-            self.show_sorted_default('mdate')
-        elif OPTSEL == 'sortsize':
-            self.show_sorted_default('size')
 
     def show_sorted_default(self, sortby, default_sortrev=False):
+        """Sort the notes by sortby, or reverse the order if they already
+        are, and go back to the notes."""
         if self.options.sorttype == sortby:
             self.options.set_sortrev(not self.options.sortrev)
         else:
             self.options.set_sortrev(default_sortrev)
         self.options.set_sorttype(sortby)
-        self.show_default()
+        return(('default', {}))
 
     def show_yesno(self, MESG, TITLE='qn dialog: '):
 
@@ -299,22 +442,14 @@ class QnAppRF(qn.QnApp):
             exit(0)
 
     def show_trash(self):
+        """Show the deleted notes, to restore them. Returns the next view to
+        show, or None to quit."""
 
         instance = 'trash'
-        if not self.hkman(instance):
-            self.add_hkman(instance)
-            self.hkman(instance).add_key(*self.options.hotkeys['showtrash'])
-            self.hkman(instance).add_key(*self.options.hotkeys['showhelp'])
-        hotkey_args = self.hkman(instance).generate_hotkey_args()
+        hotkey_args = self.hotkey_args(instance)
 
-        MESG = 'Press enter to restore file. "'
-        MESG += self.hkman(instance).get_keybinding('showtrash')
-        MESG += '" to go back to qn.'
-
-        if not self.file_repo(instance):
-            self.add_repo(self.qntrash, instance)
-            self.file_repo(instance).scan_files()
-        self.file_repo(instance).sort('cdate')
+        MESG = self.__trash_mesg()
+        self.__trash_repo()
 
         extra_args = self.options.gen_instance_args('default', alt_help=MESG,
                                                     alt_prompt='qn trash: ')
@@ -322,23 +457,41 @@ class QnAppRF(qn.QnApp):
 
         ANSWER = self.show_note_selector(instance, extra_args)
         if not ANSWER:
-            return(0)
+            return(None)
         NOTE, FILTER, OPTSEL = ANSWER
         if not OPTSEL:
             if not NOTE:
-                return(0)
+                return(None)
             else:
                 self.show_undelete(NOTE)
         if OPTSEL == 'showtrash':
-            self.show_default()
+            return(('default', {}))
+        return(None)
+
+    def __trash_mesg(self):
+        MESG = 'Press enter to restore file. "'
+        MESG += self.options.hotkeys['showtrash'][1]
+        MESG += '" to go back to qn.'
+        return(MESG)
+
+    def __trash_repo(self):
+        """Get the repo of the deleted notes, scanned on first use."""
+        instance = 'trash'
+        if not self.file_repo(instance):
+            self.add_repo(self.qntrash, instance)
+            self.file_repo(instance).scan_files()
+        self.file_repo(instance).sort('cdate')
+        return(self.file_repo(instance))
 
     def show_filtered(self, file_repo, FILTER, use_grep=False):
+        """Show the notes of file_repo that match FILTER. Returns the next
+        view to show, or None to quit."""
+
+        if not FILTER:
+            return(('default', {}))
 
         instance = 'filtered'
-        if not self.hkman(instance):
-            self.add_hkman(instance)
-            self.hkman(instance).add_key(*self.options.hotkeys['grep'])
-        hotkey_args = self.hkman(instance).generate_hotkey_args()
+        hotkey_args = self.hotkey_args(instance)
 
         MESG = "List of notes filtered for '" + FILTER + "'."
         MESG += " Press '" + self.hkman(instance).get_keybinding('grep')
@@ -349,70 +502,72 @@ class QnAppRF(qn.QnApp):
                                                     alt_prompt=TITLE)
         extra_args.extend(hotkey_args)
 
-        filters = FILTER.strip().split(" ")
+        filtered_repo = self.__filter_repo(file_repo, FILTER, use_grep)
+        if not filtered_repo:
+            self.show_warning(self.__no_matches_mesg(FILTER, use_grep))
+            return(('default', {}))
 
-        if not FILTER:
-            self.show_default()
+        ANSWER = self.show_note_selector(instance, extra_args)
+
+        if not ANSWER:
+            return(None)
+
+        NOTE, FILTER, OPTSEL = ANSWER
+
+        if not OPTSEL:
+            self.__open_or_create(NOTE, FILTER)
+            return(None)
 
+        if OPTSEL == 'grep':
+            if not FILTER:
+                return(('default', {}))
+            return(('filtered', {'file_repo': filtered_repo,
+                                 'FILTER': FILTER}))
+        return(None)
+
+    def __filter_repo(self, file_repo, FILTER, use_grep=False):
+        """Get a repo of the notes of file_repo matching FILTER, added as the
+        'filtered' instance, or None if none match."""
+        instance = 'filtered'
+        limit = self.options.max_results or None
         if use_grep:
+            filters = FILTER.strip().split(" ")
             filtered_repo = file_repo
-            for f in filters:
-                filtered_repo = filtered_repo.grep_files(f)
+            for n, f in enumerate(filters):
+                # Only the last filter cuts the results down to the best.
+                if n < len(filters) - 1:
+                    filtered_repo = filtered_repo.grep_files(f)
+                else:
+                    filtered_repo = filtered_repo.grep_files(f, limit)
                 if not filtered_repo:
-                    self.show_warning("No matches found for filters: " +
-                                      "".join(f + ", " for f in filters)[:-2] +
-                                      ". Press Enter to go back")
-                    self.show_default()
-                    return(0)
+                    return(None)
         else:
-            filtered_repo = file_repo.search_files(filters)
+            # Quoted phrases and NEAR/k keep their words together.
+            filters = search_index.parse_filter(FILTER)
+            filtered_repo = file_repo.search_files(filters, limit)
             if filtered_repo is None:
-                self.show_warning("No matches found for filters: " +
-                                  "".join(f + ", " for f in filters)[:-2] +
-                                  ". Press Enter to go back")
-                self.show_default()
-                return(0)
+                return(None)
             print(filtered_repo.filenames())
 
         self.add_existing_repo(filtered_repo, instance)
         self.file_repo(instance).set_lineformat(['name', 'misc'])
+        return(filtered_repo)
 
-        ANSWER = self.show_note_selector(instance, extra_args)
-
-        if not ANSWER:
-            return(0)
-
-        NOTE, FILTER, OPTSEL = ANSWER
-
-        if not OPTSEL:
-            if not NOTE:
-                print("Creating file from filter...")
-                self.new_note(FILTER)
-                return(0)
-            else:
-                notepath = path.join(self.qndir, NOTE)
-                if path.isfile(notepath):
-                    print("file found, editing...")
-                    self.open_note(NOTE)
-                    return(0)
-                else:
-                    print("file not found, create...")
-                    self.new_note(FILTER)
-                    return(0)
-
-        if OPTSEL == 'grep':
-            if not FILTER:
-                self.show_default()
-            else:
-                self.show_filtered(filtered_repo, FILTER)
+    def __no_matches_mesg(self, FILTER, use_grep=False):
+        if use_grep:
+            filters = FILTER.strip().split(" ")
+        else:
+            filters = search_index.parse_filter(FILTER)
+        return("No matches found for filters: " +
+               "".join(f + ", " for f in filters)[:-2] +
+               ". Press Enter to go back")
 
     def show_help(self, enter_help):
+        """Show the hotkeys of the notes view. Returns the next view to
+        show, or None to quit."""
 
         instance = 'help'
-        if not self.hkman(instance):
-            self.add_hkman(instance)
-            self.hkman(instance).add_key(*self.options.hotkeys['showhelp'])
-        hotkey_args = self.hkman(instance).generate_hotkey_args()
+        hotkey_args = self.hotkey_args(instance)
 
         MESG = "List of options and corresponding keybindings."
         MESG += " Press '" + self.hkman(instance).get_keybinding('showhelp')
@@ -424,15 +579,16 @@ class QnAppRF(qn.QnApp):
                                                     alt_prompt=TITLE)
         extra_args.extend(hotkey_args)
 
+        self.hotkey_args('default')
         help_lines = self.hkman('default').generate_help(enter_help)
         ANSWER = self.run_launcher(help_lines, extra_args)
 
         if not ANSWER:
-            return(0)
+            return(None)
         if not ANSWER[0]:
             exit(0)
         else:
-            self.show_default()
+            return(('default', {}))
 
     def show_warning(self, message):
         if self.launcher == 'rofi':
@@ -448,3 +604,367 @@ class QnAppRF(qn.QnApp):
                 return(0)
             if not ANSWER[0]:
                 exit(0)
+
+    def run_session(self):
+        """Show the views in a single fzf, switching between them with fzf's
+        reload action instead of starting a new fzf for each, see
+        fzf_session. fzf is only left to open, create, delete, rename or
+        restore a note.
+        """
+        instance = 'session'
+        hotkey_args = self.hotkey_args(instance)
+        hkeys = self.options.hotkeys
+        reload_keys = [(optname, hkeys[optname][1])
+                       for optname in _SESSION_RELOADS]
+        import qn.fzf_session as fzf_session
+
+        session = fzf_session.FzfSession(self.__serve_view)
+        session.start()
+        self.__session_view = ('default', {})
+        try:
+            while True:
+                data, MESG, TITLE = self.__view_entries(*self.__session_view)
+                extra_args = self.options.gen_instance_args(
+                    'default', alt_help=MESG, alt_prompt=TITLE)
+                extra_args.extend(hotkey_args)
+                extra_args.extend(session.fzf_args(reload_keys))
+
+                answer, exit_code = self.__launch(extra_args, data)
+                if answer == '':
+                    return(0)
+                NOTE, FILTER, OPTSEL = self.__fzf_answer(answer, instance)
+
+                view = self.__session_view[0]
+                if view == 'help':
+                    self.__session_view = ('default', {})
+                elif view == 'trash':
+                    if NOTE and not OPTSEL:
+                        self.show_undelete(NOTE)
+                    return(0)
+                elif OPTSEL:
+                    self.__note_hotkey(NOTE, FILTER, OPTSEL)
+                    return(0)
+                else:
+                    self.__open_or_create(NOTE, FILTER)
+                    return(0)
+        finally:
+            session.stop()
+
+    def __serve_view(self, optname, query):
+        """Move the session to the view the hotkey optname leads to, as
+        run() would, and get its entries and the fzf actions that show its
+        help and prompt. Called from the thread of the session."""
+        # fzf owns the terminal meanwhile, searches must not print over it.
+        # The main thread only waits for fzf, so swapping stdout is safe.
+        with open(devnull, 'w') as null, redirect_stdout(null):
+            return(self.__next_session_view(optname, query))
+
+    def __next_session_view(self, optname, query):
+        view, view_args = self.__session_view
+        next_view = (view, view_args)
+        warning = None
+        if optname in _SORT_HOTKEYS and view == 'default':
+            next_view = self.show_sorted_default(*_SORT_HOTKEYS[optname])
+        elif optname == 'showtrash' and view in ('default', 'trash'):
+            next_view = ('trash' if view == 'default' else 'default', {})
+        elif optname == 'showhelp' and view in ('default', 'help'):
+            next_view = ('help' if view == 'default' else 'default', {})
+        elif optname == 'grep' and view in ('default', 'filtered'):
+            FILTER = query.strip()
+            if not FILTER:
+                next_view = ('default', {})
+            else:
+                file_repo = view_args.get('file_repo',
+                                          self.file_repo('default'))
+                filtered_repo = self.__filter_repo(file_repo, FILTER)
+                if filtered_repo:
+                    next_view = ('filtered', {'file_repo': filtered_repo,
+                                              'FILTER': FILTER})
+                else:
+                    warning = self.__no_matches_mesg(FILTER)
+        self.__session_view = next_view
+
+        data, MESG, TITLE = self.__view_entries(*next_view)
+        if warning:
+            MESG = warning
+        import qn.fzf_session as fzf_session
+
+        actions = (fzf_session.fzf_action('change-prompt', TITLE) + '+' +
+                   fzf_session.fzf_action('change-header', MESG))
+        return(data, actions)
+
+    def __view_entries(self, view, view_args):
+        """Get the entries, as launcher input, help message and prompt of a
+        view of the fzf session."""
+        if view == 'trash':
+            data = self.__trash_repo().entries('names')
+            return(data, self.__trash_mesg(), 'qn trash: ')
+        if view == 'help':
+            self.hotkey_args('default')
+            help_lines = self.hkman('default').generate_help(
+                "Create/Edit note")
+            MESG = "List of options and corresponding keybindings."
+            MESG += " Press '" + self.options.hotkeys['showhelp'][1]
+            MESG += "' to go back to qn."
+            return(join_entries(help_lines), MESG, 'qn help: ')
+        if view == 'filtered':
+            MESG = "List of notes filtered for '" + view_args['FILTER'] + "'."
+            MESG += " Press '" + self.options.hotkeys['grep'][1]
+            MESG += "' with an empty query to go back to qn."
+            return(view_args['file_repo'].entries('names'), MESG,
+                   'qn search: ')
+
+        instance = 'default'
+        if not self.file_repo(instance):
+            self.add_repo(self.qndir, instance)
+            self.file_repo(instance).scan_files()
+        self.file_repo(instance).sort(self.options.sorttype,
+                                      self.options.sortrev)
+        return(self.file_repo(instance).entries('names'),
+               self.__default_mesg(), self.options.prompt)
+
+    def script_command(self, script_path):
+        """Get the rofi command that runs qn in script mode, with script_path
+        answering its calls through run_script."""
+        command = list(self.options.command)
+        # Script mode takes none of the dmenu options.
+        for option, nargs in (('-dmenu', 0), ('-sep', 1), ('-format', 1)):
+            if option in command:
+                idx = command.index(option)
+                del command[idx:idx + 1 + nargs]
+        command.extend(['-modi', 'qn:' + script_path, '-show', 'qn'])
+        command.extend(self.hotkey_args('script'))
+        return(command)
+
+    def run_script(self, argument=None, out=None):
+        """Answer one call of rofi in script mode, see rofi-script(5). rofi
+        runs the script again for every selection, custom input or hotkey,
+        with the current view kept by rofi in ROFI_DATA, so a single rofi
+        window moves between views. Repos are loaded from their snapshots
+        (or the daemon) and searches from the result cache, so each call
+        only reads what changed. Needs rofi 1.7 or later.
+
+        Keyword arguments:
+        argument -- selected entry or custom input, from rofi (default
+                    None, the first call).
+        out -- file rofi reads the entries from (default None, stdout).
+        """
+        if out is None:
+            out = stdout
+        import json
+
+        retv = int(environ.get('ROFI_RETV', '0'))
+        try:
+            state = json.loads(environ.get('ROFI_DATA', ''))
+        except ValueError:
+            state = {'view': 'default'}
+        if 'sortby' in state:
+            self.options.set_sorttype(state['sortby'])
+            self.options.set_sortrev(state['sortrev'])
+
+        state, action = self.__script_step(state, retv, argument,
+                                           environ.get('ROFI_INFO'))
+        if action:
+            # rofi closes when it gets no entries, but waits for the script
+            # to exit, so editors run in a process of their own.
+            out.flush()
+            out.close()
+            if fork() != 0:
+                _exit(0)
+            setsid()
+            with open(devnull, 'r+b') as null:
+                for fd in (0, 1, 2):
+                    dup2(null.fileno(), fd)
+            action[0](*action[1:])
+            return(0)
+        if state is not None:
+            state['sortby'] = self.options.sorttype
+            state['sortrev'] = self.options.sortrev
+            self.__script_write(state, out)
+        return(0)
+
+    def __script_step(self, state, retv, argument, info):
+        """Get the next view of script mode, and the action to run once rofi
+        closes, if any, as (function, *args)."""
+        view = state.get('view', 'default')
+        OPTSEL = None
+        if retv >= 10:
+            self.hotkey_args('script')
+            OPTSEL = self.hkman('script').get_opt(retv)
+        selected = retv == 1
+        typed = retv in (1, 2) and argument
+
+        if retv == 0:
+            return({'view': 'default'}, None)
+        if view in ('default', 'filtered'):
+            if selected and info:
+                return(None, (self.__open_or_create, info, argument))
+            if retv == 2 and argument:
+                return(None, (self.new_note, argument))
+            if OPTSEL == 'grep':
+                return({'view': 'grep',
+                        'filters': state.get('filters', [])}, None)
+        if view == 'default':
+            if OPTSEL == 'delete' and info:
+                return({'view': 'confirm', 'action': 'delete',
+                        'note': info, 'back': 'default'}, None)
+            if OPTSEL == 'rename' and info:
+                return({'view': 'rename', 'note': info}, None)
+            if OPTSEL == 'forcenew':
+                return({'view': 'forcenew'}, None)
+            if OPTSEL == 'showtrash':
+                return({'view': 'trash'}, None)
+            if OPTSEL == 'showhelp':
+                return({'view': 'help'}, None)
+            if OPTSEL in _SORT_HOTKEYS:
+                self.show_sorted_default(*_SORT_HOTKEYS[OPTSEL])
+            return({'view': 'default'}, None)
+        if view == 'grep':
+            if not typed:
+                return({'view': 'default'}, None)
+            filters = state.get('filters', []) + [argument]
+            if not self.__script_filtered(filters):
+                return({'view': 'default',
+                        'warning': self.__no_matches_mesg(argument)}, None)
+            return({'view': 'filtered', 'filters': filters}, None)
+        if view == 'trash':
+            if selected and info:
+                return({'view': 'confirm', 'action': 'undelete',
+                        'note': info, 'back': 'trash'}, None)
+            if OPTSEL == 'showtrash':
+                return({'view': 'default'}, None)
+            return(state, None)
+        if view == 'rename':
+            if not typed:
+                return({'view': 'default'}, None)
+            return({'view': 'confirm', 'action': 'rename',
+                    'note': state['note'], 'to': argument.strip(),
+                    'back': 'default'}, None)
+        if view == 'forcenew':
+            if typed and argument.strip():
+                return(None, (self.force_new_note, argument.strip()))
+            return({'view': 'default'}, None)
+        if view == 'confirm':
+            if selected and argument == 'yes' and \
+                    not self.__script_confirmed(state):
+                return({'view': state['back'],
+                        'warning': "Could not " + state['action'] + " '" +
+                                   state['note'] + "'."}, None)
+            return({'view': state['back']}, None)
+        # help, and views of older versions.
+        return({'view': 'default'}, None)
+
+    def __script_confirmed(self, state):
+        """Run the action of a confirm view, and tell whether it succeeded.
+        The actions print and exit like on the command line, while rofi
+        waits for the view to go back to."""
+        try:
+            with open(devnull, 'w') as null, redirect_stdout(null):
+                if state['action'] == 'delete':
+                    self.delete_note(state['note'])
+                elif state['action'] == 'undelete':
+                    self.undelete_note(state['note'])
+                elif state['action'] == 'rename':
+                    self.move_note(state['note'], state['to'])
+        except SystemExit as err:
+            return(not err.code)
+        return(True)
+
+    def __script_filtered(self, filters):
+        """Apply a chain of filters, from the default repo on."""
+        file_repo = self.__script_repo('default')
+        for FILTER in filters:
+            file_repo = self.__filter_repo(file_repo, FILTER)
+            if not file_repo:
+                return(None)
+        return(file_repo)
+
+    def __script_repo(self, instance):
+        if instance == 'trash':
+            return(self.__trash_repo())
+        if not self.file_repo(instance):
+            self.add_repo(self.qndir, instance)
+            self.file_repo(instance).scan_files()
+            if self.options.summary:
+                self.file_repo(instance).set_lineformat(['name', 'misc',
+                                                         'cdate'])
+        self.file_repo(instance).sort(self.options.sorttype,
+                                      self.options.sortrev)
+        return(self.file_repo(instance))
+
+    def __script_write(self, state, out):
+        """Write a view of script mode for rofi: its options, then a row per
+        entry, with the note name as the row info."""
+        view = state['view']
+        rows = []
+        hint = None
+        no_custom = True
+        TITLE = 'qn: '
+        if view in ('default', 'trash', 'filtered'):
+            if view == 'filtered':
+                file_repo = self.__script_filtered(state['filters'])
+                MESG = "List of notes filtered for '"
+                MESG += "', '".join(state['filters']) + "'. Press '"
+                MESG += self.options.hotkeys['grep'][1]
+                MESG += "' to search in them."
+                TITLE = 'qn search: '
+            elif view == 'trash':
+                file_repo = self.__script_repo('trash')
+                MESG = self.__trash_mesg()
+                TITLE = 'qn trash: '
+            else:
+                file_repo = self.__script_repo('default')
+                MESG = self.__default_mesg()
+            rows = list(zip(file_repo.lines(), file_repo.filenames()))
+            no_custom = view == 'trash'
+        elif view == 'help':
+            self.hotkey_args('script')
+            rows = [(line, None) for line in
+                    self.hkman('script').generate_help("Create/Edit note")]
+            MESG = "List of options and corresponding keybindings."
+            MESG += " Press Enter to go back to qn."
+            TITLE = 'qn help: '
+        elif view == 'confirm':
+            rows = [('no', None), ('yes', None)]
+            if state['action'] == 'rename':
+                MESG = "Are you sure you want to rename '" + state['note']
+                MESG += "' to '" + state['to'] + "'?"
+            else:
+                MESG = "Are you sure you want to " + state['action'] + ' "'
+                MESG += state['note'] + '"?'
+            TITLE = 'qn ' + state['action'] + ': '
+        else:
+            no_custom = False
+            if view == 'rename':
+                MESG = "Please write the new name for '" + state['note'] + "'"
+                TITLE = 'qn rename: '
+            elif view == 'forcenew':
+                MESG = "Please write the name of the new note"
+                TITLE = 'qn new: '
+            else:
+                MESG = "Type the words to search for and press Enter"
+                TITLE = 'qn search: '
+            hint = MESG
+        if state.get('warning'):
+            MESG = state.pop('warning')
+
+        import json
+
+        mode_options = [('prompt', TITLE), ('message', MESG),
+                        ('use-hot-keys', 'true'),
+                        ('no-custom', 'true' if no_custom else 'false'),
+                        ('data', json.dumps(state))]
+        lines = ['\x00' + key + '\x1f' + value.replace('\n', ' ')
+                 for key, value in mode_options]
+        for text, info in rows:
+            # Rows are separated by newlines in script mode.
+            text = text.replace('\n', ' ')
+            if info is not None:
+                text += '\x00info\x1f' + info
+            lines.append(text)
+        if hint is not None:
+            # rofi closes on a list without entries.
+            lines.append(hint + '\x00nonselectable\x1ftrue')
+        out.write('\n'.join(lines) + '\n')
+        out.flush()
+        startup.mark('first launcher write')
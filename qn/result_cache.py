@@ -0,0 +1,218 @@
+"""Persistent cache of search results of a note repository"""
+
+import pickle
+from os import path, remove
+from time import time_ns
+
+_CACHE_VERSION = 2
+# Least recently used results are dropped past this many entries, or this
+# many bytes of pickled matches in total.
+_MAX_ENTRIES = 64
+_MAX_BYTES = 4 * 1024 * 1024
+# Results larger than this are not cached: they are cheaper to find again
+# than to keep, and would evict every other entry.
+_MAX_ENTRY_BYTES = 256 * 1024
+# Seconds to wait for another process writing the cache.
+_LOCK_TIMEOUT = 1
+
+
+def normalize_search(queries_list):
+    """Cache key of the queries of FileRepo.search_files. Every query must be
+    found, case insensitive, so their order and case do not matter."""
+    return(('search',) + tuple(sorted(set(q.lower() for q in queries_list))))
+
+
+def normalize_grep(filters_string):
+    """Cache key of the pattern of FileRepo.grep_files."""
+    return(('grep', filters_string))
+
+
+class ResultCache:
+    """Class that keeps the results of the latest searches of a note
+    repository between runs, least recently used first out, in an SQLite
+    database so that each search only reads and writes its own entry.
+
+    Results are stored with the generation of the index the search used, and
+    a result is only returned for the same generation, so any change to the
+    notes makes older results unreachable until they are evicted. A cache
+    that can't be opened or written caches nothing.
+
+    Keyword arguments:
+    cache_path -- path of the database holding the cache.
+    root -- root directory of the note repository.
+    """
+    def __init__(self, cache_path, root):
+        self.__path = cache_path
+        self.__root = root
+        self.__db = None
+        self.__used = {}  # key -> time of the gets since the last save
+        self.load()
+
+    @property
+    def cache_path(self):
+        return(self.__path)
+
+    def load(self):
+        """Open the cache. A missing, unreadable or outdated cache is simply
+        started again."""
+        import sqlite3
+
+        self.__used = {}
+        for attempt in range(2):
+            try:
+                self.__db = sqlite3.connect(self.__path,
+                                            timeout=_LOCK_TIMEOUT,
+                                            isolation_level=None,
+                                            check_same_thread=False)
+                if not self.__valid():
+                    self.__transaction(self.__reset)
+                return
+            except sqlite3.OperationalError:
+                break
+            except sqlite3.DatabaseError:
+                # Not a database at all.
+                self.__db.close()
+                try:
+                    remove(self.__path)
+                except OSError:
+                    break
+        if self.__db:
+            self.__db.close()
+        self.__db = None
+
+    def __transaction(self, function, *args):
+        db = self.__db
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            function(*args)
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+
+    def __valid(self):
+        import sqlite3
+
+        db = self.__db
+        try:
+            if db.execute('PRAGMA user_version').fetchone()[0] != \
+                    _CACHE_VERSION:
+                return(False)
+            root = db.execute("SELECT value FROM meta WHERE name = "
+                              "'root'").fetchone()
+        except sqlite3.OperationalError:
+            return(False)
+        return(root == (self.__root,))
+
+    def __reset(self):
+        if self.__valid():
+            # Another process just did.
+            return
+        db = self.__db
+        db.execute('DROP TABLE IF EXISTS meta')
+        db.execute('DROP TABLE IF EXISTS entries')
+        db.execute('CREATE TABLE meta (name TEXT PRIMARY KEY, value)')
+        db.execute('CREATE TABLE entries (key TEXT PRIMARY KEY, '
+                   'generation INTEGER, used INTEGER, size INTEGER, '
+                   'matches BLOB)')
+        db.execute("INSERT INTO meta VALUES ('root', ?)", (self.__root,))
+        db.execute('PRAGMA user_version = ' + str(_CACHE_VERSION))
+        # Left by earlier versions, which kept the cache in a pickle.
+        legacy_path = path.splitext(self.__path)[0] + '.pickle'
+        if legacy_path != self.__path:
+            try:
+                remove(legacy_path)
+            except OSError:
+                pass
+
+    def save(self):
+        """Write the order in which entries were used since the last save.
+        """
+        import sqlite3
+
+        if not self.__db or not self.__used:
+            return
+        try:
+            self.__transaction(self.__write_used)
+        except sqlite3.Error:
+            return
+        self.__used = {}
+
+    def __write_used(self):
+        self.__db.executemany('UPDATE entries SET used = ? WHERE key = ?',
+                              [(used, key) for key, used
+                               in self.__used.items()])
+
+    def get(self, key, generation):
+        """Get the cached matches of a search, or None if there are none for
+        this generation of the repository.
+
+        Keyword arguments:
+        key -- normalized search, see normalize_search and normalize_grep.
+        generation -- generation of the index of the repository.
+        """
+        import sqlite3
+
+        if not self.__db:
+            return(None)
+        key = repr(key)
+        try:
+            row = self.__db.execute('SELECT generation, matches FROM entries '
+                                    'WHERE key = ?', (key,)).fetchone()
+        except sqlite3.Error:
+            return(None)
+        if row is None or row[0] != generation:
+            return(None)
+        try:
+            matches = pickle.loads(row[1])
+        except Exception:
+            return(None)
+        # The new order is only written with the next put.
+        self.__used[key] = time_ns()
+        return(matches)
+
+    def put(self, key, generation, matches):
+        """Cache the matches of a search and write them to disk, unless they
+        are larger than _MAX_ENTRY_BYTES.
+
+        Keyword arguments:
+        key -- normalized search, see normalize_search and normalize_grep.
+        generation -- generation of the index of the repository.
+        matches -- list of (name, misc) tuples, in result order.
+        """
+        import sqlite3
+
+        if not self.__db:
+            return
+        data = pickle.dumps(list(matches), pickle.HIGHEST_PROTOCOL)
+        if len(data) > _MAX_ENTRY_BYTES:
+            data = None
+        try:
+            self.__transaction(self.__put, repr(key), generation, data)
+        except sqlite3.Error:
+            return
+        self.__used = {}
+
+    def __put(self, key, generation, data):
+        db = self.__db
+        self.__used.pop(key, None)
+        self.__write_used()
+        # Older results of the same search are outdated anyway.
+        db.execute('DELETE FROM entries WHERE key = ?', (key,))
+        if data is None:
+            return
+        db.execute('INSERT INTO entries VALUES (?, ?, ?, ?, ?)',
+                   (key, generation, time_ns(), len(data), data))
+        total = 0
+        evicted = []
+        for count, (old_key, size) in enumerate(db.execute(
+                'SELECT key, size FROM entries ORDER BY used DESC')):
+            total += size
+            if count >= _MAX_ENTRIES or total > _MAX_BYTES:
+                evicted.append((old_key,))
+        db.executemany('DELETE FROM entries WHERE key = ?', evicted)
+
+
+def cache_path(qndata, instance):
+    """Path of the result cache of a qn instance inside the qn data dir."""
+    return(path.join(qndata, 'results-' + instance + '.sqlite'))
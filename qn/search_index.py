@@ -0,0 +1,936 @@
+"""Persistent inverted index over the contents of a note repository"""
+
+import heapq
+import re
+from array import array
+from bisect import bisect_right
+from collections import Counter
+from math import log
+from os import path, remove
+from time import time_ns
+
+_INDEX_VERSION = 5
+_TOKEN_RE = re.compile(r'\w+')
+# BM25 parameters: term frequency saturation and document length weight.
+_BM25_K1 = 1.2
+_BM25_B = 0.75
+# Compact the postings once more than this many documents are dead, and
+# dead documents outnumber live ones.
+_COMPACT_MIN_DEAD = 1000
+# Notes read, then written in a transaction, at a time.
+_BATCH_SIZE = 1000
+# Terms read with a single query.
+_READ_BATCH_SIZE = 500
+# Chunks of the postings of a term, written by separate updates, merged
+# once a query reads more than this many of them.
+_MAX_CHUNKS = 8
+# Seconds to wait for another process writing the index.
+_LOCK_TIMEOUT = 10
+
+
+def tokenize(text):
+    """Get the set of lowercase terms in a text."""
+    return(set(_TOKEN_RE.findall(text.lower())))
+
+
+def read_terms(filepath):
+    """Get a Counter of the terms in a file. Files that are not valid UTF-8
+    have no terms."""
+    try:
+        with open(filepath, 'rb') as notefile:
+            data = notefile.read()
+        text = data.decode('utf-8')
+    except (OSError, UnicodeDecodeError):
+        return(Counter())
+    return(Counter(_TOKEN_RE.findall(text.lower())))
+
+
+def text_positions(text):
+    """Get a dict of each lowercase term in a text to an array of the
+    positions, in terms, where it appears."""
+    positions = {}
+    for pos, term in enumerate(_TOKEN_RE.findall(text.lower())):
+        term_positions = positions.get(term)
+        if term_positions is None:
+            positions[term] = array('I', [pos])
+        else:
+            term_positions.append(pos)
+    return(positions)
+
+
+def read_positions(filepath):
+    """Get text_positions of a file. Files that are not valid UTF-8 have no
+    terms."""
+    try:
+        with open(filepath, 'rb') as notefile:
+            data = notefile.read()
+        text = data.decode('utf-8')
+    except (OSError, UnicodeDecodeError):
+        return({})
+    return(text_positions(text))
+
+
+class PostingsIndex:
+    """Class that maps the terms found in the notes of a repository to the
+    notes containing them, kept in an SQLite database and updated from file
+    stats. Subclasses define what the terms are through read_terms(). If
+    counted is True, the number of times each term appears in each note and
+    the length of each note are kept too, for ranking. If positional is
+    True, the positions of each term in each note are kept.
+
+    The postings of a term are stored in chunks, one per batch of notes
+    written, so that an update only adds rows. Queries only read the terms
+    they look up, and merge the chunks of a term once it has too many.
+
+    Keyword arguments:
+    index_path -- path of the database holding the index.
+    root -- root directory of the note repository.
+    """
+    kind = 'terms'
+    counted = False
+    positional = False
+
+    def __init__(self, index_path, root):
+        self.__path = index_path
+        self.__root = root
+        self.__db = None
+        self.__docs = {}       # doc id -> name, of live documents
+        self.__doc_keys = {}   # name -> (doc id, stats key)
+        self.__lengths = {}    # doc id -> number of terms, if counted
+        self.__total_length = 0      # of live documents
+        self.__opaque = set()  # names of notes that could not be indexed
+        self.__next_id = 0
+        self.__dead = 0
+        self.__generation = 0
+        # term -> (doc ids, counts, positions) of the terms read so far
+        self.__postings = {}
+        self.load()
+
+    @property
+    def index_path(self):
+        return(self.__path)
+
+    @property
+    def generation(self):
+        """Number that changes whenever a note is added, changed or removed.
+        """
+        return(self.__generation)
+
+    def load(self):
+        """Open the index. A missing, unreadable or outdated index is simply
+        started again. Raises OSError if it can't be opened."""
+        import sqlite3
+
+        try:
+            try:
+                self.__open()
+            except sqlite3.OperationalError:
+                raise
+            except sqlite3.DatabaseError:
+                # Not a database at all.
+                self.__db.close()
+                remove(self.__path)
+                self.__open()
+        except sqlite3.Error as err:
+            raise OSError('can not open ' + self.__path + ': ' + str(err))
+
+    def __open(self):
+        import sqlite3
+
+        self.__db = sqlite3.connect(self.__path, timeout=_LOCK_TIMEOUT,
+                                    isolation_level=None,
+                                    check_same_thread=False)
+        if not self.__valid():
+            self.__transaction(self.__reset)
+        self.__db.execute('BEGIN')
+        try:
+            self.__read()
+        finally:
+            self.__db.execute('COMMIT')
+
+    def __transaction(self, function, *args):
+        """Run a function in a write transaction."""
+        db = self.__db
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            result = function(*args)
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+        return(result)
+
+    def __refresh(self):
+        """Read the state of the index again if another process changed it.
+        """
+        stored = self.__db.execute("SELECT value FROM meta WHERE name = "
+                                   "'generation'").fetchone()[0]
+        if stored != self.__generation:
+            self.__read()
+
+    def __valid(self):
+        import sqlite3
+
+        db = self.__db
+        try:
+            if db.execute('PRAGMA user_version').fetchone()[0] != \
+                    _INDEX_VERSION:
+                return(False)
+            meta = dict(db.execute("SELECT name, value FROM meta WHERE name "
+                                   "IN ('root', 'kind')"))
+        except sqlite3.OperationalError:
+            return(False)
+        return(meta == {'root': self.__root, 'kind': self.kind})
+
+    def __reset(self):
+        """Start the index again, from no notes."""
+        if self.__valid():
+            # Another process just did.
+            return
+        db = self.__db
+        for table in ('meta', 'docs', 'terms', 'postings'):
+            db.execute('DROP TABLE IF EXISTS ' + table)
+        db.execute('CREATE TABLE meta (name TEXT PRIMARY KEY, value)')
+        db.execute('CREATE TABLE docs (id INTEGER PRIMARY KEY, name TEXT, '
+                   'key TEXT, length INTEGER, opaque INTEGER)')
+        db.execute('CREATE TABLE terms (term TEXT PRIMARY KEY) WITHOUT ROWID')
+        db.execute('CREATE TABLE postings (term TEXT, chunk INTEGER, '
+                   'docids BLOB, counts BLOB, positions BLOB, '
+                   'PRIMARY KEY (term, chunk)) WITHOUT ROWID')
+        # Starts from the time the index was created, so that a rebuilt
+        # index never reuses the generation of an earlier one.
+        db.executemany('INSERT INTO meta VALUES (?, ?)',
+                       [('root', self.__root), ('kind', self.kind),
+                        ('generation', time_ns()), ('next_id', 0),
+                        ('dead', 0), ('total_length', 0)])
+        db.execute('PRAGMA user_version = ' + str(_INDEX_VERSION))
+        # Left by earlier versions, which kept the index in a pickle.
+        legacy_path = path.splitext(self.__path)[0] + '.pickle'
+        if legacy_path != self.__path:
+            try:
+                remove(legacy_path)
+            except OSError:
+                pass
+
+    def __read(self):
+        """Read the state of the index from the database."""
+        db = self.__db
+        meta = dict(db.execute('SELECT name, value FROM meta'))
+        self.__generation = meta['generation']
+        self.__next_id = meta['next_id']
+        self.__dead = meta['dead']
+        self.__total_length = meta['total_length']
+        self.__docs = {}
+        self.__doc_keys = {}
+        self.__lengths = {}
+        self.__opaque = set()
+        for docid, name, key, length, opaque in db.execute(
+                'SELECT id, name, key, length, opaque FROM docs'):
+            self.__docs[docid] = name
+            self.__doc_keys[name] = (docid, key)
+            if self.counted:
+                self.__lengths[docid] = length
+            if opaque:
+                self.__opaque.add(name)
+        self.__postings = {}
+        self.terms_changed()
+
+    def __write_meta(self):
+        self.__db.executemany('UPDATE meta SET value = ? WHERE name = ?',
+                              [(self.__generation, 'generation'),
+                               (self.__next_id, 'next_id'),
+                               (self.__dead, 'dead'),
+                               (self.__total_length, 'total_length')])
+
+    def update(self, names, stats_list):
+        """Bring the index up to date with the notes of a repository. Only
+        notes whose key changed are read, and they are written in batches
+        as they are read.
+
+        Keyword arguments:
+        names -- list of note names, relative to the root.
+        stats_list -- list of keys of the stats of each note, e.g. (size,
+                      mtime, ctime). A note is read again when its key
+                      changes.
+
+        Raises OSError if the index can't be written.
+        """
+        import sqlite3
+
+        keys = {}
+        changed = []
+        for name, key in zip(names, stats_list):
+            key = repr(key)
+            keys[name] = key
+            indexed = self.__doc_keys.get(name)
+            if indexed is None or indexed[1] != key:
+                changed.append(name)
+        try:
+            if any(name not in keys for name in self.__doc_keys):
+                self.__transaction(self.__write, keys, {})
+            for start in range(0, len(changed), _BATCH_SIZE):
+                batch = {}
+                for name in changed[start:start + _BATCH_SIZE]:
+                    batch[name] = self.read_terms(path.join(self.__root,
+                                                            name))
+                self.__transaction(self.__write, keys, batch)
+        except sqlite3.Error as err:
+            raise OSError('can not update ' + self.__path + ': ' + str(err))
+
+    def read_terms(self, filepath):
+        """Get the terms of a file, as a set or, for counted indexes, a
+        Counter, or for positional indexes, a dict of term to an array of
+        positions. None if the file can't be indexed and must always be a
+        candidate."""
+        return(read_terms(filepath))
+
+    def terms_changed(self):
+        """Called when terms were added to or removed from the index."""
+        pass
+
+    def __write(self, keys, batch):
+        """Remove the notes that are not in keys, and add the notes of batch,
+        a dict of name to the terms read from the note."""
+        db = self.__db
+        self.__refresh()
+        for name in list(self.__doc_keys):
+            if name not in keys:
+                self.__remove_doc(name)
+        pending = {}  # term -> (doc ids, counts, positions) of the batch
+        for name, terms in batch.items():
+            indexed = self.__doc_keys.get(name)
+            if indexed is not None and indexed[1] == keys[name]:
+                # Another process just did.
+                continue
+            if indexed is not None:
+                self.__remove_doc(name)
+            self.__add_doc(name, keys[name], terms, pending)
+        if pending:
+            db.executemany('INSERT OR IGNORE INTO terms VALUES (?)',
+                           ((term,) for term in pending))
+            db.executemany('INSERT INTO postings VALUES (?, ?, ?, ?, ?)',
+                           ((term, self.__generation) + _encode(entry)
+                            for term, entry in pending.items()))
+            for term in pending:
+                self.__postings.pop(term, None)
+            self.terms_changed()
+        dead = self.__dead
+        if dead > _COMPACT_MIN_DEAD and dead > len(self.__doc_keys):
+            self.__compact()
+        self.__write_meta()
+
+    def __add_doc(self, name, key, terms, pending):
+        docid = self.__next_id
+        self.__next_id += 1
+        opaque = terms is None
+        if opaque:
+            self.__opaque.add(name)
+            terms = {}
+        for term in terms:
+            entry = pending.get(term)
+            if entry is None:
+                entry = pending[term] = (array('I'), array('I'), array('I'))
+            entry[0].append(docid)
+            if self.positional:
+                entry[1].append(len(terms[term]))
+                entry[2].extend(terms[term])
+            elif self.counted:
+                entry[1].append(terms[term])
+        length = None
+        if self.counted:
+            length = sum(len(positions) for positions in terms.values()) \
+                if self.positional else sum(terms.values())
+            self.__lengths[docid] = length
+            self.__total_length += length
+        self.__docs[docid] = name
+        self.__doc_keys[name] = (docid, key)
+        self.__db.execute('INSERT INTO docs VALUES (?, ?, ?, ?, ?)',
+                          (docid, name, key, length, opaque))
+        self.__generation += 1
+
+    def __remove_doc(self, name):
+        docid = self.__doc_keys.pop(name)[0]
+        del self.__docs[docid]
+        if self.counted:
+            self.__total_length -= self.__lengths.pop(docid)
+        self.__opaque.discard(name)
+        self.__db.execute('DELETE FROM docs WHERE id = ?', (docid,))
+        self.__dead += 1
+        self.__generation += 1
+
+    def __compact(self):
+        """Drop dead documents from the postings, merging the chunks of
+        every term."""
+        db = self.__db
+        rows = db.execute('SELECT term, docids, counts, positions FROM '
+                          'postings ORDER BY term, chunk').fetchall()
+        db.execute('DELETE FROM postings')
+        db.execute('DELETE FROM terms')
+        by_term = {}
+        for row in rows:
+            by_term.setdefault(row[0], []).append(row[1:])
+        del rows
+        for term, chunks in by_term.items():
+            entry = _live(_decode(chunks), self.__docs)
+            if entry[0]:
+                db.execute('INSERT INTO terms VALUES (?)', (term,))
+                db.execute('INSERT INTO postings VALUES (?, ?, ?, ?, ?)',
+                           (term, self.__generation) + _encode(entry))
+        self.__dead = 0
+        self.__postings = {}
+        self.terms_changed()
+
+    def __merge(self, term):
+        """Merge the chunks of a term into one, without dead documents."""
+        db = self.__db
+        self.__refresh()
+        chunks = db.execute('SELECT docids, counts, positions FROM postings '
+                            'WHERE term = ? ORDER BY chunk',
+                            (term,)).fetchall()
+        entry = _live(_decode(chunks), self.__docs)
+        db.execute('DELETE FROM postings WHERE term = ?', (term,))
+        if entry[0]:
+            db.execute('INSERT INTO postings VALUES (?, ?, ?, ?, ?)',
+                       (term, self.__generation) + _encode(entry))
+        else:
+            db.execute('DELETE FROM terms WHERE term = ?', (term,))
+            self.terms_changed()
+        self.__postings.pop(term, None)
+
+    def __term(self, term):
+        """Get the (doc ids, counts, positions) arrays of a term."""
+        entry = self.__postings.get(term)
+        if entry is None:
+            entry = self.__read_terms([term])[term]
+        return(entry)
+
+    def __read_terms(self, terms):
+        """Get the (doc ids, counts, positions) arrays of terms, reading the
+        ones that were not read yet."""
+        import sqlite3
+
+        entries = {}
+        chunks = {}
+        for term in terms:
+            entry = self.__postings.get(term)
+            if entry is None:
+                chunks[term] = []
+            else:
+                entries[term] = entry
+        missing = list(chunks)
+        for start in range(0, len(missing), _READ_BATCH_SIZE):
+            batch = missing[start:start + _READ_BATCH_SIZE]
+            for row in self.__db.execute(
+                    'SELECT term, docids, counts, positions FROM postings '
+                    'WHERE term IN (' + ', '.join('?' * len(batch)) +
+                    ') ORDER BY term, chunk', batch):
+                chunks[row[0]].append(row[1:])
+        for term, term_chunks in chunks.items():
+            entries[term] = _decode(term_chunks)
+            if len(term_chunks) > _MAX_CHUNKS:
+                try:
+                    self.__transaction(self.__merge, term)
+                except sqlite3.Error:
+                    # Only slower to read, merged next time.
+                    pass
+        self.__postings.update(entries)
+        return(entries)
+
+    def terms(self):
+        """Get every indexed term."""
+        return([row[0] for row in self.__db.execute('SELECT term FROM terms')])
+
+    def read_postings(self, terms):
+        """Read the postings of many terms at once, ahead of postings()."""
+        self.__read_terms(list(terms))
+
+    def postings(self, term):
+        """Get the ids of the notes containing a term."""
+        return(self.__term(term)[0])
+
+    def freqs(self, term):
+        """Get how many times a term appears in each note of postings(term).
+        Only for counted indexes."""
+        return(self.__term(term)[1])
+
+    def positions(self, term):
+        """Get the positions of a term in each note of postings(term), as an
+        array of the positions of every note one after the other. Each note
+        has freqs(term) of them. Only for positional indexes."""
+        return(self.__term(term)[2])
+
+    def doc_id(self, name):
+        """Get the id of a live note, or None if it is not indexed."""
+        doc_key = self.__doc_keys.get(name)
+        if doc_key is None:
+            return(None)
+        return(doc_key[0])
+
+    def doc_length(self, docid):
+        """Get the number of terms in a note. Only for counted indexes."""
+        return(self.__lengths[docid])
+
+    def doc_stats(self):
+        """Get (number of documents, average document length) for ranking.
+        The number of documents includes dead documents not compacted yet,
+        like the postings do, so that it stays consistent with them."""
+        live = len(self.__doc_keys)
+        count = live + self.__dead
+        if not live:
+            return(count, 0.0)
+        return(count, self.__total_length / live)
+
+    def names(self, docids):
+        """Get the set of names of live notes from their ids, including notes
+        that could not be indexed."""
+        docs = self.__docs
+        found = set(docs[docid] for docid in docids if docid in docs)
+        found.update(self.__opaque)
+        return(found)
+
+
+def _decode(chunks):
+    """Join the (doc ids, counts, positions) blobs of the chunks of a term
+    into arrays."""
+    entry = (array('I'), array('I'), array('I'))
+    for docids, counts, positions in chunks:
+        if docids:
+            entry[0].frombytes(docids)
+        if counts:
+            entry[1].frombytes(counts)
+        if positions:
+            # Two bytes per position if they all fit, see _encode.
+            if len(positions) == 2 * sum(array('I', counts)):
+                entry[2].fromlist(array('H', positions).tolist())
+            else:
+                entry[2].frombytes(positions)
+    return(entry)
+
+
+def _encode(entry):
+    docids, counts, positions = entry
+    if positions and max(positions) <= 0xffff:
+        positions = array('H', positions)
+    return(tuple(values.tobytes() if values else None
+                 for values in (docids, counts, positions)))
+
+
+def _live(entry, docs):
+    """Get the (doc ids, counts, positions) arrays of a term without the
+    documents that are not in docs."""
+    docids, counts, positions = entry
+    live = (array('I'), array('I'), array('I'))
+    offset = 0
+    for i, docid in enumerate(docids):
+        count = counts[i] if counts else 0
+        if docid in docs:
+            live[0].append(docid)
+            if counts:
+                live[1].append(count)
+            if positions:
+                live[2].extend(positions[offset:offset + count])
+        if positions:
+            offset += count
+    return(live)
+
+
+class SearchIndex(PostingsIndex):
+    """Index of the words in the notes of a repository, used by
+    FileRepo.search_files.
+
+    Query strings are matched as case-insensitive substrings, like
+    FileRepo.search_files does without an index, so the index only narrows
+    the notes down to candidates that are then checked by the caller.
+
+    Keyword arguments:
+    index_path -- path of the file holding the index.
+    root -- root directory of the note repository.
+    """
+    kind = 'words'
+    counted = True
+
+    def __init__(self, index_path, root):
+        self.__vocab = None  # (joined terms, start offsets, terms)
+        self.__idf = {}      # term -> BM25 idf, until the index changes
+        PostingsIndex.__init__(self, index_path, root)
+
+    def terms_changed(self):
+        self.__vocab = None
+
+    def update(self, names, stats_list):
+        PostingsIndex.update(self, names, stats_list)
+        self.__idf = {}
+
+    def __terms_containing(self, substring):
+        """Get every indexed term that contains substring."""
+        if self.__vocab is None:
+            terms = self.terms()
+            starts = []
+            offset = 0
+            for term in terms:
+                starts.append(offset)
+                offset += len(term) + 1
+            self.__vocab = ('\n'.join(terms), starts, terms)
+        joined, starts, terms = self.__vocab
+        found = set()
+        for match in re.finditer(re.escape(substring), joined):
+            found.add(terms[bisect_right(starts, match.start()) - 1])
+        return(found)
+
+    def candidates(self, queries_list):
+        """Get the names of the notes that may contain every query string.
+
+        Returns:
+            set of names, or None if the queries can't be narrowed down with
+            the index (e.g. they contain no word characters).
+        """
+        docids = None
+        for query in queries_list:
+            for token in tokenize(query):
+                matching = set()
+                terms = self.__terms_containing(token)
+                self.read_postings(terms)
+                for term in terms:
+                    matching.update(self.postings(term))
+                if docids is None:
+                    docids = matching
+                else:
+                    docids &= matching
+                if not docids:
+                    return(set())
+        if docids is None:
+            return(None)
+        return(self.names(docids))
+
+    def __term_idf(self, term, count):
+        idf = self.__idf.get(term)
+        if idf is None:
+            df = len(self.postings(term))
+            idf = log(1 + (count - df + 0.5) / (df + 0.5))
+            self.__idf[term] = idf
+        return(idf)
+
+    def rank(self, names, queries_list, limit=None):
+        """Order notes by their BM25 score for a list of query strings. Each
+        word of a query scores the indexed terms that contain it, like
+        candidates() matches them.
+
+        Keyword arguments:
+        names -- list of names of the notes to rank.
+        queries_list -- list of query strings.
+        limit -- keep only this many of the best notes (default None, all).
+
+        Returns:
+            list of names, best first. Notes with equal scores, including
+            notes that are not indexed, keep the order of names.
+        """
+        scores = {}
+        for name in names:
+            docid = self.doc_id(name)
+            if docid is not None:
+                scores[docid] = 0.0
+        count, avg_length = self.doc_stats()
+        tokens = set()
+        for query in queries_list:
+            tokens.update(tokenize(query))
+        terms = set()
+        for token in tokens:
+            terms.update(self.__terms_containing(token))
+
+        self.read_postings(terms)
+        for term in terms:
+            idf = self.__term_idf(term, count)
+            for docid, tf in zip(self.postings(term), self.freqs(term)):
+                if docid not in scores:
+                    continue
+                norm = _BM25_K1 * (1 - _BM25_B + _BM25_B *
+                                   self.doc_length(docid) / avg_length)
+                scores[docid] += idf * tf * (_BM25_K1 + 1) / (tf + norm)
+
+        keyed = []
+        for pos, name in enumerate(names):
+            docid = self.doc_id(name)
+            keyed.append((scores.get(docid, 0.0), -pos, name))
+        if limit is not None and limit < len(keyed):
+            best = heapq.nlargest(limit, keyed)
+        else:
+            best = sorted(keyed, reverse=True)
+        return([name for score, pos, name in best])
+
+
+class TrigramIndex(PostingsIndex):
+    """Index of the lowercase character trigrams in the notes of a
+    repository, used by FileRepo.grep_files to pick the notes that can
+    possibly match a pattern before running grep on them.
+
+    Keyword arguments:
+    index_path -- path of the file holding the index.
+    root -- root directory of the note repository.
+    """
+    kind = 'trigrams'
+
+    def read_terms(self, filepath):
+        try:
+            with open(filepath, 'rb') as notefile:
+                text = notefile.read().decode('utf-8').lower()
+        except OSError:
+            return(set())
+        except UnicodeDecodeError:
+            # grep may still match it, so it is always a candidate.
+            return(None)
+        return(set(text[i:i + 3] for i in range(len(text) - 2)))
+
+    def candidates(self, pattern):
+        """Get the names of the notes that may match a grep basic regular
+        expression, case insensitive.
+
+        Returns:
+            set of names, or None if the pattern has no literal part long
+            enough to narrow down the notes.
+        """
+        trigrams = set()
+        for literal in required_literals(pattern):
+            literal = literal.lower()
+            for i in range(len(literal) - 2):
+                trigrams.add(literal[i:i + 3])
+        if not trigrams:
+            return(None)
+        self.read_postings(trigrams)
+        postings = sorted((self.postings(trigram) for trigram in trigrams),
+                          key=len)
+        docids = set(postings[0])
+        for trigram_postings in postings[1:]:
+            if not docids:
+                break
+            docids.intersection_update(trigram_postings)
+        return(self.names(docids))
+
+
+class PositionalIndex(PostingsIndex):
+    """Index of the positions of the words in the notes of a repository,
+    used by FileRepo.search_files to answer phrase and proximity queries
+    (see positional_query) without reading the notes. A query only reads
+    the positions of its own terms, kept in two bytes each when the notes
+    are short enough.
+
+    Keyword arguments:
+    index_path -- path of the file holding the index.
+    root -- root directory of the note repository.
+    """
+    kind = 'positions'
+    positional = True
+
+    def read_terms(self, filepath):
+        return(read_positions(filepath))
+
+    def matching(self, query):
+        """Get the names of the notes matching a query parsed by
+        positional_query."""
+        terms = query_terms(query)
+        self.read_postings(terms)
+        docids = None
+        for term in terms:
+            term_docids = set(self.postings(term))
+            if docids is None:
+                docids = term_docids
+            else:
+                docids &= term_docids
+            if not docids:
+                return(set())
+        by_doc = {docid: {} for docid in docids}
+        for term in set(terms):
+            positions = self.positions(term)
+            offset = 0
+            for docid, count in zip(self.postings(term), self.freqs(term)):
+                if docid in by_doc:
+                    by_doc[docid][term] = positions[offset:offset + count]
+                offset += count
+        return(self.names(docid for docid, doc_positions in by_doc.items()
+                          if positions_match(doc_positions, query)))
+
+
+_NEAR_RE = re.compile(r'^NEAR(?:/(\d+))?$')
+_FILTER_RE = re.compile(r'"([^"]*)"|(\S+)')
+_DEFAULT_NEAR = 10
+
+
+def parse_filter(filter_string):
+    """Split a search filter in query strings. Words are separated by
+    spaces, except inside double quotes, which make a phrase query, and
+    around NEAR/k, which makes a proximity query of the words before and
+    after it, e.g. 'todo "load balancer config" dns NEAR/3 cache'."""
+    parts = []
+    for match in _FILTER_RE.finditer(filter_string):
+        phrase = match.group(1)
+        if phrase is None:
+            parts.append(match.group(2))
+        elif _TOKEN_RE.search(phrase):
+            parts.append('"' + phrase + '"')
+        elif phrase.strip():
+            # Nothing to look up in the index, search it as it is.
+            parts.append(phrase.strip())
+    queries = []
+    i = 0
+    while i < len(parts):
+        if _NEAR_RE.match(parts[i]) and queries and i + 1 < len(parts):
+            near = queries[-1] + ' ' + parts[i] + ' ' + parts[i + 1]
+            if positional_query(near) is not None:
+                queries[-1] = near
+                i += 2
+                continue
+        queries.append(parts[i])
+        i += 1
+    return(queries)
+
+
+def positional_query(query):
+    """Parse a query string from parse_filter that needs positions.
+
+    Returns:
+        ('phrase', terms) for a quoted phrase, ('near', distance, terms) for
+        a proximity query, or None for a plain substring query.
+    """
+    if len(query) > 1 and query[0] == '"' and query[-1] == '"':
+        return(('phrase', _TOKEN_RE.findall(query[1:-1].lower())))
+    parts = query.split(' ')
+    if len(parts) == 3:
+        near = _NEAR_RE.match(parts[1])
+        if near:
+            distance = int(near.group(1) or _DEFAULT_NEAR)
+            terms = [_TOKEN_RE.findall(part.lower()) for part in
+                     (parts[0], parts[2])]
+            if all(len(part_terms) == 1 for part_terms in terms):
+                return(('near', distance, [terms[0][0], terms[1][0]]))
+    return(None)
+
+
+def query_terms(query):
+    """Get the list of terms of a parsed positional query."""
+    return(query[-1])
+
+
+def positions_match(doc_positions, query):
+    """Check whether a note matches a parsed positional query.
+
+    Keyword arguments:
+    doc_positions -- dict of term to the array of its positions in the note,
+                     as given by text_positions.
+    query -- query parsed by positional_query.
+    """
+    terms = query_terms(query)
+    if not terms:
+        return(True)
+    if any(term not in doc_positions for term in terms):
+        return(False)
+    if query[0] == 'phrase':
+        following = [set(doc_positions[term]) for term in terms[1:]]
+        for start in doc_positions[terms[0]]:
+            if all(start + i + 1 in term_positions
+                   for i, term_positions in enumerate(following)):
+                return(True)
+        return(False)
+
+    distance = query[1]
+    first = doc_positions[terms[0]]
+    second = doc_positions[terms[1]]
+    i = j = 0
+    while i < len(first) and j < len(second):
+        if abs(first[i] - second[j]) <= distance:
+            return(True)
+        if first[i] < second[j]:
+            i += 1
+        else:
+            j += 1
+    return(False)
+
+
+# Escapes that stand for themselves in a grep basic regular expression.
+_BRE_LITERAL_ESCAPES = '.*[]^$\\/-'
+
+
+def _skip_bracket(pattern, i):
+    """Get the index right after the bracket expression starting at i."""
+    j = i + 1
+    if j < len(pattern) and pattern[j] == '^':
+        j += 1
+    # A ']' right after '[' or '[^' is part of the expression.
+    if j < len(pattern) and pattern[j] == ']':
+        j += 1
+    while j < len(pattern):
+        if pattern[j] == ']':
+            return(j + 1)
+        if pattern[j] == '[' and pattern[j + 1:j + 2] in (':', '.', '='):
+            end = pattern.find(pattern[j + 1] + ']', j + 2)
+            if end == -1:
+                return(len(pattern))
+            j = end + 2
+            continue
+        j += 1
+    return(len(pattern))
+
+
+def required_literals(pattern):
+    """Get strings that any line matching a grep basic regular expression
+    must contain. Parts inside groups, parts that are made optional by a
+    quantifier and patterns with alternatives are left out, so the result
+    may be incomplete but never wrong.
+    """
+    if '\\|' in pattern:
+        return([])
+    literals = []
+    run = ''
+    depth = 0
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        quantified = False
+        literal = None
+        if char == '\\' and i + 1 < len(pattern):
+            nxt = pattern[i + 1]
+            i += 2
+            if nxt in _BRE_LITERAL_ESCAPES:
+                literal = nxt
+            elif nxt == '(':
+                depth += 1
+            elif nxt == ')':
+                depth -= 1
+            elif nxt in '?+':
+                quantified = True
+            elif nxt == '{':
+                quantified = True
+                j = pattern.find('\\}', i)
+                i = len(pattern) if j == -1 else j + 2
+        elif char == '[':
+            i = _skip_bracket(pattern, i)
+        elif char == '*' and (run or i > 0):
+            quantified = True
+            i += 1
+        elif char in '.^$':
+            i += 1
+        else:
+            literal = char
+            i += 1
+
+        if quantified:
+            run = run[:-1]
+        if literal is not None and depth == 0:
+            run += literal
+            continue
+        if quantified or literal is None or depth:
+            if run:
+                literals.append(run)
+            run = ''
+    if run:
+        literals.append(run)
+    return(literals)
+
+
+# Index class of each kind of index.
+INDEX_KINDS = {'words': SearchIndex,
+               'trigrams': TrigramIndex,
+               'positions': PositionalIndex}
+
+
+def index_path(qndata, instance, kind='words'):
+    """Path of an index of a qn instance inside the qn data dir."""
+    return(path.join(qndata, 'index-' + kind + '-' + instance + '.sqlite'))
@@ -0,0 +1,151 @@
+"""Persistent stat snapshot of a note repository"""
+
+import pickle
+from os import path, replace, remove
+from time import time_ns
+
+_SNAPSHOT_VERSION = 4
+# Directories modified less than this long before they were listed may have
+# changed again within the same mtime tick, so their listing is not trusted.
+_RACY_NS = 1000000000
+
+
+class StatSnapshot:
+    """Class that stores, between runs, the listing of every directory of a
+    note repository. A directory only needs to be listed again when its
+    mtime changes. The stats of the files are not kept: a note edited in
+    place does not change the mtime of its directory, so they are taken
+    afresh when needed. The sort orders of the files are kept too, so that
+    they only need to be updated.
+
+    Keyword arguments:
+    snapshot_path -- path of the file holding the snapshot.
+    root -- root directory of the note repository the snapshot describes.
+    """
+    def __init__(self, snapshot_path, root):
+        self.__path = snapshot_path
+        self.__root = root
+        self.__dirs = {}
+        self.__orders = {}
+        self.__seen = set()
+        self.__changed = False
+        self.load()
+
+    @property
+    def snapshot_path(self):
+        return(self.__path)
+
+    def load(self):
+        """Load the snapshot from disk. A missing, unreadable or outdated
+        snapshot is simply discarded."""
+        self.__dirs = {}
+        self.__orders = {}
+        try:
+            with open(self.__path, 'rb') as snapfile:
+                data = pickle.load(snapfile)
+        except Exception:
+            return
+        if not isinstance(data, dict):
+            return
+        if data.get('version') != _SNAPSHOT_VERSION:
+            return
+        if data.get('root') != self.__root:
+            return
+        self.__dirs = data['dirs']
+        self.__orders = data['orders']
+
+    def save(self):
+        """Write the snapshot to disk if it changed since it was loaded."""
+        if not self.__changed:
+            return
+        data = {'version': _SNAPSHOT_VERSION,
+                'root': self.__root,
+                'dirs': self.__dirs,
+                'orders': self.__orders}
+        tmp_path = self.__path + '.tmp'
+        try:
+            with open(tmp_path, 'wb') as snapfile:
+                pickle.dump(data, snapfile, pickle.HIGHEST_PROTOCOL)
+            replace(tmp_path, self.__path)
+        except OSError:
+            try:
+                remove(tmp_path)
+            except OSError:
+                pass
+            return
+        self.__changed = False
+
+    def begin_scan(self):
+        """Start tracking which directories are visited by a scan."""
+        self.__seen = set()
+
+    def end_scan(self):
+        """Forget directories that were not visited by the last scan."""
+        for reldir in list(self.__dirs):
+            if reldir not in self.__seen:
+                del self.__dirs[reldir]
+                self.__changed = True
+
+    def get(self, reldir, mtime_ns):
+        """Get the cached listing of a directory.
+
+        Keyword arguments:
+        reldir -- directory path relative to the repository root.
+        mtime_ns -- current mtime of the directory in nanoseconds.
+
+        Returns:
+            (subdirs, files) if the cached listing is still valid, None
+            otherwise. files is the list of file names.
+        """
+        self.__seen.add(reldir)
+        cached = self.__dirs.get(reldir)
+        if cached is None:
+            return(None)
+        cached_mtime, racy, subdirs, files = cached
+        if racy or cached_mtime != mtime_ns:
+            return(None)
+        return(subdirs, files)
+
+    def put(self, reldir, mtime_ns, subdirs, files, listed_ns=None):
+        """Store the listing of a directory.
+
+        Keyword arguments:
+        reldir -- directory path relative to the repository root.
+        mtime_ns -- mtime of the directory when it was listed.
+        subdirs -- list of subdirectory names.
+        files -- list of file names.
+        listed_ns -- time at which the directory was listed (default now).
+        """
+        if listed_ns is None:
+            listed_ns = time_ns()
+        racy = mtime_ns >= listed_ns - _RACY_NS
+        self.__seen.add(reldir)
+        self.__dirs[reldir] = (mtime_ns, racy, subdirs, files)
+        self.__changed = True
+
+    def get_order(self, sortby):
+        """Get the last stored order of the files for a sort key, as an
+        ascending list of (value, name) tuples, or None."""
+        return(self.__orders.get(sortby))
+
+    def set_order(self, sortby, order):
+        """Store the order of the files for a sort key.
+
+        Keyword arguments:
+        sortby -- sort key, a FileRecord property.
+        order -- ascending list of (value, name) tuples.
+        """
+        self.__orders[sortby] = order
+        self.__changed = True
+
+    def invalidate(self, reldir):
+        """Force the next scan to list a directory again. Used for notes that
+        may be edited in place, which does not change the directory mtime."""
+        if reldir in self.__dirs:
+            del self.__dirs[reldir]
+            self.__changed = True
+
+
+def snapshot_path(qndata, instance):
+    """Path of the snapshot file of a qn instance inside the qn data dir."""
+    return(path.join(qndata, 'snapshot-' + instance + '.pickle'))
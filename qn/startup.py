@@ -0,0 +1,91 @@
+"""Startup report: the time qn takes to reach its first launcher write, and
+how long each module imported on the way took, like python -X importtime.
+
+It is enabled by setting QN_STARTUP_REPORT, to a file to write the report
+to, or to 1 to print it on stderr, when qn exits."""
+
+import builtins
+import sys
+from os import environ
+from time import perf_counter
+
+_start = None
+_marks = []  # (label, seconds since start)
+_imports = []  # (depth, module, self seconds, cumulative seconds)
+_children = []  # seconds spent in nested imports, per import being timed
+_import = builtins.__import__
+
+
+def _timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+    if level or name in sys.modules:
+        return(_import(name, globals, locals, fromlist, level))
+    _children.append(0.0)
+    start = perf_counter()
+    try:
+        return(_import(name, globals, locals, fromlist, level))
+    finally:
+        total = perf_counter() - start
+        children = _children.pop()
+        if _children:
+            _children[-1] += total
+        _imports.append((len(_children), name, total - children, total))
+
+
+def enabled():
+    return(bool(environ.get('QN_STARTUP_REPORT')))
+
+
+def start():
+    """Start timing, before qn imports anything else. Does nothing unless
+    QN_STARTUP_REPORT is set."""
+    global _start
+    if not enabled() or _start is not None:
+        return
+    import atexit
+
+    _start = perf_counter()
+    builtins.__import__ = _timed_import
+    atexit.register(write_report)
+
+
+def mark(label):
+    """Note the time a step of the startup is reached, the first time only.
+    """
+    if _start is None:
+        return
+    for marked, seconds in _marks:
+        if marked == label:
+            return
+    _marks.append((label, perf_counter() - _start))
+    if label == 'first launcher write':
+        # Imports after this point are not part of the startup.
+        builtins.__import__ = _import
+
+
+def report():
+    """Get the startup report as a list of lines."""
+    lines = ['import time: self [us] | cumulative | imported package']
+    for depth, name, self_time, total in _imports:
+        lines.append('import time: ' + str(int(self_time * 1e6)).rjust(9) +
+                     ' | ' + str(int(total * 1e6)).rjust(10) + ' | ' +
+                     '  ' * depth + name)
+    for label, seconds in _marks:
+        lines.append('startup: ' + ('%.1f ms' % (seconds * 1000)).rjust(10) +
+                     ' | ' + label)
+    return(lines)
+
+
+def write_report():
+    """Write the report where QN_STARTUP_REPORT says."""
+    target = environ.get('QN_STARTUP_REPORT')
+    if not target or _start is None:
+        return
+    text = '\n'.join(report()) + '\n'
+    if target == '1':
+        sys.stderr.write(text)
+        return
+    try:
+        with open(target, 'w') as reportfile:
+            reportfile.write(text)
+    except OSError:
+        sys.stderr.write(text)
@@ -0,0 +1,184 @@
+"""Cached one line summaries of notes, shown in the 'misc' block of lines"""
+
+import pickle
+import threading
+from os import path, replace, remove, stat
+from stat import ST_MTIME
+
+_CACHE_VERSION = 2
+_HEAD_BYTES = 4096
+_MAX_LENGTH = 200
+
+
+def extract_summary(filepath):
+    """Get the summary of a note from its first few KB: its first markdown
+    heading, or its first non-empty line if it has none. Binary and
+    unreadable notes have an empty summary."""
+    try:
+        with open(filepath, 'rb') as notefile:
+            head = notefile.read(_HEAD_BYTES)
+    except OSError:
+        return('')
+    if b'\x00' in head:
+        return('')
+    # The head may end in the middle of a character.
+    lines = head.decode('utf-8', 'ignore').splitlines()
+    first = None
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith('#') and line.lstrip('#')[:1] in (' ', '\t'):
+            return(line.lstrip('#').strip()[:_MAX_LENGTH])
+        if first is None:
+            first = line
+    if first is None:
+        return('')
+    return(first[:_MAX_LENGTH])
+
+
+class SummaryCache:
+    """Class that keeps the summaries of the notes of a repository between
+    runs, keyed by the inode, mtime and size of each note so that only new
+    or changed notes are read again.
+
+    Summaries are looked up right away, and missing or outdated ones are
+    extracted by refresh() in a background thread, which also takes the
+    notes of the refreshes asked for while it runs.
+
+    Keyword arguments:
+    cache_path -- path of the file holding the cache.
+    root -- root directory of the note repository.
+    """
+    def __init__(self, cache_path, root):
+        self.__path = cache_path
+        self.__root = root
+        # name -> ((inode, mtime, size), summary), the mtime in whole
+        # seconds like FileRecord.mdate, so that both can be compared.
+        self.__summaries = {}
+        self.__worker = None
+        self.__lock = threading.Lock()  # for the worker and what it takes
+        self.__pending = []  # names left for the worker
+        self.__keep = None   # keep of the latest refresh left for it
+        self.__changed = False
+        self.load()
+
+    @property
+    def cache_path(self):
+        return(self.__path)
+
+    def load(self):
+        """Load the cache from disk. A missing, unreadable or outdated cache
+        is simply discarded."""
+        self.__summaries = {}
+        try:
+            with open(self.__path, 'rb') as cachefile:
+                data = pickle.load(cachefile)
+        except Exception:
+            return
+        if not isinstance(data, dict):
+            return
+        if data.get('version') != _CACHE_VERSION:
+            return
+        if data.get('root') != self.__root:
+            return
+        self.__summaries = data['summaries']
+
+    def save(self):
+        """Write the cache to disk if it changed."""
+        if not self.__changed:
+            return
+        data = {'version': _CACHE_VERSION,
+                'root': self.__root,
+                'summaries': dict(self.__summaries)}
+        tmp_path = self.__path + '.tmp'
+        try:
+            with open(tmp_path, 'wb') as cachefile:
+                pickle.dump(data, cachefile, pickle.HIGHEST_PROTOCOL)
+            replace(tmp_path, self.__path)
+        except OSError:
+            try:
+                remove(tmp_path)
+            except OSError:
+                pass
+            return
+        self.__changed = False
+
+    def get(self, name, mdate=None, size=None, ino=None):
+        """Get the cached summary of a note, or None if it has none or, when
+        mdate, size and ino are given, if the note changed since, including
+        when it was replaced by another file."""
+        entry = self.__summaries.get(name)
+        if entry is None:
+            return(None)
+        if mdate is not None and entry[0] != (ino, mdate, size):
+            return(None)
+        return(entry[1])
+
+    def __refresh(self, names, keep):
+        for name in names:
+            try:
+                filestat = stat(self.__root + name)
+            except OSError:
+                continue
+            key = (filestat.st_ino, filestat[ST_MTIME], filestat.st_size)
+            entry = self.__summaries.get(name)
+            if entry is not None and entry[0] == key:
+                continue
+            self.__summaries[name] = (key,
+                                      extract_summary(self.__root + name))
+            self.__changed = True
+        if keep is not None:
+            for name in list(self.__summaries):
+                if name not in keep:
+                    del self.__summaries[name]
+                    self.__changed = True
+        self.save()
+
+    def __run(self):
+        """Refresh the notes left by refresh() until there are none."""
+        while True:
+            with self.__lock:
+                names, self.__pending = self.__pending, []
+                keep, self.__keep = self.__keep, None
+                if not names and keep is None:
+                    self.__worker = None
+                    return
+            self.__refresh(names, keep)
+
+    def refresh(self, names, keep=None):
+        """Extract the summaries of notes whose inode, mtime or size changed
+        in a background thread, then save the cache. While an earlier
+        refresh is still running, the notes are left for it to do next.
+
+        Keyword arguments:
+        names -- list of names of the notes to check.
+        keep -- set of the names of every note of the repository, to forget
+                the others (default None, keep every summary).
+        """
+        with self.__lock:
+            self.__pending.extend(names)
+            if keep is not None:
+                self.__keep = keep
+            if self.__worker is None:
+                # Not a daemon thread, so that the cache is saved before qn
+                # exits.
+                self.__worker = threading.Thread(target=self.__run)
+                self.__worker.start()
+
+    def refreshing(self):
+        """Whether a background refresh is running."""
+        with self.__lock:
+            return(self.__worker is not None)
+
+    def wait(self):
+        """Wait for the background refreshes to finish."""
+        with self.__lock:
+            worker = self.__worker
+        if worker:
+            worker.join()
+
+
+def cache_path(qndata, instance):
+    """Path of the summary cache of a qn instance inside the qn data dir."""
+    return(path.join(qndata, 'summaries-' + instance + '.pickle'))
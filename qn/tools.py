@@ -0,0 +1,142 @@
+"""Lookup of the programs qn runs in PATH, kept between runs"""
+
+import pickle
+from os import path, environ, access, stat, replace, remove, X_OK, pathsep
+
+_CACHE_VERSION = 1
+
+
+def _search_path():
+    return(environ.get('PATH', ''))
+
+
+def path_key(config_path=None):
+    """What the lookups depend on: PATH, the mtimes of its directories, so
+    that installed or removed programs are noticed, and the mtime of the
+    config file."""
+    dir_mtimes = []
+    for dirpath in _search_path().split(pathsep):
+        try:
+            dir_mtimes.append(stat(dirpath or '.').st_mtime_ns)
+        except OSError:
+            dir_mtimes.append(None)
+    config_mtime = None
+    if config_path:
+        try:
+            config_mtime = stat(config_path).st_mtime_ns
+        except OSError:
+            pass
+    return((_search_path(), tuple(dir_mtimes), config_path, config_mtime))
+
+
+def find_program(cmd):
+    """Find a program like the shell would, without running one.
+
+    Returns:
+        path of the program, or None if it is not found.
+    """
+    if not cmd:
+        return(None)
+    if '/' in cmd:
+        if path.isfile(cmd) and access(cmd, X_OK):
+            return(cmd)
+        return(None)
+    for dirpath in _search_path().split(pathsep):
+        filepath = path.join(dirpath or '.', cmd)
+        if path.isfile(filepath) and access(filepath, X_OK):
+            return(filepath)
+    return(None)
+
+
+class ToolCache:
+    """Class that keeps where the programs qn runs were found, so that
+    starting qn does not search PATH, or start a shell, for each of them.
+    Every lookup is dropped when PATH, a directory in it or the config file
+    change.
+
+    Keyword arguments:
+    cache_path -- path of the file holding the cache, or None to only keep
+                  it in memory.
+    config_path -- path of the config file in use (default None).
+    """
+    def __init__(self, cache_path, config_path=None):
+        self.__path = cache_path
+        self.__key = path_key(config_path)
+        self.__found = {}  # command -> path, or None if not installed
+        self.load()
+
+    @property
+    def cache_path(self):
+        return(self.__path)
+
+    def load(self):
+        """Load the cache from disk. A missing, unreadable or outdated cache
+        is simply discarded."""
+        self.__found = {}
+        if not self.__path:
+            return
+        try:
+            with open(self.__path, 'rb') as cachefile:
+                data = pickle.load(cachefile)
+        except Exception:
+            return
+        if not isinstance(data, dict):
+            return
+        if data.get('version') != _CACHE_VERSION:
+            return
+        if data.get('key') != self.__key:
+            return
+        self.__found = data['found']
+
+    def save(self):
+        """Write the cache to disk."""
+        if not self.__path:
+            return
+        data = {'version': _CACHE_VERSION,
+                'key': self.__key,
+                'found': self.__found}
+        tmp_path = self.__path + '.tmp'
+        try:
+            with open(tmp_path, 'wb') as cachefile:
+                pickle.dump(data, cachefile, pickle.HIGHEST_PROTOCOL)
+            replace(tmp_path, self.__path)
+        except OSError:
+            try:
+                remove(tmp_path)
+            except OSError:
+                pass
+
+    def which(self, cmd):
+        """Get the path of a program, or None if it is not installed."""
+        if cmd not in self.__found:
+            self.__found[cmd] = find_program(cmd)
+            self.save()
+        return(self.__found[cmd])
+
+
+_tools = ToolCache(None)
+
+
+def use_cache(qndata, config_path=None):
+    """Keep the lookups in the qn data dir from now on, for the config file
+    at config_path.
+
+    Keyword arguments:
+    qndata -- qn data directory, or None to keep lookups in memory only.
+    config_path -- path of the config file in use (default None).
+    """
+    global _tools
+    cache_path = None
+    if qndata:
+        cache_path = path.join(qndata, 'tools.pickle')
+    _tools = ToolCache(cache_path, config_path)
+
+
+def which(cmd):
+    """Get the path of a program, or None if it is not installed."""
+    return(_tools.which(cmd))
+
+
+def cmd_exists(cmd):
+    """Check if a program exists in PATH."""
+    return(which(cmd) is not None)
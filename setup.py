@@ -14,7 +14,7 @@ setup(name='qn',
       author_email='mbfraga@gmail.com',
       url='https://www.github.com/mbfraga/qn/',
       packages=['qn'],
-      scripts=['bin/qnr', 'bin/qnf'],
+      scripts=['bin/qnr', 'bin/qnf', 'bin/qnd', 'bin/qns'],
       data_files=data_files,
       install_requires=['configargparse'],
       )
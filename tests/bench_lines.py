@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+# -*- Mode: Python; coding: utf-8; indent-tabs-mode: nil; tab-width: 4 -*-
+
+# Time FileRepo.lines for a large repo: the first render, and renders after
+# sort changes, which reuse the lines kept in each record.
+# Usage: bench_lines.py [number of notes, default 100000]
+
+import os
+import sys
+import time
+import tempfile
+from os.path import realpath, dirname, normpath
+
+LAUNCH_PATH = dirname(realpath(__file__))
+if LAUNCH_PATH != "/usr/bin":
+    sys.dont_write_bytecode = True
+    SOURCE_PATH = normpath(os.path.join(LAUNCH_PATH, '..'))
+    sys.path.insert(0, SOURCE_PATH)
+
+from qn import qn
+
+nnotes = 100000
+if len(sys.argv) > 1:
+    nnotes = int(sys.argv[1])
+
+
+def timed(message, function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    print(message.ljust(40), '%8.1f ms' % ((time.perf_counter() - start) *
+                                           1000))
+    return(result)
+
+
+with tempfile.TemporaryDirectory() as qndir:
+    now = time.time()
+    for i in range(nnotes):
+        notepath = os.path.join(qndir, 'note' + str(i) + '.txt')
+        with open(notepath, 'w') as notefile:
+            notefile.write('x' * (i % 5000))
+        # Spread the notes over a year of mtimes.
+        os.utime(notepath, (now, now - i * 317))
+
+    repo = qn.FileRepo(qndir)
+    timed('scan ' + str(nnotes) + ' notes', repo.scan_files)
+    repo.sort('cdate')
+    lineformat = ['name', 'mdate', 'size']
+    timed('first lines()', repo.lines, lineformat)
+    for sortby in ('name', 'size', 'mdate', 'cdate'):
+        repo.sort(sortby)
+        timed('lines() after sorting by ' + sortby, repo.lines, lineformat)
+    fresh = qn.FileRepo(qndir)
+    fresh.scan_files()
+    print('same lines as a fresh repo:',
+          sorted(repo.lines(lineformat)) == sorted(fresh.lines(lineformat)))
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- Mode: Python; coding: utf-8; indent-tabs-mode: nil; tab-width: 4 -*-
+
+# Options are parsed once, then loaded from their compiled copy until the
+# config file, the command line or the environment change.
+
+import os
+import sys
+import time
+import tempfile
+from os.path import realpath, dirname, normpath
+
+LAUNCH_PATH = dirname(realpath(__file__))
+if LAUNCH_PATH != "/usr/bin":
+    sys.dont_write_bytecode = True
+    SOURCE_PATH = normpath(os.path.join(LAUNCH_PATH, '..'))
+    sys.path.insert(0, SOURCE_PATH)
+
+from qn import config_parser
+
+parsed = []
+_parse_config = config_parser.QnOptions.parse_config
+
+
+def counting_parse_config(self, argv=None):
+    parsed.append(1)
+    return(_parse_config(self, argv))
+
+
+def write_config(config_path, qndir, sorttype):
+    with open(config_path, 'w') as config:
+        config.write('qndir=' + qndir + '\n' +
+                     'sorttype=' + sorttype + '\n')
+    # Noticed whatever the resolution of mtimes.
+    later = time.time() + len(parsed)
+    os.utime(config_path, (later, later))
+
+
+def load(argv):
+    """Load the options like a new qnf run with arguments argv would.
+    Returns them and whether the config was parsed."""
+    del parsed[:]
+    sys.argv = ['qnf'] + argv
+    qno = config_parser.QnOptions(app='fzf', run_parse_config=True)
+    return(qno, bool(parsed))
+
+
+def test_compiled_config():
+    saved_argv = sys.argv
+    saved_cache_home = os.environ.get('XDG_CACHE_HOME')
+    saved_default = config_parser._DEFAULT_CONFIG
+    config_parser.QnOptions.parse_config = counting_parse_config
+    try:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            os.environ['XDG_CACHE_HOME'] = os.path.join(tmpdir, 'cache')
+            default_path = os.path.join(tmpdir, 'default_config')
+            config_parser._DEFAULT_CONFIG = default_path
+            with open(default_path, 'w') as config:
+                config.write('scan-workers=2\n')
+            qndir = os.path.join(tmpdir, 'notes')
+            config_path = os.path.join(tmpdir, 'config')
+            write_config(config_path, qndir, 'name')
+            argv = ['-c', config_path]
+
+            print('* first run parses the config')
+            qno, was_parsed = load(argv)
+            assert was_parsed
+            assert os.path.isfile(config_parser.compiled_config_path('fzf'))
+            assert qno.sorttype == 'name'
+            options = (qno.qndir, qno.qndata, qno.sorttype, qno.command)
+
+            print('* later runs load the compiled options')
+            qno, was_parsed = load(argv)
+            assert not was_parsed
+            assert (qno.qndir, qno.qndata, qno.sorttype,
+                    qno.command) == options
+            # The command is a copy, changing it changes no other run.
+            qno.command.append('--extra')
+            assert qno.command == options[3]
+
+            print('* after the config file changed')
+            write_config(config_path, qndir, 'size')
+            qno, was_parsed = load(argv)
+            assert was_parsed
+            assert qno.sorttype == 'size'
+            assert not load(argv)[1]
+
+            print('* after the command line changed')
+            qno, was_parsed = load(argv + ['--sorttype', 'mdate'])
+            assert was_parsed
+            assert qno.sorttype == 'mdate'
+            qno, was_parsed = load(argv)
+            assert was_parsed
+            assert qno.sorttype == 'size'
+
+            print('* after the default config changed, with -c')
+            with open(default_path, 'w') as config:
+                config.write('scan-workers=3\n')
+            later = time.time() + 10
+            os.utime(default_path, (later, later))
+            qno, was_parsed = load(argv)
+            assert was_parsed
+            assert qno.scan_workers == 3
+            assert qno.sorttype == 'size'
+            assert not load(argv)[1]
+
+            print('* with a broken compiled copy')
+            with open(config_parser.compiled_config_path('fzf'), 'wb') as cf:
+                cf.write(b'broken')
+            qno, was_parsed = load(argv)
+            assert was_parsed
+            assert qno.sorttype == 'size'
+            print('---------------')
+    finally:
+        config_parser.QnOptions.parse_config = _parse_config
+        config_parser._DEFAULT_CONFIG = saved_default
+        sys.argv = saved_argv
+        if saved_cache_home is None:
+            os.environ.pop('XDG_CACHE_HOME', None)
+        else:
+            os.environ['XDG_CACHE_HOME'] = saved_cache_home
+
+
+if __name__ == '__main__':
+    test_compiled_config()
+    print('OK')
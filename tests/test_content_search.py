@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- Mode: Python; coding: utf-8; indent-tabs-mode: nil; tab-width: 4 -*-
+
+# Large searches run on several workers. With another thread alive, as in
+# qnd or the fzf session, they must not start processes that import the
+# main script again: like the bin scripts, this one refuses to be.
+
+import os
+import sys
+import tempfile
+import threading
+from os.path import realpath, dirname, normpath
+
+if __name__ == '__mp_main__':
+    sys.exit('imported again by a worker process')
+
+LAUNCH_PATH = dirname(realpath(__file__))
+if LAUNCH_PATH != "/usr/bin":
+    sys.dont_write_bytecode = True
+    SOURCE_PATH = normpath(os.path.join(LAUNCH_PATH, '..'))
+    sys.path.insert(0, SOURCE_PATH)
+
+from qn import content_search
+
+NNOTES = 1500
+
+
+def make_notes(notedir):
+    filepaths = []
+    for i in range(NNOTES):
+        filepath = os.path.join(notedir, 'note' + str(i) + '.txt')
+        with open(filepath, 'w') as nf:
+            nf.write('note ' + str(i) + '\n')
+            if i % 3 == 0:
+                nf.write('Banana split\n')
+        filepaths.append(filepath)
+    return(filepaths)
+
+
+def test_search_paths():
+    with tempfile.TemporaryDirectory() as notedir:
+        filepaths = make_notes(notedir)
+        expected = [(fp, 'Banana split\n') for i, fp in enumerate(filepaths)
+                    if i % 3 == 0]
+
+        print('* search on', NNOTES, 'notes')
+        results = content_search.search_paths(filepaths, ['banana'],
+                                              workers=2)
+        assert results == expected
+
+        print('* search on', NNOTES, 'notes with another thread alive')
+        stop = threading.Event()
+        thread = threading.Thread(target=stop.wait)
+        thread.start()
+        try:
+            results = content_search.search_paths(filepaths, ['banana'],
+                                                  workers=2)
+        finally:
+            stop.set()
+            thread.join()
+        assert results == expected
+        print(len(results), 'matches')
+        print('---------------')
+
+
+if __name__ == '__main__':
+    test_search_paths()
+    print('OK')
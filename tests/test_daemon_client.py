@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# -*- Mode: Python; coding: utf-8; indent-tabs-mode: nil; tab-width: 4 -*-
+
+# The client side of qnd, without qnd: a socket stands in for the daemon.
+
+import os
+import sys
+import json
+import socket
+import tempfile
+import threading
+from os.path import realpath, dirname, normpath
+
+LAUNCH_PATH = dirname(realpath(__file__))
+if LAUNCH_PATH != "/usr/bin":
+    sys.dont_write_bytecode = True
+    SOURCE_PATH = normpath(os.path.join(LAUNCH_PATH, '..'))
+    sys.path.insert(0, SOURCE_PATH)
+
+from qn import daemon_client
+from qn import search_index
+from qn import result_cache
+
+
+def make_notes(qndir):
+    os.makedirs(os.path.join(qndir, '.qn'))
+    for name, text in (('a.txt', 'banana bread\n'), ('b.txt', 'apple\n')):
+        with open(os.path.join(qndir, name), 'w') as nf:
+            nf.write(text)
+
+
+def fake_daemon(sock_path, names):
+    """Answer requests like qnd, listing names, until the socket is closed.
+    """
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(sock_path)
+    server.listen(4)
+
+    def serve():
+        while True:
+            try:
+                conn = server.accept()[0]
+            except OSError:
+                return
+            with conn, conn.makefile('rwb') as connfile:
+                message = json.loads(connfile.readline().decode('utf-8'))
+                payload = b''
+                if message['op'] == 'list':
+                    payload = '\x00'.join(names).encode('utf-8')
+                header = {'count': len(names), 'names': len(payload),
+                          'size': len(payload)}
+                if message['op'] in ('search', 'grep'):
+                    header['results'] = [(name, '') for name in names]
+                daemon_client.write_message(connfile, header, payload)
+
+    threading.Thread(target=serve, daemon=True).start()
+    return(server)
+
+
+def test_private_dir():
+    print('* private_dir')
+    with tempfile.TemporaryDirectory() as tmpdir:
+        sock_dir = os.path.join(tmpdir, 'qnd')
+        assert daemon_client.private_dir(sock_dir)
+        assert oct(os.stat(sock_dir).st_mode & 0o777) == oct(0o700)
+        assert daemon_client.private_dir(sock_dir)
+        os.chmod(sock_dir, 0o755)
+        assert not daemon_client.private_dir(sock_dir)
+        os.rmdir(sock_dir)
+        os.symlink(tmpdir, sock_dir)
+        assert not daemon_client.private_dir(sock_dir)
+    saved_runtime = os.environ.pop('XDG_RUNTIME_DIR', None)
+    try:
+        assert os.path.dirname(daemon_client.socket_path()) == \
+            '/tmp/qnd-' + str(os.getuid())
+    finally:
+        if saved_runtime is not None:
+            os.environ['XDG_RUNTIME_DIR'] = saved_runtime
+    print('---------------')
+
+
+def test_check_names():
+    print('* check_names')
+    assert daemon_client.check_names(['a.txt', 'dir/b.txt', 'c..d']) == \
+        ['a.txt', 'dir/b.txt', 'c..d']
+    for name in ('../a.txt', 'dir/../../a.txt', '/etc/passwd', '', 'a/..'):
+        try:
+            daemon_client.check_names(['a.txt', name])
+        except ValueError:
+            continue
+        assert False, name
+    print('---------------')
+
+
+def test_invalid_names():
+    print('* names that leave the notes dir make the client scan locally')
+    with tempfile.TemporaryDirectory() as qndir:
+        make_notes(qndir)
+        sock_path = os.path.join(qndir, '.qn', 'qnd.sock')
+        server = fake_daemon(sock_path, ['a.txt', '../../etc/passwd'])
+        try:
+            client = daemon_client.DaemonClient(sock_path)
+            assert client.ping()
+            repo = client.repo(qndir)
+            assert sorted(repo.filenames()) == ['a.txt', 'b.txt']
+            repo = client.repo(qndir)
+            results = repo.grep_files('banana')
+            assert results.filenames() == ['a.txt']
+        finally:
+            server.shutdown(socket.SHUT_RDWR)
+            server.close()
+    print('---------------')
+
+
+def test_fallback():
+    print('* without the daemon, search like a local repo')
+    with tempfile.TemporaryDirectory() as qndir:
+        make_notes(qndir)
+        qndata = os.path.join(qndir, '.qn')
+        index_paths = {}
+        for kind in search_index.INDEX_KINDS:
+            index_paths[kind] = search_index.index_path(qndata, 'default',
+                                                        kind)
+        cache_path = result_cache.cache_path(qndata, 'default')
+        client = daemon_client.DaemonClient(os.path.join(qndata, 'none'))
+        assert not client.ping()
+        repo = client.repo(qndir, None, 1, index_paths, cache_path)
+        results = repo.search_files(['banana'])
+        assert results.filenames() == ['a.txt']
+        assert os.path.exists(index_paths['words'])
+        assert os.path.exists(cache_path)
+    print('---------------')
+
+
+if __name__ == '__main__':
+    test_private_dir()
+    test_check_names()
+    test_invalid_names()
+    test_fallback()
+    print('OK')
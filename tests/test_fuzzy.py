@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*- Mode: Python; coding: utf-8; indent-tabs-mode: nil; tab-width: 4 -*-
+
+import os
+import sys
+import random
+from os.path import realpath, dirname, normpath
+
+LAUNCH_PATH = dirname(realpath(__file__))
+if LAUNCH_PATH != "/usr/bin":
+    sys.dont_write_bytecode = True
+    SOURCE_PATH = normpath(os.path.join(LAUNCH_PATH, '..'))
+    sys.path.insert(0, SOURCE_PATH)
+
+from qn import fuzzy
+
+NAMES = ['meeting-notes.md', 'my_todo.txt', 'ShoppingList.txt', 'mtn.txt',
+         'projects/qn/todo.md', 'random.txt']
+
+
+def holds(key, pattern):
+    """Whether key holds pattern as a subsequence."""
+    chars = iter(key)
+    return(all(char in chars for char in pattern))
+
+
+def test_score():
+    print('* score')
+    assert fuzzy.score('x', 'abc') is None
+    assert fuzzy.score('', 'abc') == 0
+    # Consecutive characters beat the same characters with gaps.
+    assert fuzzy.score('mtn', 'mtn.txt') > fuzzy.score('mtn',
+                                                       'meeting-notes.md')
+    # Word boundaries and camel case score a bonus.
+    assert fuzzy.score('sl', 'shoppinglist', 'ShoppingList') > \
+        fuzzy.score('sl', 'shoppinglist')
+    assert fuzzy.score('n', 'my-notes') > fuzzy.score('n', 'mynotes')
+    print('---------------')
+
+
+def test_top():
+    print('* FuzzyMatcher.top')
+    matcher = fuzzy.FuzzyMatcher(NAMES)
+    print(matcher.top(['mtn']))
+    assert matcher.top(['mtn']) == ['mtn.txt', 'meeting-notes.md']
+    assert matcher.top(['TODO']) == ['my_todo.txt', 'projects/qn/todo.md']
+    # Every pattern must be found.
+    assert matcher.top(['todo', 'md']) == ['projects/qn/todo.md',
+                                           'my_todo.txt']
+    assert matcher.top(['todo', 'zz']) == []
+    assert matcher.top(['sl']) == ['ShoppingList.txt']
+    assert len(matcher.top(['t'], limit=2)) == 2
+    # No pattern matches every name, shortest first.
+    assert matcher.top(['']) == sorted(NAMES, key=len)
+    print('---------------')
+
+
+def test_same_names_as_brute_force():
+    print('* FuzzyMatcher.top finds the same names as a plain scan')
+    rand = random.Random(1)
+    names = [''.join(rand.choice('abcdeAB-_./') for i in range(12))
+             for j in range(2000)]
+    matcher = fuzzy.FuzzyMatcher(names)
+    for patterns in (['ab'], ['a.b'], ['ABC', '_'], ['-a-'], ['e', 'd.']):
+        found = matcher.top(patterns)
+        expected = [name for name in names
+                    if all(holds(name.casefold(), pattern.casefold())
+                           for pattern in patterns)]
+        print(patterns, len(found))
+        assert sorted(found) == sorted(expected), patterns
+        assert matcher.top(patterns, limit=5) == found[:5]
+    print('---------------')
+
+
+if __name__ == '__main__':
+    test_score()
+    test_top()
+    test_same_names_as_brute_force()
+    print('OK')
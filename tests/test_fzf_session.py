@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- Mode: Python; coding: utf-8; indent-tabs-mode: nil; tab-width: 4 -*-
+
+# A session without fzf: the reload command is run as fzf would run it,
+# and a socket at the --listen path stands in for fzf's server.
+
+import os
+import sys
+import stat
+import socket
+import threading
+import subprocess
+from os.path import realpath, dirname, normpath
+
+LAUNCH_PATH = dirname(realpath(__file__))
+if LAUNCH_PATH != "/usr/bin":
+    sys.dont_write_bytecode = True
+    SOURCE_PATH = normpath(os.path.join(LAUNCH_PATH, '..'))
+    sys.path.insert(0, SOURCE_PATH)
+
+from qn import fzf_session
+
+
+def serve(optname, query):
+    entries = (optname + '\x00' + query + '\x00').encode('utf-8')
+    return(entries, fzf_session.fzf_action('change-header', 'view ' +
+                                           optname))
+
+
+def test_fzf_action():
+    print('* fzf_action')
+    assert fzf_session.fzf_action('reload', 'ls') == 'reload(ls)'
+    assert fzf_session.fzf_action('change-header', 'a (b)') == \
+        'change-header[a (b)]'
+    print('---------------')
+
+
+def test_session():
+    print('* reload through the session')
+    threads = threading.enumerate()
+    session = fzf_session.FzfSession(serve)
+    session.start()
+    try:
+        listen_path = session.listen_path
+        session_dir = dirname(listen_path)
+        # Only the user can reach the sockets.
+        assert stat.S_IMODE(os.stat(session_dir).st_mode) == 0o700
+        args = session.fzf_args([('grep', 'Alt-S')])
+        assert args[0] == '--listen=' + listen_path
+        assert args[1:3] == ['--bind', 'alt-s:' + fzf_session.fzf_action(
+            'reload', session.reload_command('grep')) + '+clear-query']
+
+        fzf = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        fzf.bind(listen_path)
+        fzf.listen(1)
+        fzf.settimeout(10)
+        with fzf:
+            command = session.reload_command('grep').replace(
+                '{q}', "'my query'")
+            output = subprocess.run(command, shell=True, check=True,
+                                    stdout=subprocess.PIPE).stdout
+            assert output == b'grep\x00my query\x00', output
+
+            conn = fzf.accept()[0]
+            with conn:
+                request = b''
+                while not request.endswith(b'(view grep)'):
+                    data = conn.recv(65536)
+                    if not data:
+                        break
+                    request += data
+                conn.sendall(b'HTTP/1.1 200 OK\r\nContent-Length: 0\r\n\r\n')
+        print(request.decode('utf-8').splitlines()[0])
+        assert request.startswith(b'POST / HTTP/1.1\r\n')
+        assert request.endswith(b'\r\n\r\nchange-header(view grep)')
+    finally:
+        session.stop()
+    assert not os.path.exists(session_dir)
+    # The thread serving views is gone too.
+    for thread in threading.enumerate():
+        if thread not in threads:
+            thread.join(10)
+            assert not thread.is_alive()
+    print('---------------')
+
+
+if __name__ == '__main__':
+    test_fzf_action()
+    test_session()
+    print('OK')
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- Mode: Python; coding: utf-8; indent-tabs-mode: nil; tab-width: 4 -*-
+
+import os
+import sys
+import tempfile
+from os.path import realpath, dirname, normpath
+
+LAUNCH_PATH = dirname(realpath(__file__))
+if LAUNCH_PATH != "/usr/bin":
+    sys.dont_write_bytecode = True
+    SOURCE_PATH = normpath(os.path.join(LAUNCH_PATH, '..'))
+    sys.path.insert(0, SOURCE_PATH)
+
+from qn import mime
+
+# name, contents, MIME type. None of these need xdg-mime.
+FILES = [('note.txt', b'some text\n', 'text/plain'),
+         ('note.md', b'# heading\n', 'text/markdown'),
+         ('note.org', b'* heading\n', 'text/x-org'),
+         ('noext', 'café au lait\n'.encode('utf-8'), 'text/plain'),
+         ('empty.txt', b'', 'inode/x-empty'),
+         ('doc.pdf', b'%PDF-1.4\n...', 'application/pdf'),
+         ('pic', b'\x89PNG\r\n\x1a\n\x00\x00', 'image/png'),
+         ('named.txt', b'\xff\xd8\xff\xe0 jpeg data', 'image/jpeg'),
+         ('blob', b'\x00\x01\x02binary', 'application/octet-stream'),
+         ('page.html', b'<html></html>\n', 'text/html'),
+         # A UTF-8 character cut short by the end of the sniffed bytes.
+         ('long', b'a' * 4095 + 'é'.encode('utf-8') + b'\n',
+          'text/plain')]
+
+
+def make_files(tmpdir):
+    for name, contents, mtype in FILES:
+        with open(os.path.join(tmpdir, name), 'wb') as f:
+            f.write(contents)
+
+
+def test_classify():
+    print('* classify')
+    with tempfile.TemporaryDirectory() as tmpdir:
+        make_files(tmpdir)
+        for name, contents, mtype in FILES:
+            print(name, mime.classify(os.path.join(tmpdir, name)))
+            assert mime.classify(os.path.join(tmpdir, name)) == mtype, name
+        assert mime.classify(os.path.join(tmpdir, 'missing')) == 'None/None'
+    print('---------------')
+
+
+def test_cache():
+    print('* MimeCache, across runs')
+    classified = []
+    classify = mime.classify
+
+    def counting_classify(filepath, size=None):
+        classified.append(os.path.basename(filepath))
+        return(classify(filepath, size))
+
+    mime.classify = counting_classify
+    try:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            make_files(tmpdir)
+            cache_path = mime.cache_path(tmpdir)
+            notepath = os.path.join(tmpdir, 'noext')
+            assert mime.MimeCache(cache_path).get(notepath) == 'text/plain'
+            assert mime.MimeCache(cache_path).get(notepath) == 'text/plain'
+            assert classified == ['noext']
+
+            print('* after a note changed')
+            with open(notepath, 'wb') as f:
+                f.write(b'%PDF-1.4\n')
+            mtime_ns = os.stat(notepath).st_mtime_ns + 1000000000
+            os.utime(notepath, ns=(mtime_ns, mtime_ns))
+            assert mime.MimeCache(cache_path).get(notepath) == \
+                'application/pdf'
+            assert classified == ['noext', 'noext']
+    finally:
+        mime.classify = classify
+    print('---------------')
+
+
+if __name__ == '__main__':
+    test_classify()
+    test_cache()
+    print('OK')
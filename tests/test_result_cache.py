@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- Mode: Python; coding: utf-8; indent-tabs-mode: nil; tab-width: 4 -*-
+
+import os
+import sys
+import tempfile
+from os.path import realpath, dirname, normpath
+
+LAUNCH_PATH = dirname(realpath(__file__))
+if LAUNCH_PATH != "/usr/bin":
+    sys.dont_write_bytecode = True
+    SOURCE_PATH = normpath(os.path.join(LAUNCH_PATH, '..'))
+    sys.path.insert(0, SOURCE_PATH)
+
+from qn import result_cache
+
+
+def search_key(i):
+    return(result_cache.normalize_search(['query' + str(i)]))
+
+
+def test_keys():
+    print('* normalized keys')
+    assert result_cache.normalize_search(['Foo', 'bar', 'foo']) == \
+        result_cache.normalize_search(['BAR', 'foo'])
+    assert result_cache.normalize_grep('Foo') != \
+        result_cache.normalize_grep('foo')
+    print('---------------')
+
+
+def test_generations():
+    print('* results only for the same generation, across runs')
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cache_path = result_cache.cache_path(tmpdir, 'default')
+        cache = result_cache.ResultCache(cache_path, '/notes/')
+        cache.put(search_key(1), 5, [('a.txt', 'line')])
+        assert cache.get(search_key(1), 5) == [('a.txt', 'line')]
+        assert cache.get(search_key(1), 6) is None
+        assert cache.get(search_key(2), 5) is None
+
+        cache = result_cache.ResultCache(cache_path, '/notes/')
+        assert cache.get(search_key(1), 5) == [('a.txt', 'line')]
+        # A cache for another repo is discarded.
+        cache = result_cache.ResultCache(cache_path, '/other/')
+        assert cache.get(search_key(1), 5) is None
+    print('---------------')
+
+
+def test_lru():
+    print('* least recently used entries are dropped first')
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cache_path = result_cache.cache_path(tmpdir, 'default')
+        cache = result_cache.ResultCache(cache_path, '/notes/')
+        for i in range(result_cache._MAX_ENTRIES):
+            cache.put(search_key(i), 1, [('a.txt', str(i))])
+        # Using the oldest entry keeps it.
+        assert cache.get(search_key(0), 1) is not None
+        cache.put(search_key(-1), 1, [('a.txt', 'new')])
+        assert cache.get(search_key(0), 1) is not None
+        assert cache.get(search_key(1), 1) is None
+        assert cache.get(search_key(2), 1) is not None
+
+        cache = result_cache.ResultCache(cache_path, '/notes/')
+        assert cache.get(search_key(1), 1) is None
+        assert cache.get(search_key(-1), 1) == [('a.txt', 'new')]
+
+        print('* and past the maximum size')
+        matches = [('a.txt', str(i) + 'x' * 1000) for i in range(200)]
+        for i in range(result_cache._MAX_BYTES // (200 * 1000) + 1):
+            cache.put(search_key(100 + i), 1, matches)
+        assert cache.get(search_key(100), 1) is None
+        assert cache.get(search_key(-1), 1) is None
+        assert cache.get(search_key(101), 1) == matches
+    print('---------------')
+
+
+def test_large_results():
+    print('* results too large to cache evict nothing')
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cache_path = result_cache.cache_path(tmpdir, 'default')
+        cache = result_cache.ResultCache(cache_path, '/notes/')
+        for i in range(10):
+            cache.put(search_key(i), 1, [('a.txt', str(i))])
+        cache.put(search_key(10), 1, [('a.txt', str(10))])
+        matches = [('a.txt', str(i) + 'x' * 1000)
+                   for i in range(result_cache._MAX_ENTRY_BYTES // 1000)]
+        cache.put(search_key(10), 2, matches)
+        assert cache.get(search_key(10), 2) is None
+        assert cache.get(search_key(10), 1) is None
+        cache = result_cache.ResultCache(cache_path, '/notes/')
+        for i in range(10):
+            assert cache.get(search_key(i), 1) == [('a.txt', str(i))]
+        assert os.path.getsize(cache_path) < len(matches) * 1000
+
+        print('* a file that is not a cache is started again')
+        with open(cache_path, 'wb') as cachefile:
+            cachefile.write(b'not a cache' * 100)
+        cache = result_cache.ResultCache(cache_path, '/notes/')
+        assert cache.get(search_key(1), 1) is None
+        cache.put(search_key(1), 1, [('a.txt', 'line')])
+        assert cache.get(search_key(1), 1) == [('a.txt', 'line')]
+    print('---------------')
+
+
+if __name__ == '__main__':
+    test_keys()
+    test_generations()
+    test_lru()
+    test_large_results()
+    print('OK')
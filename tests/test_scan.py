@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- Mode: Python; coding: utf-8; indent-tabs-mode: nil; tab-width: 4 -*-
+
+# Scans of a repo kept in a qn data dir, across runs, when notes are edited
+# in place: the mtime of their directory does not change, so the listing
+# comes from the stat snapshot.
+
+import os
+import sys
+import tempfile
+from os.path import realpath, dirname, normpath
+
+LAUNCH_PATH = dirname(realpath(__file__))
+if LAUNCH_PATH != "/usr/bin":
+    sys.dont_write_bytecode = True
+    SOURCE_PATH = normpath(os.path.join(LAUNCH_PATH, '..'))
+    sys.path.insert(0, SOURCE_PATH)
+
+from qn import qn
+from qn import snapshot
+
+_OLD = 1000000000  # mtime of the notes and their dir, far in the past
+
+
+def make_repo(qndir):
+    """Scan qndir like a new qn run would, keeping its snapshot in
+    qndir/.qn"""
+    repo = qn.FileRepo(qndir, snapshot.snapshot_path(
+        os.path.join(qndir, '.qn'), 'default'))
+    repo.scan_files()
+    return(repo)
+
+
+def make_notes(qndir):
+    os.makedirs(os.path.join(qndir, '.qn'))
+    for i in range(5):
+        notepath = os.path.join(qndir, 'note' + str(i) + '.txt')
+        with open(notepath, 'w') as nf:
+            nf.write('note ' + str(i) + '\n')
+        os.utime(notepath, (_OLD + i, _OLD + i))
+    os.utime(qndir, (_OLD, _OLD))
+
+
+def edit_in_place(qndir, name, text):
+    """Append to a note without touching the mtime of its directory."""
+    with open(os.path.join(qndir, name), 'r+') as nf:
+        nf.seek(0, os.SEEK_END)
+        nf.write(text)
+    os.utime(qndir, (_OLD, _OLD))
+
+
+def test_stats_in_place_edit():
+    with tempfile.TemporaryDirectory() as qndir:
+        make_notes(qndir)
+        print('* sizes and dates before the edit')
+        repo = make_repo(qndir)
+        sizes = dict(zip(repo.filenames(), repo.get_property_list('size')))
+        assert sizes['note2.txt'] == 7
+        lines = repo.lines(['name', 'size', 'mdate'])
+        assert all(qn.format_date(_OLD) in line for line in lines)
+
+        edit_in_place(qndir, 'note2.txt', 'more text\n')
+        print('* after editing note2.txt in place')
+        repo = make_repo(qndir)
+        names = repo.filenames()
+        sizes = dict(zip(names, repo.get_property_list('size')))
+        mdates = dict(zip(names, repo.get_property_list('mdate')))
+        assert sizes['note2.txt'] == 17, sizes
+        assert mdates['note2.txt'] > _OLD + 4, mdates
+        assert mdates['note1.txt'] == _OLD + 1
+        lines = dict(zip(names, repo.lines(['name', 'size', 'mdate'])))
+        print(lines['note2.txt'])
+        assert qn.sizeof_fmt(17) in lines['note2.txt']
+        assert qn.format_date(mdates['note2.txt']) in lines['note2.txt']
+        print('---------------')
+
+
+def test_sort_in_place_edit():
+    with tempfile.TemporaryDirectory() as qndir:
+        make_notes(qndir)
+        print('* sort by size and mdate, kept in the snapshot')
+        repo = make_repo(qndir)
+        repo.sort('mdate')
+        assert repo.filenames()[0] == 'note4.txt'
+        repo.sort('size')
+        assert repo.filenames()[0] == 'note4.txt'
+
+        edit_in_place(qndir, 'note1.txt', 'more text\n')
+        print('* after editing note1.txt in place, over two runs')
+        for run in range(2):
+            repo = make_repo(qndir)
+            for sortby in ('mdate', 'size'):
+                repo.sort(sortby)
+                print(sortby, repo.filenames())
+                assert repo.filenames() == ['note1.txt', 'note4.txt',
+                                            'note3.txt', 'note2.txt',
+                                            'note0.txt'], sortby
+        print('---------------')
+
+
+if __name__ == '__main__':
+    test_stats_in_place_edit()
+    test_sort_in_place_edit()
+    print('OK')
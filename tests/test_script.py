@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- Mode: Python; coding: utf-8; indent-tabs-mode: nil; tab-width: 4 -*-
+
+# rofi script mode without rofi: run_script is called as rofi would call
+# the script, with the view kept in ROFI_DATA.
+
+import io
+import os
+import sys
+import json
+import tempfile
+from os.path import realpath, dirname, normpath
+
+LAUNCH_PATH = dirname(realpath(__file__))
+if LAUNCH_PATH != "/usr/bin":
+    sys.dont_write_bytecode = True
+    SOURCE_PATH = normpath(os.path.join(LAUNCH_PATH, '..'))
+    sys.path.insert(0, SOURCE_PATH)
+
+from qn import qng
+from qn import config_parser
+
+
+def make_notes(qndir):
+    os.makedirs(os.path.join(qndir, '.qn', 'trash'))
+    for name in ('a.txt', 'b.txt'):
+        with open(os.path.join(qndir, name), 'w') as nf:
+            nf.write(name + '\n')
+
+
+def run_script(qndir, state, argument):
+    """Call the script like rofi does when argument is selected in the view
+    of state. Returns the state and the names of the rows of the next view.
+    """
+    saved = {key: os.environ.pop(key, None)
+             for key in ('ROFI_RETV', 'ROFI_DATA', 'ROFI_INFO')}
+    os.environ['ROFI_RETV'] = '1'
+    os.environ['ROFI_DATA'] = json.dumps(state)
+    out = io.StringIO()
+    try:
+        app = qng.QnAppRF(config_parser.QnOptions(qndir=qndir))
+        assert app.run_script(argument, out) == 0
+    finally:
+        for key, value in saved.items():
+            os.environ.pop(key, None)
+            if value is not None:
+                os.environ[key] = value
+    lines = out.getvalue().splitlines()
+    options = dict(line[1:].split('\x1f', 1) for line in lines
+                   if line.startswith('\x00'))
+    names = [line.split('\x00info\x1f')[1] for line in lines
+             if '\x00info\x1f' in line]
+    return(json.loads(options['data']), names, options['message'])
+
+
+def test_confirm():
+    print('* confirmed actions go back to the view they came from')
+    with tempfile.TemporaryDirectory() as qndir:
+        make_notes(qndir)
+        state, names, message = run_script(
+            qndir, {'view': 'confirm', 'action': 'delete', 'note': 'a.txt',
+                    'back': 'default'}, 'yes')
+        assert state['view'] == 'default'
+        assert names == ['b.txt'], names
+        assert os.path.exists(os.path.join(qndir, '.qn', 'trash', 'a.txt'))
+
+        state, names, message = run_script(
+            qndir, {'view': 'confirm', 'action': 'undelete', 'note': 'a.txt',
+                    'back': 'trash'}, 'yes')
+        assert state['view'] == 'trash'
+        assert names == []
+        assert os.path.exists(os.path.join(qndir, 'a.txt'))
+
+        state, names, message = run_script(
+            qndir, {'view': 'confirm', 'action': 'rename', 'note': 'b.txt',
+                    'to': 'c.txt', 'back': 'default'}, 'yes')
+        assert state['view'] == 'default'
+        assert sorted(names) == ['a.txt', 'c.txt'], names
+
+        print('* and tell when they failed')
+        state, names, message = run_script(
+            qndir, {'view': 'confirm', 'action': 'delete', 'note': 'none.txt',
+                    'back': 'default'}, 'yes')
+        assert state['view'] == 'default'
+        assert message == "Could not delete 'none.txt'.", message
+        assert sorted(names) == ['a.txt', 'c.txt']
+    print('---------------')
+
+
+if __name__ == '__main__':
+    test_confirm()
+    print('OK')
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# -*- Mode: Python; coding: utf-8; indent-tabs-mode: nil; tab-width: 4 -*-
+
+# Searches of a repo kept in a qn data dir, across runs, when notes are
+# edited in place: the stat snapshot doesn't notice, since the mtime of
+# their directory does not change.
+
+import os
+import sys
+import tempfile
+from os.path import realpath, dirname, normpath
+
+LAUNCH_PATH = dirname(realpath(__file__))
+if LAUNCH_PATH != "/usr/bin":
+    sys.dont_write_bytecode = True
+    SOURCE_PATH = normpath(os.path.join(LAUNCH_PATH, '..'))
+    sys.path.insert(0, SOURCE_PATH)
+
+from qn import qn
+from qn import snapshot
+from qn import search_index
+from qn import result_cache
+
+_OLD = 1000000000  # mtime of the notes dir, far in the past
+
+
+def make_repo(qndir):
+    """Scan qndir like a new qn run would, keeping its data in qndir/.qn"""
+    qndata = os.path.join(qndir, '.qn')
+    index_paths = {}
+    for kind in search_index.INDEX_KINDS:
+        index_paths[kind] = search_index.index_path(qndata, 'default', kind)
+    repo = qn.FileRepo(qndir, snapshot.snapshot_path(qndata, 'default'),
+                       index_paths=index_paths,
+                       cache_path=result_cache.cache_path(qndata, 'default'))
+    repo.scan_files()
+    return(repo)
+
+
+def make_notes(qndir):
+    os.makedirs(os.path.join(qndir, '.qn'))
+    for i in range(20):
+        with open(os.path.join(qndir, 'note' + str(i) + '.txt'), 'w') as nf:
+            nf.write('apple note ' + str(i) + '\n')
+    os.utime(qndir, (_OLD, _OLD))
+
+
+def edit_in_place(qndir, name, text):
+    """Append to a note without touching the mtime of its directory."""
+    with open(os.path.join(qndir, name), 'r+') as nf:
+        nf.seek(0, os.SEEK_END)
+        nf.write(text)
+    os.utime(qndir, (_OLD, _OLD))
+
+
+def result_names(results):
+    if results is None:
+        return([])
+    return(sorted(results.filenames()))
+
+
+def test_search_in_place_edit():
+    with tempfile.TemporaryDirectory() as qndir:
+        make_notes(qndir)
+        print('* search before the edit')
+        assert result_names(make_repo(qndir).search_files(['banana'])) == []
+
+        edit_in_place(qndir, 'note3.txt', 'banana\n')
+        print('* search after editing note3.txt in place')
+        results = make_repo(qndir).search_files(['banana'])
+        assert result_names(results) == ['note3.txt'], result_names(results)
+        print('---------------')
+
+
+def test_grep_in_place_edit():
+    with tempfile.TemporaryDirectory() as qndir:
+        make_notes(qndir)
+        print('* grep before the edit')
+        assert result_names(make_repo(qndir).grep_files('banana')) == []
+
+        edit_in_place(qndir, 'note5.txt', 'banana\n')
+        print('* grep after editing note5.txt in place')
+        results = make_repo(qndir).grep_files('banana')
+        assert result_names(results) == ['note5.txt'], result_names(results)
+        print('---------------')
+
+
+def test_cached_results_after_edit():
+    with tempfile.TemporaryDirectory() as qndir:
+        make_notes(qndir)
+        edit_in_place(qndir, 'note3.txt', 'banana\n')
+        print('* search twice, the second time from the result cache')
+        repo = make_repo(qndir)
+        assert result_names(repo.search_files(['banana'])) == ['note3.txt']
+        cache = repo.result_cache()
+        key = (result_cache.normalize_search(['banana']), None)
+        generation = repo.search_index('words').generation
+        assert cache.get(key, generation) == [('note3.txt', 'banana\n')]
+        assert result_names(make_repo(qndir).search_files(['banana'])) == \
+            ['note3.txt']
+
+        edit_in_place(qndir, 'note7.txt', 'banana\n')
+        print('* search after editing note7.txt in place')
+        repo = make_repo(qndir)
+        assert repo.search_index('words').generation != generation
+        assert repo.result_cache().get(
+            key, repo.search_index('words').generation) is None
+        results = repo.search_files(['banana'])
+        assert result_names(results) == ['note3.txt', 'note7.txt'], \
+            result_names(results)
+        print('---------------')
+
+
+def test_phrase_search():
+    with tempfile.TemporaryDirectory() as qndir:
+        make_notes(qndir)
+        edit_in_place(qndir, 'note1.txt', 'load balancer config\n')
+        edit_in_place(qndir, 'note2.txt', 'config of the load balancer\n')
+        queries = search_index.parse_filter('"balancer config"')
+        print('* phrase search with the positional index')
+        results = make_repo(qndir).search_files(queries)
+        assert result_names(results) == ['note1.txt'], result_names(results)
+        print('* and without it')
+        repo = qn.FileRepo(qndir)
+        repo.scan_files()
+        assert result_names(repo.search_files(queries)) == ['note1.txt']
+        queries = search_index.parse_filter('config NEAR/3 load')
+        assert result_names(repo.search_files(queries)) == ['note1.txt',
+                                                            'note2.txt']
+        print('---------------')
+
+
+def test_grep_indexes():
+    with tempfile.TemporaryDirectory() as qndir:
+        make_notes(qndir)
+        edit_in_place(qndir, 'note5.txt', 'banana\n')
+        words_path = search_index.index_path(os.path.join(qndir, '.qn'),
+                                             'default', 'words')
+        print('* grep with a single match does not need the words index')
+        assert result_names(make_repo(qndir).grep_files('banana')) == \
+            ['note5.txt']
+        assert not os.path.exists(words_path)
+
+        print('* ranked grep stats each note once, for both indexes')
+        stat_path = qn._stat_path
+        stated = []
+
+        def counting_stat_path(filepath):
+            stated.append(filepath)
+            return(stat_path(filepath))
+
+        repo = make_repo(qndir)
+        qn._stat_path = counting_stat_path
+        try:
+            results = repo.grep_files('apple')
+        finally:
+            qn._stat_path = stat_path
+        assert len(result_names(results)) == 20
+        assert os.path.exists(words_path)
+        assert len(stated) == 20, len(stated)
+        print('---------------')
+
+
+if __name__ == '__main__':
+    test_search_in_place_edit()
+    test_grep_in_place_edit()
+    test_cached_results_after_edit()
+    test_phrase_search()
+    test_grep_indexes()
+    print('OK')
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+# -*- Mode: Python; coding: utf-8; indent-tabs-mode: nil; tab-width: 4 -*-
+
+import os
+import sys
+import tempfile
+from os.path import realpath, dirname, normpath
+
+LAUNCH_PATH = dirname(realpath(__file__))
+if LAUNCH_PATH != "/usr/bin":
+    sys.dont_write_bytecode = True
+    SOURCE_PATH = normpath(os.path.join(LAUNCH_PATH, '..'))
+    sys.path.insert(0, SOURCE_PATH)
+
+from qn import search_index
+
+
+def make_index(index_class, notes):
+    """Build an index of notes, a dict of name -> text, in a temporary
+    directory. Returns the directory, to be cleaned up, and the index."""
+    tmpdir = tempfile.TemporaryDirectory()
+    names = sorted(notes)
+    for name in names:
+        with open(os.path.join(tmpdir.name, name), 'w') as nf:
+            nf.write(notes[name])
+    index = index_class(os.path.join(tmpdir.name, 'index.sqlite'),
+                        tmpdir.name)
+    index.update(names, [len(notes[name]) for name in names])
+    return(tmpdir, index)
+
+
+def test_required_literals():
+    print('* required_literals')
+    cases = [('banana', ['banana']),
+             ('foo.*bar', ['foo', 'bar']),
+             ('ab*c', ['a', 'c']),
+             ('colou\\?r', ['colo', 'r']),
+             ('\\(abc\\)def', ['def']),
+             ('[abc]def', ['def']),
+             ('[]x]yz', ['yz']),
+             ('a\\.b', ['a.b']),
+             ('^start', ['start']),
+             ('ab\\{2\\}c', ['a', 'c']),
+             ('x\\|y', [])]
+    for pattern, literals in cases:
+        print(pattern, search_index.required_literals(pattern))
+        assert search_index.required_literals(pattern) == literals, pattern
+    print('---------------')
+
+
+def test_trigram_candidates():
+    print('* TrigramIndex.candidates')
+    tmpdir, index = make_index(search_index.TrigramIndex,
+                               {'a.txt': 'Banana bread\n',
+                                'b.txt': 'apple pie\n',
+                                'c.txt': 'banana split\n'})
+    with tmpdir:
+        assert index.candidates('banana') == {'a.txt', 'c.txt'}
+        assert index.candidates('BANANA.*split') == {'c.txt'}
+        assert index.candidates('cherry') == set()
+        # Too short to narrow down: every note is a candidate.
+        assert index.candidates('pi') is None
+        assert index.candidates('x\\|y') is None
+    print('---------------')
+
+
+def test_rank():
+    print('* SearchIndex.rank')
+    tmpdir, index = make_index(search_index.SearchIndex,
+                               {'a.txt': 'banana banana banana\n',
+                                'b.txt': 'banana apple pear plum fig kiwi\n',
+                                'c.txt': 'apple\n',
+                                'd.txt': 'cherry\n'})
+    with tmpdir:
+        names = ['d.txt', 'c.txt', 'b.txt', 'a.txt']
+        print(index.rank(names, ['banana']))
+        # More occurrences in a shorter note rank higher, notes without the
+        # term keep their order.
+        assert index.rank(names, ['banana']) == ['a.txt', 'b.txt', 'd.txt',
+                                                 'c.txt']
+        assert index.rank(names, ['banana'], limit=1) == ['a.txt']
+        # Query words score the terms containing them.
+        assert index.rank(names, ['NAN'])[:2] == ['a.txt', 'b.txt']
+        assert index.rank(names, ['apple'])[:2] == ['c.txt', 'b.txt']
+        assert index.rank(names, ['zzz']) == names
+        assert index.rank(names + ['new.txt'], ['apple'])[-1] == 'new.txt'
+        assert index.candidates(['ana', 'PLUM']) == {'b.txt'}
+        assert index.candidates(['+-']) is None
+    print('---------------')
+
+
+def test_parse_filter():
+    print('* parse_filter and positional_query')
+    cases = [('todo "load balancer config" dns NEAR/3 cache',
+              ['todo', '"load balancer config"', 'dns NEAR/3 cache'],
+              [None, ('phrase', ['load', 'balancer', 'config']),
+               ('near', 3, ['dns', 'cache'])]),
+             ('a NEAR b', ['a NEAR b'], [('near', 10, ['a', 'b'])]),
+             ('"Hello, World"', ['"Hello, World"'],
+              [('phrase', ['hello', 'world'])]),
+             # NEAR needs a single word on each side.
+             ('NEAR x', ['NEAR', 'x'], [None, None]),
+             ('x NEAR/2', ['x', 'NEAR/2'], [None, None]),
+             ('a NEAR/2 "b c"', ['a', 'NEAR/2', '"b c"'],
+              [None, None, ('phrase', ['b', 'c'])]),
+             # Phrases without words are searched as they are.
+             ('"" "+" x', ['+', 'x'], [None, None])]
+    for filter_string, queries, parsed in cases:
+        print(filter_string, search_index.parse_filter(filter_string))
+        assert search_index.parse_filter(filter_string) == queries
+        assert [search_index.positional_query(query)
+                for query in queries] == parsed
+    print('---------------')
+
+
+def test_positions_match():
+    print('* positions_match')
+    positions = search_index.text_positions(
+        'The load balancer config is in DNS, and the cache.')
+    cases = [(('phrase', ['load', 'balancer', 'config']), True),
+             (('phrase', ['balancer', 'load']), False),
+             (('phrase', ['load', 'config']), False),
+             (('phrase', ['missing']), False),
+             (('phrase', []), True),
+             (('near', 3, ['dns', 'cache']), True),
+             (('near', 3, ['cache', 'dns']), True),
+             (('near', 2, ['dns', 'cache']), False)]
+    for query, matches in cases:
+        assert search_index.positions_match(positions, query) == matches, \
+            query
+    print('---------------')
+
+
+def test_positional_index():
+    print('* PositionalIndex.matching')
+    tmpdir, index = make_index(search_index.PositionalIndex,
+                               {'a.txt': 'load balancer config\n',
+                                'b.txt': 'config of the load balancer\n',
+                                'c.txt': 'dns\n' + 'filler ' * 20 +
+                                         'cache\n'})
+    with tmpdir:
+        assert index.matching(('phrase', ['load', 'balancer'])) == \
+            {'a.txt', 'b.txt'}
+        assert index.matching(('phrase', ['balancer', 'config'])) == \
+            {'a.txt'}
+        assert index.matching(('near', 3, ['config', 'load'])) == \
+            {'a.txt', 'b.txt'}
+        assert index.matching(('near', 10, ['dns', 'cache'])) == set()
+        assert index.matching(('near', 21, ['dns', 'cache'])) == {'c.txt'}
+    print('---------------')
+
+
+def test_update():
+    print('* SearchIndex.update, across runs')
+    tmpdir, index = make_index(search_index.SearchIndex,
+                               {'a.txt': 'apple banana\n',
+                                'b.txt': 'banana bread\n',
+                                'c.txt': 'cherry\n'})
+    with tmpdir:
+        index_path = index.index_path
+        assert index.candidates(['banana']) == {'a.txt', 'b.txt'}
+        with open(os.path.join(tmpdir.name, 'b.txt'), 'w') as nf:
+            nf.write('cherry bread\n')
+        generation = index.generation
+        index = search_index.SearchIndex(index_path, tmpdir.name)
+        assert index.generation == generation
+        index.update(['b.txt', 'c.txt'], [(13, 1), 7])
+        assert index.generation > generation
+        assert index.candidates(['banana']) == set()
+        assert index.candidates(['cherry']) == {'b.txt', 'c.txt'}
+        assert index.rank(['c.txt', 'b.txt'], ['bread'])[0] == 'b.txt'
+
+        reopened = search_index.SearchIndex(index_path, tmpdir.name)
+        assert reopened.generation == index.generation
+        assert reopened.candidates(['cherry']) == {'b.txt', 'c.txt'}
+
+        print('* an index that is not a database is started again')
+        with open(index_path, 'wb') as index_file:
+            index_file.write(b'not an index' * 100)
+        index = search_index.SearchIndex(index_path, tmpdir.name)
+        assert index.candidates(['cherry']) == set()
+        index.update(['c.txt'], [7])
+        assert index.candidates(['cherry']) == {'c.txt'}
+    print('---------------')
+
+
+def test_positional_update():
+    print('* PositionalIndex, across runs, with merged chunks')
+    max_chunks = search_index._MAX_CHUNKS
+    search_index._MAX_CHUNKS = 1
+    long_text = 'filler ' * 70000 + 'load balancer\n'
+    tmpdir, index = make_index(search_index.PositionalIndex,
+                               {'a.txt': 'load balancer config\n',
+                                'b.txt': long_text})
+    try:
+        with tmpdir:
+            with open(os.path.join(tmpdir.name, 'a.txt'), 'w') as nf:
+                nf.write('config of the load balancer\n')
+            index.update(['a.txt', 'b.txt'], [1, len(long_text)])
+            with open(os.path.join(tmpdir.name, 'c.txt'), 'w') as nf:
+                nf.write('balancer load\n')
+            index.update(['a.txt', 'b.txt', 'c.txt'], [1, len(long_text), 1])
+
+            index = search_index.PositionalIndex(index.index_path,
+                                                 tmpdir.name)
+            for run in range(2):
+                assert index.matching(('phrase', ['load', 'balancer'])) == \
+                    {'a.txt', 'b.txt'}
+                assert index.matching(('phrase', ['balancer', 'config'])) \
+                    == set()
+                assert index.matching(('near', 1, ['balancer', 'load'])) == \
+                    {'a.txt', 'b.txt', 'c.txt'}
+    finally:
+        search_index._MAX_CHUNKS = max_chunks
+    print('---------------')
+
+
+if __name__ == '__main__':
+    test_required_literals()
+    test_trigram_candidates()
+    test_rank()
+    test_parse_filter()
+    test_positions_match()
+    test_positional_index()
+    test_update()
+    test_positional_update()
+    print('OK')
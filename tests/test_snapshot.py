@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+# -*- Mode: Python; coding: utf-8; indent-tabs-mode: nil; tab-width: 4 -*-
+
+import os
+import sys
+import locale
+from os.path import realpath, dirname, normpath
+
+LAUNCH_PATH = dirname(realpath(__file__))
+if LAUNCH_PATH != "/usr/bin":
+    sys.dont_write_bytecode = True
+    SOURCE_PATH = normpath(os.path.join(LAUNCH_PATH, '..'))
+    sys.path.insert(0, SOURCE_PATH)
+
+locale.setlocale(locale.LC_ALL, locale.getlocale())
+
+from qn import qn
+from qn import snapshot
+
+qndir = 'qntest'
+snap_path = snapshot.snapshot_path(os.path.join(qndir, '.qn'), 'default')
+os.makedirs(os.path.join(qndir, '.qn'), exist_ok=True)
+
+print('* first scan (no snapshot)')
+repo = qn.FileRepo(qndir, snap_path)
+repo.scan_files()
+print(repo.filecount(), os.path.isfile(snap_path))
+print('---------------')
+
+print('* second scan (from snapshot)')
+repo = qn.FileRepo(qndir, snap_path)
+repo.scan_files()
+print(repo.filecount())
+print(sorted(repo.filenames()))
+print('---------------')
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- Mode: Python; coding: utf-8; indent-tabs-mode: nil; tab-width: 4 -*-
+
+# Time qnf from its start to its first launcher write, with a launcher that
+# only notes when its input arrives, and print the startup report of qn.
+# Fails if the warm start is over the budget.
+# Usage: test_startup.py [budget in ms, default 500] [notes, default 1000]
+
+import os
+import sys
+import time
+import tempfile
+import subprocess
+from os.path import realpath, dirname, normpath
+
+LAUNCH_PATH = dirname(realpath(__file__))
+SOURCE_PATH = normpath(os.path.join(LAUNCH_PATH, '..'))
+
+
+def test_startup(budget_ms=500, nnotes=1000):
+    print('* qnf start to first launcher write, of ' + str(nnotes) +
+          ' notes')
+    with tempfile.TemporaryDirectory() as tmpdir:
+        qndir = os.path.join(tmpdir, 'notes')
+        os.makedirs(os.path.join(qndir, '.qn', 'trash'))
+        for i in range(nnotes):
+            notepath = os.path.join(qndir, 'note' + str(i) + '.txt')
+            with open(notepath, 'w') as nf:
+                nf.write('note ' + str(i) + '\n')
+
+        arrived_path = os.path.join(tmpdir, 'arrived')
+        launcher_path = os.path.join(tmpdir, 'launcher')
+        with open(launcher_path, 'w') as launcher:
+            launcher.write('#!/bin/sh\n' +
+                           'head -c 1 > /dev/null\n' +
+                           'date +%s%N > ' + arrived_path + '\n' +
+                           'cat > /dev/null\n')
+        os.chmod(launcher_path, 0o755)
+
+        config_path = os.path.join(tmpdir, 'config')
+        with open(config_path, 'w') as config:
+            config.write('qndir=' + qndir + '\n' +
+                         'fzf-custom-command=' + launcher_path + '\n')
+
+        report_path = os.path.join(tmpdir, 'report')
+        env = dict(os.environ, QN_STARTUP_REPORT=report_path)
+        command = [sys.executable, os.path.join(SOURCE_PATH, 'bin', 'qnf'),
+                   '-c', config_path]
+        elapsed_ms = None
+        for run in ('cold', 'warm'):
+            start = time.time_ns()
+            subprocess.run(command, env=env, stdout=subprocess.DEVNULL)
+            assert os.path.isfile(arrived_path), \
+                'qnf did not write to the launcher'
+            with open(arrived_path) as arrived:
+                elapsed_ms = (int(arrived.read()) - start) / 1e6
+            os.remove(arrived_path)
+            print(run, 'start to first launcher write: %.1f ms' %
+                  elapsed_ms)
+
+        with open(report_path) as report:
+            print(report.read())
+
+    assert elapsed_ms <= budget_ms, \
+        'over the startup budget of %.0f ms' % budget_ms
+    print('---------------')
+
+
+def main():
+    budget_ms = 500
+    nnotes = 1000
+    if len(sys.argv) > 1:
+        budget_ms = float(sys.argv[1])
+    if len(sys.argv) > 2:
+        nnotes = int(sys.argv[2])
+    try:
+        test_startup(budget_ms, nnotes)
+    except AssertionError as err:
+        print('FAILED: ' + str(err))
+        sys.exit(1)
+    print('OK: within the startup budget of %.0f ms' % budget_ms)
+
+
+if __name__ == '__main__':
+    main()
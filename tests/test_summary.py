@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+# -*- Mode: Python; coding: utf-8; indent-tabs-mode: nil; tab-width: 4 -*-
+
+import os
+import sys
+import tempfile
+import threading
+from os.path import realpath, dirname, normpath
+
+LAUNCH_PATH = dirname(realpath(__file__))
+if LAUNCH_PATH != "/usr/bin":
+    sys.dont_write_bytecode = True
+    SOURCE_PATH = normpath(os.path.join(LAUNCH_PATH, '..'))
+    sys.path.insert(0, SOURCE_PATH)
+
+from qn import qn
+from qn import summary
+
+# The summary view of qng, whose dates make the records stat'ed.
+LINEFORMAT = ['name', 'misc', 'cdate']
+NOTES = {'heading.md': 'intro\n# Shopping list\n- milk\n',
+         'plain.txt': '\n\nFirst line\nsecond line\n',
+         'empty.txt': ''}
+
+extracted = []
+_extract_summary = summary.extract_summary
+
+
+def counting_extract_summary(filepath):
+    extracted.append(os.path.basename(filepath))
+    return(_extract_summary(filepath))
+
+
+def wait_refresh():
+    """Wait for the summaries being extracted in the background."""
+    for thread in threading.enumerate():
+        if thread is not threading.current_thread() and not thread.daemon:
+            thread.join()
+
+
+def misc_blocks(qndir):
+    """Lines of the summary view in a new qn run, as name -> misc block."""
+    repo = qn.FileRepo(qndir, summary_path=summary.cache_path(
+        os.path.join(qndir, '.qn'), 'default'))
+    repo.scan_files()
+    repo.sort('name')
+    blocks = {}
+    for name, line in zip(repo.filenames(), repo.lines(LINEFORMAT)):
+        blocks[name] = line[40:140].strip()
+    wait_refresh()
+    return(blocks)
+
+
+def test_extract_summary():
+    print('* extract_summary')
+    with tempfile.TemporaryDirectory() as qndir:
+        for name, text in NOTES.items():
+            with open(os.path.join(qndir, name), 'w') as nf:
+                nf.write(text)
+        assert summary.extract_summary(os.path.join(
+            qndir, 'heading.md')) == 'Shopping list'
+        assert summary.extract_summary(os.path.join(
+            qndir, 'plain.txt')) == 'First line'
+        assert summary.extract_summary(os.path.join(qndir, 'empty.txt')) == ''
+        assert summary.extract_summary(os.path.join(qndir, 'none.txt')) == ''
+    print('---------------')
+
+
+def test_summary_view():
+    print('* summaries in a view with a date column, over three runs')
+    summary.extract_summary = counting_extract_summary
+    try:
+        with tempfile.TemporaryDirectory() as qndir:
+            os.makedirs(os.path.join(qndir, '.qn'))
+            for name, text in NOTES.items():
+                with open(os.path.join(qndir, name), 'w') as nf:
+                    nf.write(text)
+            expected = {'heading.md': 'Shopping list',
+                        'plain.txt': 'First line',
+                        'empty.txt': ''}
+
+            # Missing summaries are shown empty, then extracted.
+            assert set(misc_blocks(qndir).values()) == {''}
+            assert sorted(extracted) == sorted(NOTES)
+            del extracted[:]
+            for run in range(2):
+                assert misc_blocks(qndir) == expected
+                assert extracted == []
+
+            print('* after a note changed')
+            with open(os.path.join(qndir, 'plain.txt'), 'w') as nf:
+                nf.write('New first line, longer than before\n')
+            misc_blocks(qndir)
+            assert extracted == ['plain.txt']
+            expected['plain.txt'] = 'New first line, longer than before'
+            assert misc_blocks(qndir) == expected
+    finally:
+        summary.extract_summary = _extract_summary
+    print('---------------')
+
+
+def test_replaced_note():
+    print('* a note replaced by a file of the same mtime and size')
+    with tempfile.TemporaryDirectory() as qndir:
+        os.makedirs(os.path.join(qndir, '.qn'))
+        notepath = os.path.join(qndir, 'plain.txt')
+        with open(notepath, 'w') as nf:
+            nf.write('Old line\n')
+        os.utime(notepath, (1000000000, 1000000000))
+        misc_blocks(qndir)
+        assert misc_blocks(qndir) == {'plain.txt': 'Old line'}
+
+        # Keep the old file, so that the new one gets another inode.
+        os.rename(notepath, os.path.join(qndir, '.qn', 'old.txt'))
+        with open(notepath, 'w') as nf:
+            nf.write('New line\n')
+        os.utime(notepath, (1000000000, 1000000000))
+        misc_blocks(qndir)
+        assert misc_blocks(qndir) == {'plain.txt': 'New line'}
+    print('---------------')
+
+
+def test_refresh_while_refreshing():
+    print('* notes to refresh while a refresh runs are done after it')
+    started = threading.Event()
+    release = threading.Event()
+
+    def blocking_extract_summary(filepath):
+        started.set()
+        release.wait()
+        return(_extract_summary(filepath))
+
+    summary.extract_summary = blocking_extract_summary
+    try:
+        with tempfile.TemporaryDirectory() as qndir:
+            for name, text in NOTES.items():
+                with open(os.path.join(qndir, name), 'w') as nf:
+                    nf.write(text)
+            cache = summary.SummaryCache(os.path.join(qndir, 'cache'),
+                                         qndir + '/')
+            cache.refresh(['heading.md'])
+            started.wait()
+            cache.refresh(['plain.txt'], {'heading.md', 'plain.txt'})
+            assert cache.refreshing()
+            release.set()
+            cache.wait()
+            assert not cache.refreshing()
+            assert cache.get('heading.md') == 'Shopping list'
+            assert cache.get('plain.txt') == 'First line'
+    finally:
+        summary.extract_summary = _extract_summary
+    print('---------------')
+
+
+if __name__ == '__main__':
+    test_extract_summary()
+    test_summary_view()
+    test_replaced_note()
+    test_refresh_while_refreshing()
+    print('OK')
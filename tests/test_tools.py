@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- Mode: Python; coding: utf-8; indent-tabs-mode: nil; tab-width: 4 -*-
+
+import os
+import sys
+import time
+import tempfile
+from os.path import realpath, dirname, normpath
+
+LAUNCH_PATH = dirname(realpath(__file__))
+if LAUNCH_PATH != "/usr/bin":
+    sys.dont_write_bytecode = True
+    SOURCE_PATH = normpath(os.path.join(LAUNCH_PATH, '..'))
+    sys.path.insert(0, SOURCE_PATH)
+
+from qn import tools
+
+
+def make_program(dirpath, name, executable=True):
+    filepath = os.path.join(dirpath, name)
+    with open(filepath, 'w') as program:
+        program.write('#!/bin/sh\n')
+    os.chmod(filepath, 0o755 if executable else 0o644)
+    return(filepath)
+
+
+def touch_later(filepath):
+    """Move the mtime of a file forward, to be noticed at any resolution."""
+    later = time.time() + 10
+    os.utime(filepath, (later, later))
+
+
+def test_find_program():
+    print('* find_program')
+    saved_path = os.environ.get('PATH', '')
+    with tempfile.TemporaryDirectory() as tmpdir:
+        first = os.path.join(tmpdir, 'first')
+        second = os.path.join(tmpdir, 'second')
+        os.makedirs(first)
+        os.makedirs(second)
+        make_program(first, 'notrun', executable=False)
+        make_program(second, 'notrun')
+        make_program(first, 'prog')
+        make_program(second, 'prog')
+        os.environ['PATH'] = first + os.pathsep + second
+        try:
+            assert tools.find_program('prog') == os.path.join(first, 'prog')
+            # Files that can't be run are skipped, like the shell does.
+            assert tools.find_program('notrun') == os.path.join(second,
+                                                                'notrun')
+            assert tools.find_program('missing') is None
+            assert tools.find_program('') is None
+            assert tools.find_program(os.path.join(first, 'prog')) == \
+                os.path.join(first, 'prog')
+            assert tools.find_program(os.path.join(first, 'notrun')) is None
+        finally:
+            os.environ['PATH'] = saved_path
+    print('---------------')
+
+
+def test_cache():
+    print('* ToolCache, across runs')
+    saved_path = os.environ.get('PATH', '')
+    with tempfile.TemporaryDirectory() as tmpdir:
+        bindir = os.path.join(tmpdir, 'bin')
+        os.makedirs(bindir)
+        prog = make_program(bindir, 'prog')
+        config_path = os.path.join(tmpdir, 'config')
+        with open(config_path, 'w') as config:
+            config.write('\n')
+        cache_path = os.path.join(tmpdir, 'tools.pickle')
+        os.environ['PATH'] = bindir
+        try:
+            cache = tools.ToolCache(cache_path, config_path)
+            assert cache.which('prog') == prog
+            assert cache.which('other') is None
+            assert os.path.isfile(cache_path)
+
+            # A later run answers from the cache, as long as the directory
+            # looks unchanged.
+            mtime = os.stat(bindir).st_mtime_ns
+            os.remove(prog)
+            os.utime(bindir, ns=(mtime, mtime))
+            cache = tools.ToolCache(cache_path, config_path)
+            assert cache.which('prog') == prog
+
+            print('* after a program is installed')
+            make_program(bindir, 'other')
+            touch_later(bindir)
+            cache = tools.ToolCache(cache_path, config_path)
+            assert cache.which('other') == os.path.join(bindir, 'other')
+            assert cache.which('prog') is None
+
+            print('* after the config file changed')
+            mtime = os.stat(bindir).st_mtime_ns
+            make_program(bindir, 'prog')
+            os.utime(bindir, ns=(mtime, mtime))
+            assert tools.ToolCache(cache_path, config_path).which(
+                'prog') is None
+            touch_later(config_path)
+            assert tools.ToolCache(cache_path, config_path).which(
+                'prog') == prog
+
+            print('* after PATH changed')
+            os.environ['PATH'] = tmpdir
+            assert tools.ToolCache(cache_path, config_path).which(
+                'prog') is None
+        finally:
+            os.environ['PATH'] = saved_path
+    print('---------------')
+
+
+if __name__ == '__main__':
+    test_find_program()
+    test_cache()
+    print('OK')